@@ -1,23 +1,42 @@
+import os
+import argparse
 from pathlib import Path
+from contextlib import nullcontext
 from bill_parser import *
 from bill_merger.base import BillMerger
+from bill_merger.writers import TeeLedgerWriter, get_writer
+from bill_report.rollup import RollupLedgerWriter, default_rollup_path
 from intelli_classifier.classifier import classify_consume_type
 from utils.general import get_categories
+from utils.metrics import get_metrics, profile
 
 
 ROOT = Path(__file__).parent
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="合并与导入账单")
+    parser.add_argument("--import-dir", type=Path, help="批量导入目录：按内容识别账单来源，跳过已导入的文件")
+    parser.add_argument("--output", type=Path, help="账单输出路径，按后缀选择格式；批量导入默认为 data/ledger（Parquet 分区目录）")
+    parser.add_argument("--workers", type=int, help="并行解析的进程数，批量导入默认为 CPU 核数")
+    parser.add_argument("--concurrency", type=int, default=4, help="所有解析进程合计同时在途的大模型请求上限")
+    parser.add_argument("--member-from-dir", action="store_true", help="批量导入时以第一级子目录名作为成员")
+    parser.add_argument("--reconcile", action="store_true", help="跨来源对账：合并银行卡与微信/支付宝中有交易对方或时间佐证的同一笔资金")
+    parser.add_argument("--defer", action="store_true", help="只用特例规则与缓存分类，其余记录标记为待分类，由 python -m bill_merger.patch 在后台分类并回填")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
     root_path = ROOT / "data"
     
     # 初始化合并器
-    merger = BillMerger(root_path)
+    merger = BillMerger(root_path, max_concurrency=args.concurrency)
 
     # 注册解析策略
-    merger.register_parser("wechat", WeChatBillParser())
-    merger.register_parser("alipay", AlipayBillParser())
-    merger.register_parser("icbc", ICBCBillParser())
+    merger.register_parser("wechat", WeChatBillParser(defer=args.defer))
+    merger.register_parser("alipay", AlipayBillParser(defer=args.defer))
+    merger.register_parser("icbc", ICBCBillParser(defer=args.defer))
 
     # 提供文件路径
     bill_files = {
@@ -26,10 +45,35 @@ if __name__ == "__main__":
         "icbc": "icbc/hisdetail1733407445806.csv",
     }
 
-    # 合并账单
-    merged_bill = merger.merge_bills(bill_files)
+    # 设置 BILLMATE_PROFILE=cpu,memory 时启用 cProfile / tracemalloc 剖析
+    profile_mode = os.environ.get("BILLMATE_PROFILE", "")
+    profiler = profile(root_path / "profile", cpu="cpu" in profile_mode, memory="memory" in profile_mode) if profile_mode else nullcontext()
+
+    with profiler:
+        if args.import_dir:
+            # 批量导入：python app.py --import-dir ~/账单 --member-from-dir
+            output = args.output or root_path / "ledger"
+            suffix = output.suffix.lower()
+            if suffix in (".feather", ".arrow", ".xlsx"):
+                raise SystemExit("批量导入需要可追加的输出：Parquet 分区目录、.csv 或 .db")
+            writer = get_writer(output, append=True) if suffix == ".csv" else get_writer(output)
+            # 新增记录同时累加到账本旁的汇总表（data/ledger_rollups.db）
+            writer = TeeLedgerWriter(writer, RollupLedgerWriter(default_rollup_path(output)))
+            merger.import_directory(
+                args.import_dir, writer, max_workers=args.workers,
+                reconcile=args.reconcile, member_from_dir=args.member_from_dir,
+            )
+        else:
+            output = args.output or root_path / "merged_bill.xlsx"
+            # 合并账单；指定 --reconcile 时合并银行卡与微信/支付宝中重复的同一笔资金
+            merged_bill = merger.merge_bills(bill_files, max_workers=args.workers, reconcile=args.reconcile)
+
+            # 保存合并后的账单（按后缀选择输出：.xlsx / .csv / .parquet / .feather / .db）
+            # 同时重建账本旁的汇总表，供报表查询
+            merger.write_ledger(merged_bill, TeeLedgerWriter(get_writer(output), RollupLedgerWriter(default_rollup_path(output), append=False)))
 
-    # 保存合并后的账单
-    merged_bill.to_excel(root_path / "merged_bill.xlsx", index=False)
+    print(f"账单处理完成，保存到 {output}")
 
-    print(f"账单合并完成，保存到 {root_path / 'merged_bill.xlsx'}")
+    # 导出运行指标（.json 或 Prometheus 文本格式 .prom）
+    get_metrics().save(root_path / "metrics.json")
+    print(f"运行指标已保存到 {root_path / 'metrics.json'}")
@@ -0,0 +1,286 @@
+import io
+import os
+import json
+import time
+import platform
+import argparse
+import tempfile
+import multiprocessing as mp
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from benchmarks.run import BENCH_DIR, git_revision
+from benchmarks.stub_ollama import StubOllamaServer, load_responses
+
+# 标注数据的列名 -> 别名（兼容直接从合并账单中导出的样本）
+LABEL_ALIASES = {"文本": ["备注"], "类型": ["收支类型"]}
+
+METHODS = ["rule", "cache", "embedding", "llm", "fallback"]
+
+
+def load_labelled(path) -> pd.DataFrame:
+    """
+    读取标注数据（.csv 或 .jsonl）。
+
+    必需列为 文本（或 备注）、类型（或 收支类型，取值为 支出 / 收入）、分类、子分类（可为空）；
+    可选列 缓存键 为分类缓存使用的文本（通常为商户 + 商品描述），默认与 文本 相同。
+    """
+    path = Path(path)
+    if path.suffix.lower() in (".jsonl", ".json"):
+        df = pd.read_json(path, lines=path.suffix.lower() == ".jsonl", dtype=str)
+    else:
+        df = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    for column, aliases in LABEL_ALIASES.items():
+        if column not in df.columns:
+            alias = next((name for name in aliases if name in df.columns), None)
+            if alias is None:
+                raise ValueError(f"Missing column '{column}' in labelled data: {path}")
+            df = df.rename(columns={alias: column})
+    missing = [column for column in ("分类", "子分类") if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns {missing} in labelled data: {path}")
+    if "缓存键" not in df.columns:
+        df["缓存键"] = df["文本"]
+    df = df.fillna("")
+    df["缓存键"] = df["缓存键"].where(df["缓存键"] != "", df["文本"])
+    unknown = sorted(set(df["类型"]) - {"支出", "收入"})
+    if unknown:
+        raise ValueError(f"Unknown 类型 in labelled data: {unknown}")
+    return df[["文本", "类型", "分类", "子分类", "缓存键"]].reset_index(drop=True)
+
+
+def run_pass(records: List[dict], mode: str, batch_size: int) -> dict:
+    """
+    在独立的子进程中分类一遍标注数据，返回预测结果、耗时与指标。
+
+    single 模式逐条调用 classify_consume_type，batch 模式按收支类型调用 classify_consume_types。
+    """
+    from intelli_classifier.classifier import classify_consume_type, classify_consume_types
+    from utils.metrics import get_metrics
+
+    predictions: List[Optional[List[str]]] = [None] * len(records)
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        if mode == "single":
+            for i, record in enumerate(records):
+                predictions[i] = classify_consume_type(record["文本"], record["类型"], record["缓存键"])
+        else:
+            for cate in ("支出", "收入"):
+                indices = [i for i, record in enumerate(records) if record["类型"] == cate]
+                if not indices:
+                    continue
+                results = classify_consume_types(
+                    [records[i]["文本"] for i in indices], cate, [records[i]["缓存键"] for i in indices], batch_size
+                )
+                for i, result in zip(indices, results):
+                    predictions[i] = result
+    elapsed = time.perf_counter() - start
+    return {
+        "elapsed": elapsed,
+        "predictions": [list(prediction) for prediction in predictions],
+        "metrics": get_metrics().summary(),
+    }
+
+
+def run_isolated(*args) -> dict:
+    """在新的 spawn 子进程中执行 run_pass，各遍之间只通过分类缓存（SQLite）共享状态"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as executor:
+        return executor.submit(run_pass, *args).result()
+
+
+def score(labels: pd.DataFrame, predictions: List[List[str]], top: int = 10) -> dict:
+    """
+    计算分类准确率：
+
+    - level1：一级分类正确的比例；
+    - level2：一级分类正确的行中，子分类也正确的比例；
+    - path：一级分类与子分类都正确的比例；
+    - by_category：按标注的一级分类统计的行数与准确率；
+    - confusions：最常见的错误（标注路径 -> 预测路径）。
+    """
+    predicted = pd.DataFrame(
+        [(p[0] if p else "", (p[1] if len(p) > 1 else "") or "") for p in predictions],
+        columns=["预测分类", "预测子分类"],
+    )
+    df = pd.concat([labels[["类型", "分类", "子分类"]], predicted], axis=1)
+    level1 = df["分类"] == df["预测分类"]
+    path = level1 & (df["子分类"] == df["预测子分类"])
+
+    by_category = {}
+    for (cate, category), group in df.assign(level1=level1, path=path).groupby(["类型", "分类"], sort=True):
+        by_category[f"{cate}/{category}"] = {
+            "rows": len(group),
+            "level1": round(group["level1"].mean(), 4),
+            "path": round(group["path"].mean(), 4),
+        }
+
+    def join(category, subcategory):
+        return f"{category}/{subcategory}" if subcategory else category
+
+    errors = df[~path]
+    confusions = (
+        pd.DataFrame({
+            "expected": [join(c, s) for c, s in zip(errors["分类"], errors["子分类"])],
+            "predicted": [join(c, s) for c, s in zip(errors["预测分类"], errors["预测子分类"])],
+        })
+        .value_counts()
+        .head(top)
+    )
+    return {
+        "rows": len(df),
+        "level1": round(level1.mean(), 4) if len(df) else None,
+        "level2": round(path[level1].mean(), 4) if level1.any() else None,
+        "path": round(path.mean(), 4) if len(df) else None,
+        "by_category": by_category,
+        "confusions": [
+            {"expected": expected, "predicted": predicted, "rows": int(rows)}
+            for (expected, predicted), rows in confusions.items()
+        ],
+    }
+
+
+def evaluate(labels: pd.DataFrame, modes: List[str], repeat: int, latency: float, batch_size: int,
+             responses: Optional[dict] = None, upstream: Optional[str] = None, record: Optional[Path] = None) -> dict:
+    """
+    按模式在空的分类缓存上回放标注数据，第 2 遍起为缓存预热后的重复运行，返回可序列化的结果。
+    """
+    from utils.general import get_config_fingerprint
+
+    records = labels.to_dict("records")
+    passes = []
+    with StubOllamaServer(latency=latency, responses=responses, upstream=upstream) as server, \
+            tempfile.TemporaryDirectory(prefix="billmate_eval_") as tmp:
+        # 子进程通过环境变量连接模拟服务，并使用独立的分类缓存
+        os.environ["OLLAMA_HOST"] = server.url
+        os.environ["TQDM_DISABLE"] = "1"
+        for mode in modes:
+            os.environ["BILLMATE_CACHE_DIR"] = str(Path(tmp) / f"cache_{mode}")
+            for index in range(repeat):
+                before = (server.requests, server.prompt_chars, server.prompt_tokens, server.completion_tokens,
+                          server.replay_misses)
+                result = run_isolated(records, mode, batch_size)
+                requests, chars, prompt_tokens, completion_tokens, misses = (
+                    now - then for now, then in zip(
+                        (server.requests, server.prompt_chars, server.prompt_tokens, server.completion_tokens,
+                         server.replay_misses),
+                        before,
+                    )
+                )
+                rows = len(records) or 1
+                classified = result["metrics"]["classified"]
+                case = {
+                    "mode": mode,
+                    "pass": index + 1,
+                    "elapsed": round(result["elapsed"], 4),
+                    "rows_per_second": round(len(records) / result["elapsed"], 1) if result["elapsed"] else None,
+                    "accuracy": score(labels, result["predictions"]),
+                    "resolved": {method: classified.get(method, {"ratio": 0.0})["ratio"] for method in METHODS},
+                    "llm_requests": requests,
+                    "prompt_chars_per_row": round(chars / rows, 1),
+                    "prompt_tokens_per_row": round(prompt_tokens / rows, 1),
+                    "completion_tokens_per_row": round(completion_tokens / rows, 1),
+                    "replay_misses": misses if responses is not None else None,
+                }
+                passes.append(case)
+                print(format_case(case))
+        if record is not None:
+            server.save_responses(record)
+            print(f"已录制 {len(server.recorded)} 条大模型回答到 {record}")
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "config": get_config_fingerprint(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rows": len(records),
+            "latency": latency,
+            "batch_size": batch_size,
+            "model": "upstream" if upstream else "replay" if responses is not None else "stub",
+        },
+        "passes": passes,
+    }
+
+
+def format_case(case: dict) -> str:
+    accuracy = case["accuracy"]
+    resolved = " ".join(f"{method}={ratio:.0%}" for method, ratio in case["resolved"].items() if ratio)
+    return (
+        f"[{case['mode']:>6} #{case['pass']}] {accuracy['rows']:>6} 行  {case['elapsed']:8.3f}s  "
+        f"{case['rows_per_second'] or 0:>10.1f} 行/s  一级 {accuracy['level1']:.1%}  完整路径 {accuracy['path']:.1%}  "
+        f"大模型请求 {case['llm_requests']}  提示词 {case['prompt_tokens_per_row']} token/行  {resolved}"
+    )
+
+
+def print_report(results: dict):
+    """打印首遍运行的分类别准确率与常见错误"""
+    first = results["passes"][0]["accuracy"]
+    print("按一级分类的准确率（首遍）:")
+    for category, stats in first["by_category"].items():
+        print(f"  {category:<12} {stats['rows']:>6} 行  一级 {stats['level1']:.1%}  完整路径 {stats['path']:.1%}")
+    if first["confusions"]:
+        print("常见错误（标注 -> 预测）:")
+        for item in first["confusions"]:
+            print(f"  {item['expected']} -> {item['predicted']}  {item['rows']} 行")
+
+
+def compare(baseline: dict, current: dict):
+    """对比两次运行中相同用例的准确率、提示词长度与吞吐量"""
+    previous = {(case["mode"], case["pass"]): case for case in baseline["passes"]}
+    print(f"对比基线 {baseline['meta'].get('revision')} ({baseline['meta'].get('timestamp')}):")
+    for case in current["passes"]:
+        old = previous.get((case["mode"], case["pass"]))
+        if old is None:
+            continue
+        line = (
+            f"[{case['mode']:>6} #{case['pass']}]  一级 {case['accuracy']['level1'] - old['accuracy']['level1']:+.1%}"
+            f"  完整路径 {case['accuracy']['path'] - old['accuracy']['path']:+.1%}"
+        )
+        if old["prompt_tokens_per_row"]:
+            line += f"  提示词 {case['prompt_tokens_per_row'] / old['prompt_tokens_per_row'] - 1:+.1%}"
+        if old["rows_per_second"] and case["rows_per_second"]:
+            line += f"  吞吐 {case['rows_per_second'] / old['rows_per_second'] - 1:+.1%}"
+        print(line)
+
+
+def main(argv=None):
+    # python -m benchmarks.evaluate --labels benchmarks/labelled_sample.csv --mode single batch --repeat 2
+    parser = argparse.ArgumentParser(description="分类准确率与性能的回归测试")
+    parser.add_argument("--labels", type=Path, default=BENCH_DIR / "labelled_sample.csv", help="标注数据（.csv 或 .jsonl）")
+    parser.add_argument("--mode", choices=["single", "batch"], nargs="+", default=["single", "batch"])
+    parser.add_argument("--repeat", type=int, default=2, help="每种模式运行的遍数，第 2 遍起命中分类缓存")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟大模型每个请求的耗时（秒）")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--responses", type=Path, help="回放录制的大模型回答（JSONL）")
+    parser.add_argument("--upstream", help="转发到真实的 Ollama 服务（如 http://localhost:11434）")
+    parser.add_argument("--record", type=Path, help="保存转发得到的回答（JSONL），供之后 --responses 回放")
+    parser.add_argument("--output", type=Path, help="结果 JSON 路径，默认写入 benchmarks/results/")
+    parser.add_argument("--compare", type=Path, help="作为基线对比的历史结果 JSON")
+    args = parser.parse_args(argv)
+    if args.record and not args.upstream:
+        parser.error("--record requires --upstream")
+
+    labels = load_labelled(args.labels)
+    responses = load_responses(args.responses) if args.responses else None
+    results = evaluate(
+        labels, args.mode, args.repeat, args.latency, args.batch_size, responses, args.upstream, args.record
+    )
+    print_report(results)
+    output = args.output or BENCH_DIR / "results" / f"eval_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import random
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Dict
+
+# 商户与商品池：缓存键（商户+商品）的基数决定了需要请求大模型的次数
+MERCHANTS = [
+    "美团", "饿了么", "滴滴出行", "星巴克", "瑞幸咖啡", "12306", "中国石化", "超市发", "永辉超市", "盒马鲜生",
+    "沙县小吃", "肯德基", "麦当劳", "万达影城", "京东", "淘宝", "拼多多", "携程旅行", "中国移动", "国家电网",
+    "哈啰出行", "高德打车", "屈臣氏", "优衣库", "链家", "小区物业", "健身房", "医院挂号", "药房", "便利蜂",
+]
+ITEMS = ["外卖订单", "打车费用", "咖啡", "火车票", "加油", "日用品", "水果", "午餐", "晚餐", "电影票",
+         "话费充值", "电费", "衣服", "房租", "会员", "药品", "零食", "早餐", "停车费", "快递"]
+INCOME_ITEMS = ["工资", "转账", "红包", "退款", "利息"]
+
+START = datetime(2024, 1, 1)
+
+
+class BillGenerator:
+    """
+    合成账单生成器。
+
+    按各来源真实导出的格式（文件头说明行、表头、编码、倒序时间、金额格式）逐行写出，
+    内存占用与行数无关，可生成千万行级别的文件。相同的 seed 产出相同的文件。
+    """
+
+    def __init__(self, seed: int = 0, merchants: int = len(MERCHANTS), span_days: int = 365):
+        """
+        参数:
+        - seed (int): 随机种子
+        - merchants (int): 使用的商户数量，越大缓存键越分散、大模型请求越多
+        - span_days (int): 交易时间跨度（天）
+        """
+        self.seed = seed
+        self.merchants = [
+            MERCHANTS[i % len(MERCHANTS)] + (f"{i // len(MERCHANTS)}号店" if i >= len(MERCHANTS) else "")
+            for i in range(merchants)
+        ]
+        self.span_minutes = span_days * 24 * 60
+
+    def _times(self, rng: random.Random, rows: int):
+        """倒序（由近到远）的交易时间，与支付宝/微信导出的顺序一致"""
+        step = self.span_minutes / max(rows, 1)
+        minute = float(self.span_minutes)
+        for _ in range(rows):
+            minute -= rng.uniform(0, 2 * step)
+            yield START + timedelta(minutes=max(minute, 0))
+
+    def alipay(self, path, rows: int):
+        rng = random.Random(f"{self.seed}-alipay")
+        with open(path, "w", encoding="gbk", newline="\n") as f:
+            f.write("------------------------------------------------------------------------------------\n")
+            f.write("导出信息：\n姓名：测试用户\n支付宝账户：test@example.com\n")
+            f.write(f"起始时间：[{START:%Y-%m-%d %H:%M:%S}]    终止时间：[{START + timedelta(minutes=self.span_minutes):%Y-%m-%d %H:%M:%S}]\n")
+            f.write("共{}笔记录\n".format(rows))
+            f.write("------------------------支付宝支付科技有限公司  电子客户回单------------------------\n")
+            f.write("交易时间,交易分类,交易对方,对方账号,商品说明,收/付款方式,金额,收/支,交易状态,交易订单号,商家订单号,备注,\n")
+            for i, t in enumerate(self._times(rng, rows)):
+                kind = rng.choices(["支出", "收入", "不计收支"], weights=[8, 1, 1])[0]
+                merchant = rng.choice(self.merchants)
+                item = rng.choice(INCOME_ITEMS if kind == "收入" else ITEMS)
+                amount = 0 if rng.random() < 0.02 else round(rng.uniform(1, 500), 2)
+                note = "备注" if rng.random() < 0.1 else ""
+                f.write(f"{t:%Y-%m-%d %H:%M:%S},日用百货,{merchant},***,{item},余额宝,{amount},{kind},交易成功,"
+                        f"{t:%Y%m%d}{i:012d}\t,M{i}\t,{note},\n")
+
+    def wechat(self, path, rows: int):
+        rng = random.Random(f"{self.seed}-wechat")
+        with open(path, "w", encoding="utf-8-sig", newline="\n") as f:
+            f.write("微信支付账单明细,,,,,,,,\n微信昵称：[测试用户],,,,,,,,\n")
+            f.write(f"起始时间：[{START:%Y-%m-%d %H:%M:%S}] 终止时间：[{START + timedelta(minutes=self.span_minutes):%Y-%m-%d %H:%M:%S}],,,,,,,,\n")
+            f.write(f"共{rows}笔记录,,,,,,,,\n,,,,,,,,\n")
+            f.write("----------------------微信支付账单明细列表--------------------,,,,,,,,\n")
+            f.write("交易时间,交易类型,交易对方,商品,收/支,金额(元),支付方式,当前状态,交易单号,商户单号,备注\n")
+            for i, t in enumerate(self._times(rng, rows)):
+                kind = rng.choices(["支出", "收入", "/"], weights=[8, 1, 1])[0]
+                merchant = rng.choice(self.merchants)
+                item = rng.choice(INCOME_ITEMS if kind == "收入" else ITEMS)
+                amount = "¥0.00" if rng.random() < 0.02 else f"¥{rng.uniform(1, 3000):,.2f}"
+                f.write(f'{t:%Y/%m/%d %H:%M},商户消费,{merchant},"{item}",{kind},"{amount}",零钱,支付成功,'
+                        f"42{i:020d}\t,{i}\t,/\n")
+
+    def icbc(self, path, rows: int):
+        rng = random.Random(f"{self.seed}-icbc")
+        with open(path, "w", encoding="gbk", newline="\n") as f:
+            f.write("中国工商银行借记卡账户历史明细(查询)\n卡号: 6222 **** **** 0000,\n")
+            f.write(f"起止日期: {START:%Y-%m-%d} -- {START + timedelta(minutes=self.span_minutes):%Y-%m-%d},\n")
+            # 与真实导出一致：表头行末尾没有逗号，数据行末尾有逗号
+            f.write("交易日期,摘要,交易场所,交易国家或地区简称,钱币,交易金额(收入),交易金额(支出),交易币种,"
+                    "记账金额(收入),记账金额(支出),记账币种,余额,对方户名\n")
+            for t in self._times(rng, rows):
+                income = rng.random() < 0.2
+                merchant = "基金申购" if rng.random() < 0.03 else rng.choice(self.merchants)
+                amount = f"{rng.uniform(1, 5000):,.2f}"
+                summary = "转账" if income else "消费"
+                col_in, col_out = (amount, "") if income else ("", amount)
+                f.write(f'{t:%Y-%m-%d},{summary},{merchant},CHN,人民币,"{col_in}","{col_out}",人民币,'
+                        f'"{col_in}","{col_out}",人民币,"10,000.00",{merchant},\n')
+            f.write("人民币合计,,,,,,,,,,,,,\n")
+
+    def generate(self, out_dir, rows: int) -> Dict[str, Path]:
+        """
+        在 out_dir 下生成三个来源的账单，返回账单类型到文件路径的映射。
+        文件已存在时直接复用。
+        """
+        out_dir = Path(out_dir)
+        bill_files = {}
+        for bill_type, suffix in (("alipay", "csv"), ("wechat", "csv"), ("icbc", "csv")):
+            path = out_dir / f"{bill_type}_{rows}_{self.seed}_{len(self.merchants)}.{suffix}"
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                getattr(self, bill_type)(tmp, rows)
+                tmp.replace(path)
+            bill_files[bill_type] = path
+        return bill_files
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.generator --rows 100000 --out data/synthetic
+    parser = argparse.ArgumentParser(description="生成合成账单")
+    parser.add_argument("--rows", type=int, default=10_000, help="每个来源的行数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--merchants", type=int, default=len(MERCHANTS))
+    parser.add_argument("--out", type=Path, default=Path(__file__).parent / "data")
+    args = parser.parse_args()
+    for bill_type, path in BillGenerator(args.seed, args.merchants).generate(args.out, args.rows).items():
+        print(f"{bill_type}: {path}")
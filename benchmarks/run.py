@@ -0,0 +1,249 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing as mp
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from benchmarks.generator import BillGenerator, MERCHANTS
+from benchmarks.stub_ollama import StubOllamaServer
+
+BENCH_DIR = Path(__file__).parent
+STAGES = ["parse", "filter", "normalize", "classify", "merge", "write"]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """当前进程的峰值常驻内存（MB），不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+@contextmanager
+def timer(timings: Dict[str, float], name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def run_case(bill_files: Dict[str, str], mode: str, output: str, chunksize: int) -> dict:
+    """
+    在独立的子进程中执行一次导入，返回各阶段耗时与峰值内存。
+
+    memory 模式按 parse -> filter -> normalize -> classify 依次处理每个来源，再合并、写出；
+    stream 模式调用 merge_bills_stream 端到端执行，各阶段耗时取自指标注册表（各阶段交替进行）。
+    """
+    from bill_parser import AlipayBillParser, ICBCBillParser, WeChatBillParser
+    from bill_merger.base import BillMerger
+    from bill_merger.ledger import to_compact
+    from bill_merger.writers import get_writer
+    from utils.metrics import get_metrics
+
+    parsers = {"alipay": AlipayBillParser(), "wechat": WeChatBillParser(), "icbc": ICBCBillParser()}
+    merger = BillMerger(Path(output).parent)
+    for bill_type, parser in parsers.items():
+        merger.register_parser(bill_type, parser)
+
+    stages: Dict[str, float] = {}
+    sources: Dict[str, dict] = {}
+    start = time.perf_counter()
+    # 解析器的统计输出会干扰计时结果的展示
+    with redirect_stdout(io.StringIO()):
+        if mode == "stream":
+            rows = merger.merge_bills_stream(bill_files, get_writer(output), chunksize=chunksize)
+            stages = {"parse" if name == "read" else name: elapsed
+                      for name, elapsed in get_metrics().summary()["stage_seconds"].items()}
+        else:
+            frames = []
+            for bill_type, path in bill_files.items():
+                parser = merger.get_parser(bill_type)
+                timings: Dict[str, float] = {}
+                with timer(timings, "parse"):
+                    df = parser.read(path)
+                with timer(timings, "filter"):
+                    valid_rows = parser.filter_data(df)
+                with timer(timings, "normalize"):
+                    bill_df = parser.normalize(valid_rows)
+                with timer(timings, "classify"):
+                    bill_df = parser.assign_categories(bill_df, valid_rows)
+                frames.append(to_compact(bill_df))
+                sources[bill_type] = {"input_rows": len(df), "valid_rows": len(valid_rows), **timings}
+                for name, elapsed in timings.items():
+                    stages[name] = stages.get(name, 0.0) + elapsed
+            with timer(stages, "merge"):
+                merged = merger.merge_frames(frames)
+            with timer(stages, "write"):
+                rows = merger.write_ledger(merged, get_writer(output), chunksize=chunksize)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "output_rows": rows,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+        "sources": sources,
+        "metrics": get_metrics().summary(),
+    }
+
+
+def remove_output(output: str):
+    """删除输出文件（Parquet 输出为分区目录）"""
+    path = Path(output)
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def run_isolated(*args) -> dict:
+    """在新的 spawn 子进程中执行 run_case，保证各用例的峰值内存与缓存互不影响"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as executor:
+        return executor.submit(run_case, *args).result()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(sizes: List[int], modes: List[str], latency: float, merchants: int, seed: int, warm: bool,
+              output_format: str, chunksize: int, data_dir: Path) -> dict:
+    """按行数与模式逐一运行基准用例，返回可序列化的结果"""
+    generator = BillGenerator(seed=seed, merchants=merchants)
+    cases = []
+    with StubOllamaServer(latency=latency) as server, tempfile.TemporaryDirectory(prefix="billmate_bench_") as tmp:
+        # 子进程通过环境变量连接模拟服务，并使用独立的分类缓存
+        os.environ["OLLAMA_HOST"] = server.url
+        os.environ["TQDM_DISABLE"] = "1"
+        for rows in sizes:
+            bill_files = {k: str(v) for k, v in generator.generate(data_dir, rows).items()}
+            input_bytes = sum(Path(path).stat().st_size for path in bill_files.values())
+            for mode in modes:
+                cache_dir = Path(tmp) / f"cache_{rows}_{mode}"
+                os.environ["BILLMATE_CACHE_DIR"] = str(cache_dir)
+                output = str(Path(tmp) / f"ledger_{rows}_{mode}.{output_format}")
+                if warm:
+                    # 预热分类缓存，之后的计时只包含缓存命中的路径
+                    run_isolated(bill_files, mode, output, chunksize)
+                    remove_output(output)
+                requests_before = server.requests
+                result = run_isolated(bill_files, mode, output, chunksize)
+                remove_output(output)
+
+                total_rows = sum(source["input_rows"] for source in result["sources"].values()) or rows * len(bill_files)
+                case = {
+                    "rows_per_source": rows,
+                    "mode": mode,
+                    "input_rows": total_rows,
+                    "input_mb": round(input_bytes / 1024 / 1024, 2),
+                    "output_rows": result["output_rows"],
+                    "elapsed": round(result["elapsed"], 4),
+                    "rows_per_second": round(total_rows / result["elapsed"], 1),
+                    "peak_rss_mb": result["peak_rss_mb"],
+                    "llm_requests": server.requests - requests_before,
+                    "metrics": result["metrics"],
+                    "stages": {name: round(result["stages"][name], 4) for name in STAGES if name in result["stages"]},
+                    "sources": {
+                        bill_type: {key: round(value, 4) if isinstance(value, float) else value for key, value in source.items()}
+                        for bill_type, source in result["sources"].items()
+                    },
+                }
+                cases.append(case)
+                print(format_case(case))
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency": latency,
+            "merchants": merchants,
+            "seed": seed,
+            "warm_cache": warm,
+            "output_format": output_format,
+            "chunksize": chunksize,
+        },
+        "cases": cases,
+    }
+
+
+def format_case(case: dict) -> str:
+    stages = " ".join(f"{name}={elapsed:.3f}s" for name, elapsed in case["stages"].items())
+    return (
+        f"[{case['mode']:>6}] {case['input_rows']:>10} 行  {case['elapsed']:8.3f}s  "
+        f"{case['rows_per_second']:>12.1f} 行/s  峰值内存 {case['peak_rss_mb']} MB  "
+        f"大模型请求 {case['llm_requests']}  {stages}"
+    )
+
+
+def compare(baseline: dict, current: dict):
+    """对比两次运行中相同用例的吞吐量与峰值内存"""
+    previous = {(case["rows_per_source"], case["mode"]): case for case in baseline["cases"]}
+    print(f"对比基线 {baseline['meta'].get('revision')} ({baseline['meta'].get('timestamp')}):")
+    for case in current["cases"]:
+        old = previous.get((case["rows_per_source"], case["mode"]))
+        if old is None:
+            continue
+        speed = case["rows_per_second"] / old["rows_per_second"] - 1 if old["rows_per_second"] else 0.0
+        line = f"[{case['mode']:>6}] {case['input_rows']:>10} 行  吞吐 {speed:+.1%}"
+        if case["peak_rss_mb"] and old["peak_rss_mb"]:
+            line += f"  峰值内存 {case['peak_rss_mb'] / old['peak_rss_mb'] - 1:+.1%}"
+        for name, elapsed in case["stages"].items():
+            if old["stages"].get(name):
+                line += f"  {name} {elapsed / old['stages'][name] - 1:+.1%}"
+        print(line)
+
+
+def main(argv=None):
+    # python -m benchmarks.run --rows 1000 10000 100000 --latency 0.05
+    parser = argparse.ArgumentParser(description="账单导入基准测试")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000], help="每个来源的行数，可指定多个")
+    parser.add_argument("--mode", choices=["memory", "stream"], nargs="+", default=["memory"])
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟大模型每个请求的耗时（秒）")
+    parser.add_argument("--merchants", type=int, default=len(MERCHANTS), help="商户数量，决定缓存键的基数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm", action="store_true", help="预热分类缓存后再计时")
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet", "feather", "db", "xlsx"], help="账单输出格式")
+    parser.add_argument("--chunksize", type=int, default=50_000)
+    parser.add_argument("--data-dir", type=Path, default=BENCH_DIR / "data", help="合成账单的存放目录（按参数复用）")
+    parser.add_argument("--output", type=Path, help="结果 JSON 路径，默认写入 benchmarks/results/")
+    parser.add_argument("--compare", type=Path, help="作为基线对比的历史结果 JSON")
+    args = parser.parse_args(argv)
+
+    results = benchmark(
+        args.rows, args.mode, args.latency, args.merchants, args.seed, args.warm, args.format, args.chunksize, args.data_dir
+    )
+    output = args.output or BENCH_DIR / "results" / f"{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
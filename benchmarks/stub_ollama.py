@@ -0,0 +1,189 @@
+import re
+import json
+import time
+import zlib
+import hashlib
+import threading
+import urllib.request
+from pathlib import Path
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+OPTION_RE = re.compile(r"^- ([^:\n]+)", re.M)
+BATCH_ITEM_RE = re.compile(r"^\[(\d+)\] (.*)$", re.M)
+TEXT_RE = re.compile(r"文本内容：(.*)")
+CJK_RE = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的 token 数：中日韩字符与全角符号各计 1 个，其余字符每 4 个计 1 个"""
+    cjk = len(CJK_RE.findall(text))
+    return cjk + -(-(len(text) - cjk) // 4)
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+def load_responses(path) -> Dict[str, str]:
+    """读取录制的回答（JSONL，每行 {"hash", "prompt", "response"}），返回 提示词哈希 -> 回答"""
+    responses = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                responses[record["hash"]] = record["response"]
+    return responses
+
+
+def answer(prompt: str) -> str:
+    """
+    按提示词给出确定性的回答：从可选项中按文本哈希选择一个，批量提示词返回 JSON。
+    同一文本总是得到相同的分类，便于多次运行之间比较。
+    """
+    options = [option.strip() for option in OPTION_RE.findall(prompt)]
+    if not options:
+        return "其他"
+
+    def pick(text: str) -> str:
+        return options[zlib.crc32(text.encode("utf-8")) % len(options)]
+
+    items = BATCH_ITEM_RE.findall(prompt)
+    if items:
+        return json.dumps({index: pick(text) for index, text in items}, ensure_ascii=False)
+    match = TEXT_RE.search(prompt)
+    return pick(match.group(1) if match else prompt)
+
+
+class StubOllamaServer:
+    """
+    模拟 Ollama 的 /api/generate 接口，每个请求固定等待 latency 秒后返回。
+
+    运行在后台线程中，分类流程经由真实的 Ollama 客户端（含 HTTP 与连接池开销）访问，
+    子进程通过 OLLAMA_HOST 环境变量即可共享同一个服务。
+
+    除按哈希确定性回答外，还可以回放录制的回答（responses），或作为真实 Ollama 服务的代理（upstream）
+    录制每个提示词的回答，供之后离线回放。同时统计提示词的字符数与 token 数。
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        responses: Optional[Dict[str, str]] = None,
+        upstream: Optional[str] = None,
+    ):
+        """
+        参数:
+        - latency (float): 每个请求的模拟推理耗时（秒），代理模式下不额外等待
+        - host (str): 监听地址
+        - port (int): 监听端口，0 表示随机分配
+        - responses (dict | None): 回放的回答（提示词哈希 -> 回答），未录制的提示词按哈希确定性回答并计入 replay_misses
+        - upstream (str | None): 真实 Ollama 服务地址，设置后转发请求并录制回答
+        """
+        self.latency = latency
+        self.responses = responses
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.requests = 0
+        self.replay_misses = 0
+        self.prompt_chars = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.recorded: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                payload = stub.generate(body)
+                data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def generate(self, body: dict) -> dict:
+        """回答一个 /api/generate 请求，并累计请求数与 token 数"""
+        prompt = body.get("prompt", "")
+        key = prompt_hash(prompt)
+        if self.upstream:
+            request = urllib.request.Request(
+                f"{self.upstream}/api/generate",
+                data=json.dumps({**body, "stream": False}, ensure_ascii=False).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+            )
+            with urllib.request.urlopen(request) as response:
+                payload = json.loads(response.read())
+            prompt_tokens = payload.get("prompt_eval_count") or estimate_tokens(prompt)
+            completion_tokens = payload.get("eval_count") or estimate_tokens(payload.get("response", ""))
+        else:
+            time.sleep(self.latency)
+            text = self.responses.get(key) if self.responses is not None else None
+            if text is None:
+                if self.responses is not None:
+                    with self._lock:
+                        self.replay_misses += 1
+                text = answer(prompt)
+            payload = {
+                "model": body.get("model", ""),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "response": text,
+                "done": True,
+                "done_reason": "stop",
+            }
+            prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        with self._lock:
+            self.requests += 1
+            self.prompt_chars += len(prompt)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if self.upstream:
+                self.recorded[key] = {"hash": key, "prompt": prompt, "response": payload.get("response", "")}
+        return payload
+
+    def save_responses(self, path):
+        """保存代理模式下录制的回答（JSONL），可通过 load_responses 读取后回放"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(path, "w", encoding="utf-8") as f:
+            for record in self.recorded.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def start(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
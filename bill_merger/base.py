@@ -1,45 +1,403 @@
 import os
+import time
+import numpy as np
 import pandas as pd
-from typing import Dict
+import multiprocessing as mp
+from typing import Dict, Literal, Optional, Tuple, Union
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
+import bill_parser
 from bill_parser.base import BillParserStrategy
+from bill_merger.reconcile import reconcile as reconcile_sources
+from bill_merger.incremental import ImportState, IngestLog, RowFingerprinter, file_hash
+from bill_merger.ledger import COLUMNS, concat_ledgers, conform_columns, to_compact, to_export
+from bill_merger.sorting import ExternalMerger, kway_merge, time_key
+from bill_merger.writers import LedgerWriter
+from intelli_classifier.deferred import PENDING_CATEGORY, get_deferred_queue
+from utils.metrics import get_metrics
+
+def parse_source(
+    parser: BillParserStrategy, file_path, collect_metrics: bool = False, max_concurrency: Optional[int] = None
+) -> Tuple[pd.DataFrame, float, Optional[dict]]:
+    """
+    解析单个来源的账单，返回紧凑表示的账单（见 bill_merger.ledger）、耗时（秒）与指标快照，可在子进程中执行。
+
+    collect_metrics 为 True 时（子进程中）只统计本次解析的指标并返回快照，由主进程汇总。
+    max_concurrency 为本次解析分到的大模型并发数，覆盖解析器自身的设置（子进程中的解析器是副本，不影响主进程）。
+    """
+    if max_concurrency is not None:
+        parser.max_concurrency = max_concurrency
+    metrics = get_metrics()
+    if collect_metrics:
+        metrics.reset()
+    start = time.perf_counter()
+    bill_df = to_compact(parser.parse(file_path))
+    elapsed = time.perf_counter() - start
+    metrics.observe("source_seconds", elapsed, source=parser.title)
+    return bill_df, elapsed, metrics.snapshot() if collect_metrics else None
 
 
 # 上下文类：账单合并器
 class BillMerger:
-    def __init__(self, root_path):
+    def __init__(self, root_path, max_concurrency: int = 4):
+        """
+        参数:
+            - root_path: 账单文件的根目录
+            - max_concurrency: 多进程解析时所有进程合计同时在途的大模型请求上限，按进程数平均分配
+        """
         self.root_path = Path(root_path)
+        self.max_concurrency = max_concurrency
         self.parsers: Dict[str, BillParserStrategy] = {}
+        self.orders: Dict[str, Optional[str]] = {}
+        # 最近一次合并中各来源的解析耗时（秒）
+        self.timings: Dict[str, float] = {}
+
+    def register_parser(self, bill_type, parser: BillParserStrategy, order: Optional[Literal["asc", "desc"]] = None):
+        """
+        注册账单解析策略
 
-    def register_parser(self, bill_type, parser: BillParserStrategy):
-        """注册账单解析策略"""
+        参数:
+            - bill_type: 账单类型
+            - parser: 解析策略
+            - order: 该来源导出文件的时间顺序，默认使用解析器声明的 sort_order，均未声明时自动检测
+        """
         self.parsers[bill_type] = parser
+        self.orders[bill_type] = order or parser.sort_order
+
+    def get_parser(self, bill_type) -> BillParserStrategy:
+        """获取已注册的账单解析策略，未注册时从解析器注册表中按需加载并注册"""
+        parser = self.parsers.get(bill_type)
+        if not parser:
+            try:
+                parser_class = bill_parser.get_parser_class(bill_type)
+            except ValueError:
+                raise ValueError(f"No parser registered for bill type: {bill_type}") from None
+            parser = parser_class()
+            self.register_parser(bill_type, parser)
+        return parser
+
+    def merge_bills(self, bill_files: dict, max_workers: Optional[int] = None, reconcile: bool = False):
+        """
+        合并账单
+
+        参数:
+            - bill_files: 账单类型到文件路径（相对 root_path）的映射
+            - max_workers: 并行解析的进程数，每个来源在独立进程中解析；None 或 1 时依次解析
+            - reconcile: 是否跨来源对账，合并银行卡与支付渠道中重复的同一笔资金（见 bill_merger.reconcile）
+
+        返回:
+            - pd.DataFrame: 紧凑表示的账单（账单时间为 datetime64、金额为分、账户等为 category），
+              可直接交给 write_ledger 写出，或用 bill_merger.ledger.to_export 转换为导出格式
+        """
+        results: Dict[str, pd.DataFrame] = {}
+        self.timings = {}
+        jobs = {bill_type: (bill_type, self.root_path / file_path) for bill_type, file_path in bill_files.items()}
+        for bill_type, bill_df, elapsed in self._parse_sources(jobs, max_workers):
+            results[bill_type] = bill_df
+            self.timings[bill_type] = elapsed
+            print(f"{bill_type} 账单解析完成: {len(bill_df)} 条记录, 耗时 {elapsed:.2f}s")
+
+        # 按来源的登记顺序拼接，保证结果与完成顺序无关
+        merged_df = self.merge_frames([results[bill_type] for bill_type in bill_files])
+        if reconcile:
+            with get_metrics().timer("stage_seconds", stage="reconcile", source="all"):
+                merged_df = reconcile_sources(merged_df)
+            print(f"对账后的账单总记录数: {len(merged_df)}")
+        return merged_df
+
+    def _parse_sources(self, jobs: dict, max_workers: Optional[int] = None, raise_errors: bool = True):
+        """
+        解析多个账单文件，按完成顺序产出 (键, 数据, 耗时)。
+
+        参数:
+            - jobs: 任意键到 (账单类型, 文件路径) 的映射
+            - max_workers: 并行解析的进程数，每个文件在独立进程中解析；None 或 1 时依次解析。
+              需要实时分类时进程数不超过 max_concurrency，各进程分得 max_concurrency // 进程数 的大模型并发
+            - raise_errors: 解析出错时是否抛出异常；为 False 时跳过该文件并计入 import_errors_total 指标
+        """
+        metrics = get_metrics()
+
+        def failed(key, error):
+            if raise_errors:
+                raise error
+            metrics.inc("import_errors_total", source=jobs[key][0])
+            print(f"账单解析失败，已跳过: {jobs[key][1]} ({error})")
+
+        if max_workers and max_workers > 1 and len(jobs) > 1:
+            # spawn 方式启动子进程，避免继承父进程中的数据库连接与模型客户端
+            workers = min(max_workers, len(jobs))
+            # 每个进程各自请求大模型：需要实时分类时进程数不超过并发上限，上限按进程数平均分配
+            if not all(self.get_parser(bill_type).defer for bill_type, _ in jobs.values()):
+                workers = min(workers, self.max_concurrency)
+            concurrency = max(1, self.max_concurrency // workers)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as executor:
+                futures = {
+                    executor.submit(parse_source, self.get_parser(bill_type), path, True, concurrency): key
+                    for key, (bill_type, path) in jobs.items()
+                }
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        bill_df, elapsed, snapshot = future.result()
+                    except Exception as e:
+                        failed(key, e)
+                        continue
+                    metrics.merge(snapshot)
+                    yield key, bill_df, elapsed
+        else:
+            for key, (bill_type, path) in jobs.items():
+                try:
+                    bill_df, elapsed, _ = parse_source(self.get_parser(bill_type), path)
+                except Exception as e:
+                    failed(key, e)
+                    continue
+                yield key, bill_df, elapsed
+
+    def import_directory(
+        self,
+        directory,
+        writer: LedgerWriter,
+        pattern: Union[str, Tuple[str, ...]] = ("*.csv", "*.pdf"),
+        log_path=None,
+        max_workers: Optional[int] = None,
+        reconcile: bool = False,
+        member_from_dir: bool = False,
+    ) -> int:
+        """
+        批量导入目录（含子目录）中的账单：按文件内容识别来源，跳过已导入的文件，多进程并行解析后按时间排序追加到输出。
+
+        参数:
+            - directory: 账单目录
+            - writer: 账单输出，应以追加方式写入（如 Parquet 分区目录或 CsvLedgerWriter(path, append=True)）
+            - pattern: 文件名匹配模式，可为多个
+            - log_path: 导入记录文件路径，默认为 root_path / "ingested.json"
+            - max_workers: 并行解析的进程数，默认为 CPU 核数
+            - reconcile: 是否跨来源对账
+            - member_from_dir: 是否以第一级子目录名填充 成员 列（如按家庭成员分目录存放）
+
+        返回:
+            - 新增的记录数
+        """
+        directory = Path(directory)
+        log = IngestLog(log_path or self.root_path / "ingested.json")
+        patterns = (pattern,) if isinstance(pattern, str) else pattern
+        paths = [
+            path for path in sorted({path for p in patterns for path in directory.rglob(p)})
+            if path.is_file() and not path.name.startswith((".", "~$"))
+        ]
+
+        def inspect(path):
+            return path, file_hash(path), bill_parser.detect_bill_type(path)
+
+        # 计算哈希与识别来源以 I/O 为主，使用线程池
+        jobs = {}
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4)) as executor:
+            for path, digest, bill_type in executor.map(inspect, paths):
+                if digest in log or digest in jobs:
+                    print(f"账单文件已导入，跳过: {path}")
+                    continue
+                if bill_type is None:
+                    get_metrics().inc("unrecognized_files_total")
+                    print(f"无法识别账单来源，跳过: {path}")
+                    continue
+                jobs[digest] = (bill_type, path)
+
+        if not jobs:
+            print("没有需要导入的账单文件")
+            return 0
+        print(f"发现 {len(jobs)} 个待导入的账单文件")
+
+        results = {}
+        for digest, bill_df, elapsed in self._parse_sources(jobs, max_workers or os.cpu_count(), raise_errors=False):
+            bill_type, path = jobs[digest]
+            if member_from_dir and len(path.relative_to(directory).parts) > 1:
+                bill_df["成员"] = path.relative_to(directory).parts[0]
+            results[digest] = bill_df
+            print(f"{path} ({bill_type}) 解析完成: {len(bill_df)} 条记录, 耗时 {elapsed:.2f}s")
+        if not results:
+            return 0
+
+        # 按文件路径顺序拼接，保证结果与完成顺序无关
+        merged_df = self.merge_frames([results[digest] for digest in jobs if digest in results])
+        if reconcile:
+            with get_metrics().timer("stage_seconds", stage="reconcile", source="all"):
+                merged_df = reconcile_sources(merged_df)
+        rows = self.write_ledger(merged_df, writer)
 
-    def merge_bills(self, bill_files: dict):
-        """合并账单"""
-        columns = ["账单时间", "类型", "分类", "子分类", "金额", "账本", "账户1", "账户2", "备注", "账单图片", "报销", "优惠", "标签", "成员"]
-        
-        wait_merge_data = []
-        for bill_type, file_path in bill_files.items():
-            # 获取解析策略
-            parser = self.parsers.get(bill_type)
-            if not parser:
-                raise ValueError(f"No parser registered for bill type: {bill_type}")
-            bill_df = parser.parse(self.root_path / file_path)
-            # 确保所有列都存在,不存在的列填充空值
-            for col in columns:
-                if col not in bill_df.columns:
-                    bill_df[col] = None
-            # 只保留指定的列
-            bill_df = bill_df[columns]
-            wait_merge_data.append(bill_df)
-        
-        if not wait_merge_data:
+        # 写入成功后再登记为已导入
+        for digest, bill_df in results.items():
+            bill_type, path = jobs[digest]
+            log.add(digest, path, bill_type, len(bill_df))
+        log.save()
+        print(f"新增账单记录数: {rows}")
+        return rows
+
+    @staticmethod
+    def merge_frames(frames) -> pd.DataFrame:
+        """
+        按账单时间升序合并各来源已解析的账单，返回紧凑表示的账单。
+
+        各来源本身有序（或在内部排序）后做 k 路归并（见 sorting.kway_merge），同一时间的记录保持来源与文件中的先后顺序。
+        """
+        if not frames:
             raise ValueError("No data to merge")
-        
-        merged_df = pd.concat(wait_merge_data, ignore_index=True)
-        # 按账单时间升序排序
-        merged_df = merged_df.sort_values(by="账单时间", ascending=True)
+
+        with get_metrics().timer("stage_seconds", stage="merge", source="all"):
+            merged_df = concat_ledgers(frames)
+            # datetime64 按整数比较，缺失的时间排在最后
+            times = merged_df["账单时间"]
+            keys = np.where(times.isna(), np.iinfo(np.int64).max, times.to_numpy().view(np.int64))
+            bounds = np.cumsum([len(frame) for frame in frames])[:-1]
+            merged_df = merged_df.take(kway_merge(np.split(keys, bounds))).reset_index(drop=True)
         print(f"合并后的账单总记录数: {len(merged_df)}")
         return merged_df
+
+    def write_ledger(self, bill_df: pd.DataFrame, writer: LedgerWriter, chunksize: int = 50_000) -> int:
+        """将合并后的账单按块写入输出，返回写入的记录数；紧凑表示的账单逐块转换为导出格式"""
+        with get_metrics().timer("stage_seconds", stage="write", source="all"), writer:
+            for start in range(0, len(bill_df), chunksize):
+                writer.write(to_export(bill_df.iloc[start:start + chunksize]))
+        self._track_pending(writer, [self._pending(bill_df)])
+        return writer.rows
+
+    @staticmethod
+    def _pending(bill_df: pd.DataFrame) -> pd.DataFrame:
+        """延后分类的待分类记录（导出表示，附带 对方 列作为分类缓存键）"""
+        if "对方" not in bill_df.columns:
+            return bill_df.iloc[:0]
+        pending = bill_df[(bill_df["分类"] == PENDING_CATEGORY).to_numpy()]
+        if pending.empty:
+            return pending
+        return to_export(pending).assign(对方=pending["对方"].to_numpy(dtype=object))
+
+    def _collect_pending(self, chunks, pending: list):
+        """逐块产出统一列结构的账单，同时收集其中待分类的记录"""
+        for bill_df in chunks:
+            pending.append(self._pending(bill_df))
+            yield conform_columns(bill_df)
+
+    @staticmethod
+    def _track_pending(writer: LedgerWriter, frames):
+        """
+        账本写入成功后再记录其中待分类的行，供后台分类完成后回填（见 bill_merger.patch）。
+        被对账合并、写入失败或输出格式不支持回填的记录不会进入队列。
+        """
+        frames = [frame for frame in frames if len(frame)]
+        if not frames or not writer.patchable:
+            return
+        pending = pd.concat(frames, ignore_index=True)
+        get_deferred_queue().track(pending, pending["对方"])
+
+    @staticmethod
+    def _write(writer: LedgerWriter, bill_df: pd.DataFrame):
+        """写入一块数据并记录耗时"""
+        with get_metrics().timer("stage_seconds", stage="write", source="all"):
+            writer.write(bill_df)
+
+    def merge_bills_stream(self, bill_files: dict, writer: LedgerWriter, chunksize: int = 50_000, sort: bool = True, memory_budget: int = 500_000) -> int:
+        """
+        流式合并账单：逐个来源按块解析，每块规范化后写入输出，不在内存中保留完整账单。
+
+        参数:
+            - bill_files: 账单类型到文件路径（相对 root_path）的映射
+            - writer: 账单输出
+            - chunksize: 每块读取的行数
+            - sort: 是否按账单时间升序输出；为 False 时按来源依次输出
+            - memory_budget: 排序时内存中最多缓存的行数，超出后溢写到临时文件
+
+        返回:
+            - 写入的总记录数
+        """
+        pending = []
+        with writer:
+            if not sort:
+                for bill_type, file_path in bill_files.items():
+                    parser = self.get_parser(bill_type)
+                    chunks = parser.iter_chunks(self.root_path / file_path, chunksize=chunksize)
+                    for bill_df in self._collect_pending(chunks, pending):
+                        self._write(writer, bill_df)
+            else:
+                # 各来源的导出本身按时间有序，按段做 k 路归并
+                with ExternalMerger(memory_budget=memory_budget, chunksize=chunksize) as merger:
+                    for bill_type, file_path in bill_files.items():
+                        parser = self.get_parser(bill_type)
+                        chunks = parser.iter_chunks(self.root_path / file_path, chunksize=chunksize)
+                        merger.add_source(self._collect_pending(chunks, pending), order=self.orders[bill_type])
+                    for bill_df in get_metrics().timed_iter(merger.merge(), "stage_seconds", stage="merge", source="all"):
+                        self._write(writer, bill_df)
+        self._track_pending(writer, pending)
+        print(f"合并后的账单总记录数: {writer.rows}")
+        return writer.rows
+
+    def _iter_new_chunks(self, parser: BillParserStrategy, file_path, bill_type, state: ImportState, seen: dict, chunksize: int):
+        """逐块产出尚未导入的行（仅对这些行分类），并记录水位线窗口内的行指纹"""
+        fingerprint = RowFingerprinter()
+        known = list(state.fingerprints(bill_type))
+        start = state.window_start(bill_type)
+        for df in parser.read(file_path, chunksize=chunksize):
+            if df.empty:
+                continue
+            valid_rows = parser.filter_data(df)
+            if valid_rows.empty:
+                continue
+            bill_df = parser.normalize(valid_rows)
+            fingerprints = fingerprint(bill_df)
+            times = time_key(bill_df["账单时间"])
+
+            is_new = ~fingerprints.isin(known)
+            if start is not None:
+                is_new &= times >= start
+
+            # 只保留最新时间一个窗口内的指纹
+            seen.update(zip(fingerprints, times))
+            latest = max(seen.values())
+            for fp in [fp for fp, t in seen.items() if t < latest - state.window]:
+                del seen[fp]
+
+            if is_new.any():
+                yield parser.assign_categories(bill_df[is_new], valid_rows[is_new])
+
+    def merge_incremental(self, bill_files: dict, writer: LedgerWriter, state_path=None, chunksize: int = 50_000) -> int:
+        """
+        增量合并账单：只解析并分类上次导入之后新增的行，按时间排序后追加到已有账单。
+
+        每个来源记录水位线（最后交易时间）、文件内容哈希以及窗口内的行指纹：内容未变化的文件直接跳过，
+        早于水位线窗口的行视为已导入，窗口内的行通过指纹去重。
+
+        参数:
+            - bill_files: 账单类型到文件路径（相对 root_path）的映射
+            - writer: 账单输出，应以追加方式打开（如 CsvLedgerWriter(path, append=True)）
+            - state_path: 导入状态文件路径，默认为 root_path / "import_state.json"
+            - chunksize: 每块读取的行数
+
+        返回:
+            - 新增的记录数
+        """
+        state = ImportState(state_path or self.root_path / "import_state.json")
+        updates = {}
+        pending = []
+        with ExternalMerger(chunksize=chunksize) as merger:
+            for bill_type, file_path in bill_files.items():
+                path = self.root_path / file_path
+                digest = file_hash(path)
+                if state.is_unchanged(bill_type, digest):
+                    print(f"账单文件未变化，跳过: {path}")
+                    continue
+                parser = self.get_parser(bill_type)
+                seen = {}
+                chunks = self._iter_new_chunks(parser, path, bill_type, state, seen, chunksize)
+                merger.add_source(self._collect_pending(chunks, pending), order=self.orders[bill_type])
+                updates[bill_type] = (digest, seen)
+
+            with writer:
+                for bill_df in get_metrics().timed_iter(merger.merge(), "stage_seconds", stage="merge", source="all"):
+                    self._write(writer, bill_df)
+        self._track_pending(writer, pending)
+
+        # 写入成功后再推进水位线
+        for bill_type, (digest, seen) in updates.items():
+            state.update(bill_type, digest, seen)
+        state.save()
+        print(f"新增账单记录数: {writer.rows}")
+        return writer.rows
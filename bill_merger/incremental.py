@@ -0,0 +1,147 @@
+import json
+import hashlib
+import pandas as pd
+from pathlib import Path
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from bill_merger.ledger import to_fen
+
+# 行指纹的计算方式变化时递增，旧状态文件中的指纹不再参与比对
+FINGERPRINT_VERSION = 2
+
+
+def file_hash(file_path, block_size: int = 1 << 20) -> str:
+    """计算文件内容的 SHA-256"""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class RowFingerprinter:
+    """
+    账单行指纹。
+
+    指纹由规范化后的 账单时间、金额（分）、备注 与 账户1 的哈希，以及该内容在文件中的出现序号组成，
+    完全相同的两行（如同一分钟内两笔相同的消费）也能得到不同的指纹；跨块调用时出现序号保持累计。
+
+    不使用原始行：按块读取时各块的列类型分别推断，同一行在不同的块中会转换为不同的字符串
+    （如收入 / 支出这类半空的列，与空值同块时 3 会读作 3.0）。
+    """
+
+    def __init__(self):
+        self._occurrences = Counter()
+
+    def __call__(self, bill_df: pd.DataFrame) -> pd.Series:
+        """bill_df 为解析器规范化后的账单（账单时间为字符串，金额为元）"""
+        keys = pd.DataFrame({
+            "账单时间": bill_df["账单时间"].astype(str).to_numpy(),
+            "金额_分": to_fen(bill_df["金额"]),
+            "备注": bill_df["备注"].fillna("").astype(str).to_numpy(),
+            "账户1": bill_df["账户1"].astype(str).to_numpy(),
+        }, index=bill_df.index)
+        hashes = pd.util.hash_pandas_object(keys, index=False).map("{:016x}".format)
+        occurrence = hashes.groupby(hashes).cumcount() + hashes.map(self._occurrences).fillna(0).astype(int)
+        self._occurrences.update(hashes.tolist())
+        return hashes + "-" + occurrence.astype(str)
+
+
+class ImportState:
+    """
+    增量导入状态，按来源记录：
+    - watermark: 已导入的最后交易时间
+    - file_hash: 上次导入的文件内容哈希，未变化的文件直接跳过
+    - fingerprints: 水位线之前一个时间窗口内已导入行的指纹及其交易时间，用于识别补记或重叠导出的行
+    """
+
+    def __init__(self, path, window: timedelta = timedelta(days=3)):
+        self.path = Path(path)
+        self.window = window
+        self.sources: Dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.sources = json.load(f)
+
+    def watermark(self, source: str) -> Optional[datetime]:
+        state = self.sources.get(source)
+        return datetime.fromisoformat(state["watermark"]) if state and state.get("watermark") else None
+
+    def _current(self, source: str) -> bool:
+        """状态中的指纹是否由当前版本的 RowFingerprinter 计算"""
+        return self.sources.get(source, {}).get("fingerprint_version") == FINGERPRINT_VERSION
+
+    def window_start(self, source: str) -> Optional[datetime]:
+        """
+        需要与已导入指纹比对的最早交易时间，之前的行一律视为已导入。
+
+        旧版本的指纹无法比对，此时水位线所在分钟及之前的行都视为已导入。
+        """
+        watermark = self.watermark(source)
+        if watermark is None:
+            return None
+        return watermark - self.window if self._current(source) else watermark + timedelta(minutes=1)
+
+    def fingerprints(self, source: str) -> Dict[str, str]:
+        return self.sources.get(source, {}).get("fingerprints", {}) if self._current(source) else {}
+
+    def is_unchanged(self, source: str, digest: str) -> bool:
+        return self.sources.get(source, {}).get("file_hash") == digest
+
+    def update(self, source: str, digest: str, fingerprints: Dict[str, datetime]):
+        """
+        合并本次导入的行指纹并推进水位线。
+
+        参数:
+            - source: 来源名称
+            - digest: 本次导入文件的内容哈希
+            - fingerprints: 本次导入（含已存在）行的指纹到交易时间的映射
+        """
+        known = {fp: datetime.fromisoformat(t) for fp, t in self.fingerprints(source).items()}
+        known.update(fingerprints)
+        watermark = max([*known.values(), *filter(None, [self.watermark(source)])], default=None)
+        start = watermark - self.window if watermark else None
+        self.sources[source] = {
+            "watermark": watermark.isoformat() if watermark else None,
+            "file_hash": digest,
+            "fingerprint_version": FINGERPRINT_VERSION,
+            "fingerprints": {fp: t.isoformat() for fp, t in known.items() if start is None or t >= start},
+        }
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.sources, f, ensure_ascii=False, indent=2)
+
+
+class IngestLog:
+    """
+    批量导入记录：已导入文件的内容哈希及其来源信息。
+
+    以内容而非路径判断是否已导入，重命名、移动或重复放入的同一份导出文件都不会被再次导入。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.files: Dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.files = json.load(f)
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.files
+
+    def add(self, digest: str, file_path, bill_type: str, rows: int):
+        self.files[digest] = {
+            "path": str(file_path),
+            "bill_type": bill_type,
+            "rows": rows,
+            "imported_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.files, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+from typing import Iterable, List
+
+# 合并后账单的列（导出顺序）
+COLUMNS = ["账单时间", "类型", "分类", "子分类", "金额", "账本", "账户1", "账户2", "备注", "账单图片", "报销", "优惠", "标签", "成员"]
+
+# 取值重复度高的列，在紧凑表示中使用 category 类型
+CATEGORICAL_COLUMNS = ["类型", "分类", "子分类", "账本", "账户1", "账户2"]
+
+# 通常为空的可选列，紧凑表示中只有存在非空值时才保留
+OPTIONAL_COLUMNS = ["账单图片", "报销", "优惠", "标签", "成员"]
+
+# 解析器附带的辅助列（交易对方与商户文本），只在紧凑表示中保留供对账核对，不导出
+AUXILIARY_COLUMNS = ["对方"]
+
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def conform_columns(bill_df: pd.DataFrame) -> pd.DataFrame:
+    """补齐缺失列（填充空值）并只保留指定的列"""
+    missing = {col: None for col in COLUMNS if col not in bill_df.columns}
+    return (bill_df.assign(**missing) if missing else bill_df)[COLUMNS]
+
+
+def is_compact(bill_df: pd.DataFrame) -> bool:
+    """账单是否为紧凑表示（账单时间为 datetime64）"""
+    return pd.api.types.is_datetime64_any_dtype(bill_df["账单时间"])
+
+
+def to_fen(amount: pd.Series) -> np.ndarray:
+    """金额（元）转换为整数分"""
+    return np.rint(amount.astype(float).to_numpy() * 100).astype("int64")
+
+
+def amount_fen(bill_df: pd.DataFrame) -> np.ndarray:
+    """账单的金额（分），兼容两种表示"""
+    if is_compact(bill_df):
+        return bill_df["金额"].to_numpy(dtype="int64")
+    return to_fen(bill_df["金额"])
+
+
+def to_compact(bill_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    转换为紧凑的账单表示：
+
+    - 账单时间为 datetime64，排序与按日 / 月分组无需解析字符串；
+    - 金额为 int64 的分，求和没有浮点误差；
+    - 类型、分类、子分类、账本、账户列为 category，每行只保存一个整数编码；
+    - 全部为空的可选列（账单图片、报销等）不保留，导出时再补齐；
+    - 辅助列（对方）保留为 category，导出时去除。
+
+    参数:
+        - bill_df: 解析器输出或 conform_columns 后的账单（账单时间为 "%Y-%m-%d %H:%M" 字符串，金额为元）
+
+    返回:
+        - pd.DataFrame: 紧凑表示的账单，已是紧凑表示时原样返回
+    """
+    if is_compact(bill_df):
+        return bill_df
+    data = {}
+    for col in [*COLUMNS, *AUXILIARY_COLUMNS]:
+        if col not in bill_df.columns:
+            continue
+        if col == "账单时间":
+            data[col] = pd.to_datetime(bill_df[col], format=TIME_FORMAT)
+        elif col == "金额":
+            data[col] = pd.Series(to_fen(bill_df[col]), index=bill_df.index)
+        elif col in CATEGORICAL_COLUMNS or col in AUXILIARY_COLUMNS:
+            data[col] = bill_df[col].astype("category")
+        elif col not in OPTIONAL_COLUMNS or bill_df[col].notna().any():
+            data[col] = bill_df[col]
+    return pd.DataFrame(data, index=bill_df.index)
+
+
+def to_export(bill_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    转换为导出使用的表示：列齐全且按 COLUMNS 排列，账单时间为字符串，金额为元，空值为 None。
+
+    已是导出表示的账单只补齐列。
+    """
+    if not is_compact(bill_df):
+        return conform_columns(bill_df)
+    data = {}
+    for col in COLUMNS:
+        if col not in bill_df.columns:
+            data[col] = None
+        elif col == "账单时间":
+            data[col] = bill_df[col].dt.strftime(TIME_FORMAT)
+        elif col == "金额":
+            data[col] = bill_df[col] / 100
+        else:
+            values = bill_df[col].astype(object)
+            data[col] = values.where(values.notna(), None)
+    return pd.DataFrame(data, index=bill_df.index)
+
+
+def concat_ledgers(frames: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    拼接多个紧凑表示的账单。
+
+    各分块的 category 列先统一为相同的类别集合，否则 pd.concat 会退化为 object 列。
+    """
+    frames: List[pd.DataFrame] = [to_compact(frame) for frame in frames]
+    for col in [*CATEGORICAL_COLUMNS, *AUXILIARY_COLUMNS]:
+        parts = [frame[col] for frame in frames if col in frame.columns]
+        if len(parts) < 2:
+            continue
+        categories = parts[0].cat.categories
+        for part in parts[1:]:
+            categories = categories.union(part.cat.categories, sort=False)
+        frames = [
+            frame.assign(**{col: frame[col].cat.set_categories(categories)}) if col in frame.columns else frame
+            for frame in frames
+        ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def ensure_categories(bill_df: pd.DataFrame, col: str, values: Iterable):
+    """为 category 列补充将要写入的取值（原地修改），非 category 列不做处理"""
+    if col in bill_df.columns and isinstance(bill_df[col].dtype, pd.CategoricalDtype):
+        missing = pd.Index(pd.unique(np.asarray(list(values), dtype=object))).difference(bill_df[col].cat.categories)
+        missing = [value for value in missing if pd.notna(value)]
+        if missing:
+            bill_df[col] = bill_df[col].cat.add_categories(missing)
@@ -0,0 +1,177 @@
+import os
+import time
+import uuid
+import sqlite3
+import argparse
+import pandas as pd
+from pathlib import Path
+from contextlib import ExitStack
+from typing import List, Optional, Tuple
+
+from bill_merger.ledger import to_fen
+from bill_merger.writers import arrow_schema, import_pyarrow, ledger_lock
+from intelli_classifier.deferred import PENDING_CATEGORY, DeferredQueue, drain, get_deferred_queue
+from utils.metrics import get_metrics
+
+# 回填时匹配账本记录的列
+MATCH_COLUMNS = ["账单时间", "金额_分", "备注"]
+
+
+def _apply(bill_df: pd.DataFrame, resolutions: pd.DataFrame) -> Tuple[pd.DataFrame, List[int]]:
+    """
+    将分类结果回填到待分类的记录，返回回填后的账单与已回填的队列行号。
+
+    按 账单时间、金额、备注 匹配（对账可能改写 账户1，不参与匹配），只修改分类仍为待分类的记录。
+    """
+    pending = bill_df["分类"] == PENDING_CATEGORY
+    if not pending.any():
+        return bill_df, []
+    keys = pd.DataFrame({
+        "账单时间": bill_df.loc[pending, "账单时间"].astype(str).to_numpy(),
+        "金额_分": to_fen(bill_df.loc[pending, "金额"]),
+        "备注": bill_df.loc[pending, "备注"].fillna("").astype(str).to_numpy(),
+    }, index=bill_df.index[pending])
+    resolutions = resolutions.assign(备注=resolutions["备注"].fillna("")).drop_duplicates(MATCH_COLUMNS)
+    matched = keys.reset_index().merge(resolutions, on=MATCH_COLUMNS).set_index("index")
+    if matched.empty:
+        return bill_df, []
+    bill_df = bill_df.copy()
+    bill_df.loc[matched.index, "分类"] = matched["分类"]
+    bill_df.loc[matched.index, "子分类"] = matched["子分类"]
+    return bill_df, matched["rowid"].tolist()
+
+
+def _patch_parquet(path: Path, resolutions: pd.DataFrame) -> Tuple[List[int], List[str]]:
+    """只重写包含待回填记录的月份分区"""
+    pa = import_pyarrow()
+    patched, months = [], []
+    for month in sorted(resolutions["账单时间"].str[:7].unique()):
+        directory = path / f"月份={month}"
+        files = sorted(directory.glob("*.parquet")) if directory.is_dir() else []
+        if not files:
+            continue
+        bill_df, rowids = _apply(pd.read_parquet(directory), resolutions)
+        if not rowids:
+            continue
+        # 新文件以 . 开头写入（读取数据集时会被忽略），删除旧文件后再改名
+        target = directory / f"part-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp = directory / f".{target.name}"
+        table = pa.Table.from_pandas(bill_df, schema=arrow_schema(pa, bill_df.columns), preserve_index=False)
+        pa.parquet.write_table(table, tmp, compression="zstd")
+        for file in files:
+            file.unlink()
+        tmp.replace(target)
+        patched += rowids
+        months.append(month)
+    return patched, months
+
+
+def _patch_csv(path: Path, resolutions: pd.DataFrame) -> Tuple[List[int], List[str]]:
+    # 按字符串读取，其余列原样写回
+    bill_df = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    bill_df, rowids = _apply(bill_df, resolutions)
+    if not rowids:
+        return [], []
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    bill_df.to_csv(tmp, index=False, encoding="utf-8-sig")
+    tmp.replace(path)
+    return rowids, sorted(resolutions.loc[resolutions["rowid"].isin(rowids), "账单时间"].str[:7].unique())
+
+
+def _patch_sqlite(path: Path, resolutions: pd.DataFrame, table: str = "ledger") -> Tuple[List[int], List[str]]:
+    """在 SQLite 账本中原地更新"""
+    patched, months = [], set()
+    with sqlite3.connect(path) as conn:
+        for row in resolutions.itertuples(index=False):
+            cursor = conn.execute(
+                f'UPDATE "{table}" SET "分类" = ?, "子分类" = ? WHERE "分类" = ? AND "账单时间" = ? '
+                f'AND CAST(ROUND("金额" * 100) AS INTEGER) = ? AND IFNULL("备注", \'\') = ?',
+                (row.分类, row.子分类, PENDING_CATEGORY, row.账单时间, int(row.金额_分), row.备注 or ""),
+            )
+            if cursor.rowcount:
+                patched.append(row.rowid)
+                months.add(row.账单时间[:7])
+    return patched, sorted(months)
+
+
+def patch_ledger(ledger_path, queue: Optional[DeferredQueue] = None) -> int:
+    """
+    将延后分类的结果回填到账本：Parquet 分区目录只重写受影响的月份，SQLite 账本原地更新，CSV 重写整个文件。
+    账本旁存在汇总表（bill_report.rollup）时，同时重算受影响的月份。
+
+    回填期间持有账本锁（见 bill_merger.writers.ledger_lock）；账本正在写入时跳过本次回填，返回 0。
+
+    参数:
+        - ledger_path: 账本路径
+        - queue: 延后分类队列，默认使用共享实例
+
+    返回:
+        - 回填的记录数
+    """
+    queue = queue or get_deferred_queue()
+    resolutions = queue.resolutions()
+    if resolutions.empty:
+        return 0
+    ledger_path = Path(ledger_path)
+    suffix = ledger_path.suffix.lower()
+    with ExitStack() as stack:
+        # 与账本写入互斥：导入仍在写入的分区文件或 CSV 不会被改写
+        try:
+            stack.enter_context(ledger_lock(ledger_path, blocking=False))
+        except BlockingIOError:
+            print("账本正在写入，稍后再回填")
+            return 0
+        if ledger_path.is_dir():
+            patched, months = _patch_parquet(ledger_path, resolutions)
+        elif suffix == ".csv":
+            patched, months = _patch_csv(ledger_path, resolutions)
+        elif suffix in (".db", ".sqlite"):
+            patched, months = _patch_sqlite(ledger_path, resolutions)
+        else:
+            raise ValueError(f"Unsupported ledger for patching: {ledger_path}")
+
+        queue.forget(patched)
+        get_metrics().inc("ledger_rows_patched_total", len(patched))
+        if months:
+            from bill_report.rollup import RollupStore, default_rollup_path
+
+            rollup_path = default_rollup_path(ledger_path)
+            if rollup_path.exists():
+                store = RollupStore(rollup_path)
+                store.refresh(ledger_path, months)
+                store.close()
+    print(f"已回填 {len(patched)} 条待分类记录")
+    return len(patched)
+
+
+def run_worker(ledger_path, batch_size: int = 20, interval: float = 30.0, once: bool = False, queue: Optional[DeferredQueue] = None):
+    """
+    后台处理延后分类队列：批量请求大模型，并把结果回填到账本。
+
+    参数:
+        - ledger_path: 账本路径
+        - batch_size: 每个提示词包含的文本条数
+        - interval: 队列为空或大模型不可用时的等待时间（秒）
+        - once: 处理完当前队列后退出
+        - queue: 延后分类队列，默认使用共享实例
+    """
+    queue = queue or get_deferred_queue()
+    while True:
+        resolved = drain(queue, batch_size=batch_size)
+        patch_ledger(ledger_path, queue)
+        stats = queue.stats()
+        if once:
+            return stats
+        if not resolved or stats["pending"] == 0:
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    # python -m bill_merger.patch data/ledger --once
+    parser = argparse.ArgumentParser(description="处理延后分类队列并回填账本")
+    parser.add_argument("ledger", type=Path, help="账本路径（Parquet 分区目录、.csv 或 .db）")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=30.0, help="队列为空时的轮询间隔（秒）")
+    parser.add_argument("--once", action="store_true", help="处理完当前队列后退出")
+    args = parser.parse_args()
+    print(run_worker(args.ledger, args.batch_size, args.interval, args.once))
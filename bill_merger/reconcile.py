@@ -0,0 +1,188 @@
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from difflib import SequenceMatcher
+from typing import Iterable, Literal, Tuple
+
+from bill_merger.ledger import amount_fen, ensure_categories
+from bill_merger.sorting import time_key
+from utils.metrics import get_metrics
+
+# 默认参与对账的账户组合：(资金账户, 支付渠道)
+DEFAULT_PAIRS = [("工商银行", "微信"), ("工商银行", "支付宝")]
+
+# 对方文本中的通用词（支付通道、交易类型、公司后缀等），不能说明两条记录来自同一商户
+GENERIC_WORDS = (
+    "财付通", "微信支付", "微信", "支付宝", "银联", "快捷支付", "网上支付", "消费", "扫码",
+    "有限责任公司", "有限公司", "股份", "公司", "商户", "nan",
+)
+GENERIC_RE = re.compile("|".join(GENERIC_WORDS))
+# 去掉通用词、数字（订单号等）与标点后，两边对方文本的公共片段至少为该长度（或为较短一方的全文，如 "美团"）
+# 才视为同一商户；两个字的片段常是品类词（如 "咖啡"），不足以佐证
+MIN_COMMON_CHARS = 3
+
+
+def _party_text(value) -> str:
+    """规范化交易对方文本：统一全半角与大小写，去掉通用词、数字与标点"""
+    text = unicodedata.normalize("NFKC", str(value)).lower()
+    return re.sub(r"[\W\d_]+", "", GENERIC_RE.sub("", text))
+
+
+def _same_party(left: str, right: str) -> bool:
+    shortest = min(len(left), len(right))
+    if shortest < 2:
+        return False
+    match = SequenceMatcher(None, left, right, autojunk=False).find_longest_match(0, len(left), 0, len(right))
+    return match.size >= min(MIN_COMMON_CHARS, shortest)
+
+
+def _match_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """对账使用的键：行位置、金额（分）、日期桶（自纪元起的天数）、分钟、账户、收支方向与成员"""
+    minutes = time_key(df["账单时间"]).to_numpy().astype("datetime64[m]")
+    amount = amount_fen(df)
+    return pd.DataFrame({
+        "pos": np.arange(len(df)),
+        "cents": np.abs(amount),
+        "day": minutes.astype("datetime64[D]").astype("int64"),
+        "minute": minutes.astype("int64"),
+        "account": df["账户1"].to_numpy(dtype=object),
+        "sign": np.sign(amount),
+        # 不同成员的账户之间不对账（成员为空的记录视为同一成员）
+        "member": df["成员"].astype(object).fillna("").to_numpy() if "成员" in df.columns else "",
+    })
+
+
+def find_pairs(df: pd.DataFrame, pairs: Iterable[Tuple[str, str]] = DEFAULT_PAIRS, window_days: int = 1) -> pd.DataFrame:
+    """
+    查找跨来源的同一笔资金往来。
+
+    以 (金额绝对值, 日期) 为哈希键连接两个账户的记录，日期窗口内的每个偏移各做一次连接，
+    复杂度与记录数及候选数成线性，而不是两两比较。存在 成员 列时只在同一成员的记录之间连接。金额与日期相同只是候选，还需要以下任一佐证：
+
+    - 两边的交易对方 / 商户文本（对方 列，缺失时用 备注）去掉通用词后有公共片段；
+    - 两条记录在同一分钟，且互为唯一的候选。
+
+    有佐证的候选中，任一记录有多个候选时无法确定对应关系，两边的记录都保留、不配对。
+
+    参数:
+        - df: 合并后的账单（紧凑表示或导出表示）
+        - pairs: 参与对账的 (资金账户, 支付渠道) 组合，取值为 账户1 列
+        - window_days: 允许的日期差（天），银行入账日期可能晚于支付渠道
+
+    返回:
+        - pd.DataFrame: 列为 funding / channel（两条记录在 df 中的行位置）、kind（"duplicate" 为同向重复记账，
+          "transfer" 为反向的转账）与 gap（日期差）
+    """
+    keys = _match_keys(df)
+    keys = keys[keys["cents"] > 0]
+    candidates = []
+    for funding, channel in pairs:
+        left = keys[keys["account"] == funding]
+        right = keys[keys["account"] == channel]
+        if left.empty or right.empty:
+            continue
+        for offset in range(-window_days, window_days + 1):
+            joined = left.merge(right.assign(day=right["day"] + offset), on=["cents", "day", "member"], suffixes=("_f", "_c"))
+            if len(joined):
+                candidates.append(joined.assign(gap=abs(offset)))
+
+    columns = ["funding", "channel", "kind", "gap"]
+    if not candidates:
+        return pd.DataFrame(columns=columns)
+
+    candidates = pd.concat(candidates, ignore_index=True).sort_values(["gap", "pos_c", "pos_f"], kind="stable")
+    metrics = get_metrics()
+
+    # 佐证：同一分钟且互为唯一候选，或对方文本有公共片段（只对候选涉及的记录计算）
+    unique = ~candidates["pos_f"].duplicated(keep=False) & ~candidates["pos_c"].duplicated(keep=False)
+    same_minute = (candidates["minute_f"] == candidates["minute_c"]) & unique
+    source = df["对方"] if "对方" in df.columns else df["备注"]
+    positions = pd.unique(np.concatenate([candidates["pos_f"].to_numpy(), candidates["pos_c"].to_numpy()]))
+    texts = dict(zip(positions, map(_party_text, source.to_numpy(dtype=object)[positions])))
+    same_party = np.fromiter(
+        (_same_party(texts[f], texts[c]) for f, c in zip(candidates["pos_f"], candidates["pos_c"])),
+        dtype=bool, count=len(candidates),
+    )
+    corroborated = candidates[same_minute.to_numpy() | same_party]
+    metrics.inc("reconcile_skipped_total", len(candidates) - len(corroborated), reason="uncorroborated")
+
+    # 任一记录有多个有佐证的候选时不配对
+    ambiguous = corroborated["pos_f"].duplicated(keep=False) | corroborated["pos_c"].duplicated(keep=False)
+    metrics.inc("reconcile_skipped_total", int(ambiguous.sum()), reason="ambiguous")
+    selected = corroborated[~ambiguous]
+    return pd.DataFrame({
+        "funding": selected["pos_f"].to_numpy(),
+        "channel": selected["pos_c"].to_numpy(),
+        "kind": np.where(selected["sign_f"] == selected["sign_c"], "duplicate", "transfer"),
+        "gap": selected["gap"].to_numpy(),
+    }, columns=columns)
+
+
+def reconcile(
+    df: pd.DataFrame,
+    mode: Literal["collapse", "link"] = "collapse",
+    pairs: Iterable[Tuple[str, str]] = DEFAULT_PAIRS,
+    window_days: int = 1,
+) -> pd.DataFrame:
+    """
+    跨来源对账：识别银行卡与支付渠道中重复出现的同一笔资金（配对规则见 find_pairs）。
+
+    - 同向（均为支出或均为收入）视为重复记账：合并为支付渠道的一条记录（保留商户明细与时间），账户1 改为资金账户；
+    - 反向（一边支出一边收入，如零钱充值、提现）视为转账：合并为一条 类型="转账" 的记录，
+      账户1 为转出账户、账户2 为转入账户，金额取绝对值。
+
+    mode 为 "link" 时不删除记录，只在两条记录的 账户2 填入对方账户，并以相同的 标签 关联。
+
+    参数:
+        - df: 按时间排序的合并账单
+        - mode: "collapse" 合并为一条，"link" 保留两条并关联
+        - pairs: 参与对账的 (资金账户, 支付渠道) 组合
+        - window_days: 允许的日期差（天）
+
+    返回:
+        - pd.DataFrame: 对账后的账单，行顺序保持不变
+    """
+    df = df.reset_index(drop=True)
+    matched = find_pairs(df, pairs, window_days)
+    metrics = get_metrics()
+    for kind, count in matched["kind"].value_counts().items():
+        metrics.inc("reconciled_pairs_total", int(count), kind=kind, mode=mode)
+    print(f"跨来源对账: 重复记账 {int((matched['kind'] == 'duplicate').sum())} 笔, "
+          f"转账 {int((matched['kind'] == 'transfer').sum())} 笔")
+    if matched.empty:
+        return df
+
+    df = df.copy()
+    funding = matched["funding"].to_numpy(dtype=int)
+    channel = matched["channel"].to_numpy(dtype=int)
+    accounts = df["账户1"].to_numpy(dtype=object, copy=True)
+    # 紧凑表示中 账户2 等为 category 列，写入新的取值前先补充类别
+    ensure_categories(df, "账户2", accounts[np.concatenate([funding, channel])])
+
+    if mode == "link":
+        tags = [f"对账{i + 1}" for i in range(len(matched))]
+        if "标签" not in df.columns:
+            # 紧凑表示中全空的可选列不保留
+            df["标签"] = None
+        df.loc[funding, "账户2"] = accounts[channel]
+        df.loc[channel, "账户2"] = accounts[funding]
+        df.loc[funding, "标签"] = tags
+        df.loc[channel, "标签"] = tags
+        return df
+
+    duplicate = (matched["kind"] == "duplicate").to_numpy()
+    df.loc[channel[duplicate], "账户1"] = accounts[funding[duplicate]]
+
+    transfer = ~duplicate
+    if transfer.any():
+        rows, others = channel[transfer], funding[transfer]
+        outgoing = df.loc[rows, "金额"].to_numpy() < 0
+        for col, value in (("类型", "转账"), ("分类", ""), ("子分类", "")):
+            ensure_categories(df, col, [value])
+        df.loc[rows, "账户1"] = np.where(outgoing, accounts[rows], accounts[others])
+        df.loc[rows, "账户2"] = np.where(outgoing, accounts[others], accounts[rows])
+        df.loc[rows, "金额"] = df.loc[rows, "金额"].abs()
+        df.loc[rows, ["类型", "分类", "子分类"]] = ["转账", "", ""]
+
+    return df.drop(index=funding).reset_index(drop=True)
@@ -0,0 +1,205 @@
+import heapq
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from collections import deque
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Literal, Optional
+
+SORT_KEY = "_sort_key"
+
+
+def time_key(times: pd.Series) -> pd.Series:
+    """将账单时间列转换为可比较的 datetime 排序键"""
+    return pd.to_datetime(times, format="%Y-%m-%d %H:%M")
+
+
+def _merge_two(left: tuple, right: tuple) -> tuple:
+    """稳定归并两个升序的 (键, 下标) 数组对，键相同时 left 在前"""
+    left_keys, left_index = left
+    right_keys, right_index = right
+    # right 中每个元素在结果中的位置 = left 中不大于它的元素个数 + 它在 right 中的序号
+    positions = np.searchsorted(left_keys, right_keys, side="right") + np.arange(len(right_keys))
+    from_right = np.zeros(len(left_keys) + len(right_keys), dtype=bool)
+    from_right[positions] = True
+    keys = np.empty(len(from_right), dtype=left_keys.dtype)
+    index = np.empty(len(from_right), dtype=np.int64)
+    keys[positions], index[positions] = right_keys, right_index
+    keys[~from_right], index[~from_right] = left_keys, left_index
+    return keys, index
+
+
+def kway_merge(keys: List[np.ndarray]) -> np.ndarray:
+    """
+    对若干键数组（通常各自已升序）做 k 路归并，返回按顺序拼接后的数组的稳定排序下标。
+
+    未排序的数组先在内部稳定排序，之后相邻的数组两两向量化归并，共 log k 轮；键相同的行保持原有的先后顺序。
+    """
+    runs, offset = [], 0
+    for run_keys in keys:
+        index = np.arange(offset, offset + len(run_keys), dtype=np.int64)
+        if len(run_keys) > 1 and not (run_keys[1:] >= run_keys[:-1]).all():
+            order = np.argsort(run_keys, kind="stable")
+            run_keys, index = run_keys[order], index[order]
+        runs.append((run_keys, index))
+        offset += len(run_keys)
+    if not runs:
+        return np.arange(0, dtype=np.int64)
+    while len(runs) > 1:
+        merged = [_merge_two(runs[i], runs[i + 1]) for i in range(0, len(runs) - 1, 2)]
+        runs = merged + runs[len(runs) - len(runs) % 2:]
+    return runs[0][1]
+
+
+class SortedRun:
+    """按时间升序排列的一段数据，由若干内存块或溢写到磁盘的块组成"""
+
+    def __init__(self):
+        self.segments = deque()
+        self.first = None
+        self.last = None
+        self.rows = 0
+
+    def append(self, chunk: pd.DataFrame):
+        """在末尾追加一块（块内已升序且不早于本段末尾）"""
+        self.segments.append(chunk)
+        self._extend(chunk)
+
+    def prepend(self, chunk: pd.DataFrame):
+        """在开头插入一块（块内已升序且不晚于本段开头），用于倒序导出的账单"""
+        self.segments.appendleft(chunk)
+        self._extend(chunk)
+
+    def _extend(self, chunk: pd.DataFrame):
+        keys = chunk[SORT_KEY]
+        self.first = keys.iloc[0] if self.first is None else min(self.first, keys.iloc[0])
+        self.last = keys.iloc[-1] if self.last is None else max(self.last, keys.iloc[-1])
+        self.rows += len(chunk)
+
+    def spill(self, tmp_dir: Path) -> int:
+        """将内存中的块写入临时文件，返回释放的行数"""
+        released = 0
+        for i, segment in enumerate(self.segments):
+            if isinstance(segment, pd.DataFrame):
+                path = Path(tempfile.mkstemp(suffix=".pkl", dir=tmp_dir)[1])
+                segment.to_pickle(path)
+                self.segments[i] = path
+                released += len(segment)
+        return released
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        for segment in self.segments:
+            yield segment if isinstance(segment, pd.DataFrame) else pd.read_pickle(segment)
+
+
+class ExternalMerger:
+    """
+    多来源有序归并。
+
+    各来源的数据块按时间切分为若干升序段（已排序的导出通常只有一段，倒序导出的块会被翻转并倒序拼接），
+    最后对所有段做 k 路堆归并，复杂度为 O(n log k)。内存中缓存的行数超过预算后，各段溢写到临时文件。
+    临时目录在首次溢写时才创建；应以 with 语句使用，提前结束或出错时也会删除临时文件。
+    """
+
+    def __init__(self, memory_budget: int = 500_000, chunksize: int = 50_000, tmp_dir=None):
+        """
+        参数:
+        - memory_budget (int): 内存中最多缓存的行数，超出后溢写到临时文件
+        - chunksize (int): 归并结果每块的行数
+        - tmp_dir: 临时文件目录，默认使用系统临时目录
+        """
+        self.memory_budget = memory_budget
+        self.chunksize = chunksize
+        self.tmp_root = tmp_dir
+        self.tmp_dir: Optional[Path] = None
+        self.runs: List[SortedRun] = []
+        self.columns = None
+        self._buffered = 0
+        self._spilling = False
+
+    def add_source(self, chunks: Iterable[pd.DataFrame], order: Optional[Literal["asc", "desc"]] = None):
+        """
+        加入一个来源的数据块。
+
+        参数:
+        - chunks: 按文件顺序产出的数据块
+        - order: 来源的时间顺序，"asc" 为升序、"desc" 为倒序，None 表示根据数据自动检测
+        """
+        run = None
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            if self.columns is None:
+                self.columns = list(chunk.columns)
+            chunk = chunk.assign(**{SORT_KEY: time_key(chunk["账单时间"])})
+            keys = chunk[SORT_KEY]
+            if order is None and keys.iloc[0] != keys.iloc[-1]:
+                order = "asc" if keys.iloc[0] < keys.iloc[-1] else "desc"
+            if order == "desc":
+                chunk = chunk.iloc[::-1]
+
+            if not chunk[SORT_KEY].is_monotonic_increasing:
+                # 块内无序，单独排序后作为新的一段
+                chunk = chunk.sort_values(SORT_KEY, kind="stable")
+                run = None
+            if run is not None:
+                if order == "desc" and chunk[SORT_KEY].iloc[-1] <= run.first:
+                    run.prepend(chunk)
+                elif order != "desc" and chunk[SORT_KEY].iloc[0] >= run.last:
+                    run.append(chunk)
+                else:
+                    run = None
+            if run is None:
+                run = SortedRun()
+                run.append(chunk)
+                self.runs.append(run)
+            self._account(len(chunk))
+
+    def _account(self, rows: int):
+        self._buffered += rows
+        if self._spilling or self._buffered > self.memory_budget:
+            self._spilling = True
+            if self.tmp_dir is None:
+                self.tmp_dir = Path(tempfile.mkdtemp(prefix="billmate_", dir=self.tmp_root))
+            for run in self.runs:
+                self._buffered -= run.spill(self.tmp_dir)
+
+    @staticmethod
+    def _iter_rows(run: SortedRun):
+        for chunk in run.iter_chunks():
+            keys = chunk[SORT_KEY].to_numpy()
+            yield from zip(keys, chunk.drop(columns=SORT_KEY).itertuples(index=False, name=None))
+
+    def merge(self) -> Iterator[pd.DataFrame]:
+        """按时间升序产出归并后的数据块"""
+        try:
+            if len(self.runs) == 1:
+                for chunk in self.runs[0].iter_chunks():
+                    yield chunk.drop(columns=SORT_KEY).reset_index(drop=True)
+                return
+
+            merged = heapq.merge(*(self._iter_rows(run) for run in self.runs), key=itemgetter(0))
+            batch = []
+            for _, row in merged:
+                batch.append(row)
+                if len(batch) >= self.chunksize:
+                    yield pd.DataFrame(batch, columns=self.columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=self.columns)
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        """删除临时文件"""
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
@@ -0,0 +1,307 @@
+import os
+import time
+import uuid
+import sqlite3
+import pandas as pd
+from pathlib import Path
+from abc import ABC, abstractmethod
+from contextlib import ExitStack, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def lock_path(path) -> Path:
+    """账本锁文件的路径：与账本同目录，如 data/ledger -> data/ledger.lock"""
+    path = Path(path)
+    return path.with_name(f"{path.name}.lock")
+
+
+@contextmanager
+def ledger_lock(path, blocking: bool = True):
+    """
+    账本的进程间排他锁（锁文件上的 flock，Windows 上为 msvcrt.locking），写入账本与回填分类时持有，
+    避免回填改写或删除仍在写入的文件。
+
+    参数:
+        - path: 账本路径
+        - blocking: 锁被占用时是否等待；为 False 时抛出 BlockingIOError
+    """
+    path = lock_path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        else:
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not blocking:
+                        raise BlockingIOError(f"Ledger is locked: {path}") from None
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+# 账单输出接口：逐块写入合并后的账单
+class LedgerWriter(ABC):
+    # 是否支持回填延后分类的结果（CSV、Parquet、SQLite），这些格式写入期间持有账本锁
+    patchable = True
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.rows = 0
+
+    def open(self):
+        """打开输出目标"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    @abstractmethod
+    def write(self, chunk: pd.DataFrame):
+        """写入一块账单数据"""
+        pass
+
+    def close(self):
+        """完成写入并释放资源"""
+        pass
+
+    def lock_paths(self):
+        """写入期间需要加锁的账本路径"""
+        return [self.path] if self.patchable else []
+
+    # 写入期间持有账本锁，后台回填（bill_merger.patch）不会同时改写同一账本
+    def __enter__(self):
+        with ExitStack() as stack:
+            for path in self.lock_paths():
+                stack.enter_context(ledger_lock(path))
+            self.open()
+            self._stack = stack.pop_all()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._stack:
+            self.close()
+
+
+# CSV 输出：首块写入表头，其余块追加
+class CsvLedgerWriter(LedgerWriter):
+
+    def __init__(self, path, append=False, encoding="utf-8-sig"):
+        super().__init__(path)
+        self.append = append
+        self.encoding = encoding
+        self._header = True
+
+    def open(self):
+        super().open()
+        if self.append and self.path.exists() and self.path.stat().st_size > 0:
+            self._header = False
+        elif self.path.exists():
+            self.path.unlink()
+
+    def write(self, chunk: pd.DataFrame):
+        chunk.to_csv(self.path, mode="a", header=self._header, index=False, encoding=self.encoding)
+        self._header = False
+        self.rows += len(chunk)
+
+
+def import_pyarrow():
+    """按需导入 pyarrow（Parquet / Feather 输出的可选依赖）"""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet / Feather 输出需要安装 pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+
+def arrow_schema(pa, columns):
+    """账单的 Arrow 结构：金额为 float64，其余列均为字符串（空列也保持同一类型，便于追加）"""
+    return pa.schema([(col, pa.float64() if col == "金额" else pa.string()) for col in columns])
+
+
+# Parquet 输出：按月份分区（hive 风格目录 月份=YYYY-MM），每次写入生成新的分区文件，可追加
+class ParquetLedgerWriter(LedgerWriter):
+
+    def __init__(self, path, partition_by_month=True, compression="zstd"):
+        super().__init__(path)
+        self.partition_by_month = partition_by_month
+        self.compression = compression
+        self._writers = {}
+        self._run_id = None
+
+    def open(self):
+        self.pa = import_pyarrow()
+        self.path.mkdir(parents=True, exist_ok=True)
+        # 每次打开生成新的分区文件名，同一个 writer 多次写入也不会覆盖之前的文件
+        self._run_id = time.strftime("%Y%m%d%H%M%S") + f"-{uuid.uuid4().hex[:8]}"
+
+    def _writer(self, partition, schema):
+        if partition not in self._writers:
+            directory = self.path / f"月份={partition}" if partition else self.path
+            directory.mkdir(parents=True, exist_ok=True)
+            self._writers[partition] = self.pa.parquet.ParquetWriter(
+                directory / f"part-{self._run_id}.parquet", schema, compression=self.compression
+            )
+        return self._writers[partition]
+
+    def write(self, chunk: pd.DataFrame):
+        schema = arrow_schema(self.pa, chunk.columns)
+        groups = chunk.groupby(chunk["账单时间"].astype(str).str[:7], sort=False) if self.partition_by_month else [("", chunk)]
+        for partition, part in groups:
+            table = self.pa.Table.from_pandas(part, schema=schema, preserve_index=False)
+            self._writer(partition, schema).write_table(table)
+        self.rows += len(chunk)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+# Feather（Arrow IPC 文件）输出：逐块写入 record batch，可被下游直接内存映射读取
+class FeatherLedgerWriter(LedgerWriter):
+    patchable = False
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._writer = None
+
+    def open(self):
+        super().open()
+        self.pa = import_pyarrow()
+
+    def write(self, chunk: pd.DataFrame):
+        schema = arrow_schema(self.pa, chunk.columns)
+        if self._writer is None:
+            self._writer = self.pa.ipc.new_file(str(self.path), schema)
+        self._writer.write_table(self.pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+# SQLite 账本输出：追加写入 ledger 表，并为账单时间建立索引
+class SqliteLedgerWriter(LedgerWriter):
+
+    def __init__(self, path, table="ledger", append=True):
+        super().__init__(path)
+        self.table = table
+        self.append = append
+        self._conn = None
+
+    def open(self):
+        super().open()
+        self._conn = sqlite3.connect(self.path)
+        if not self.append:
+            self._conn.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+
+    def write(self, chunk: pd.DataFrame):
+        chunk.to_sql(self.table, self._conn, if_exists="append", index=False)
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._conn is not None:
+            if self.rows:
+                self._conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{self.table}_time" ON "{self.table}" ("账单时间")')
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+
+# Excel 输出：使用 openpyxl 的 write-only 模式逐行写入，不在内存中保留整张工作表
+class ExcelLedgerWriter(LedgerWriter):
+    patchable = False
+
+    def __init__(self, path, sheet_name="Sheet1"):
+        super().__init__(path)
+        self.sheet_name = sheet_name
+        self._workbook = None
+        self._sheet = None
+
+    def open(self):
+        super().open()
+        from openpyxl import Workbook
+
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet(self.sheet_name)
+
+    def write(self, chunk: pd.DataFrame):
+        if self.rows == 0:
+            self._sheet.append(list(chunk.columns))
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+            self._sheet.append(row)
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.save(self.path)
+            self._workbook = None
+
+
+# 同时写入多个输出，例如 Parquet 账本 + Excel 导出
+class TeeLedgerWriter(LedgerWriter):
+
+    def __init__(self, *writers: LedgerWriter):
+        super().__init__(writers[0].path)
+        self.writers = writers
+
+    @property
+    def patchable(self):
+        return self.writers[0].patchable
+
+    def lock_paths(self):
+        # 为每个可回填的输出分别加锁；按固定顺序获取，避免多个进程交叉加锁时死锁
+        paths = {writer.path.resolve() for writer in self.writers if writer.patchable}
+        return sorted(paths)
+
+    def open(self):
+        for writer in self.writers:
+            writer.open()
+
+    def write(self, chunk: pd.DataFrame):
+        for writer in self.writers:
+            writer.write(chunk)
+        self.rows += len(chunk)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+WRITERS = {
+    ".csv": CsvLedgerWriter,
+    ".parquet": ParquetLedgerWriter,
+    ".feather": FeatherLedgerWriter,
+    ".arrow": FeatherLedgerWriter,
+    ".db": SqliteLedgerWriter,
+    ".sqlite": SqliteLedgerWriter,
+    ".xlsx": ExcelLedgerWriter,
+}
+
+
+def get_writer(path, **kwargs) -> LedgerWriter:
+    """根据文件后缀选择账单输出（无后缀的路径视为 Parquet 分区目录）"""
+    suffix = Path(path).suffix.lower()
+    writer_cls = WRITERS.get(suffix) if suffix else ParquetLedgerWriter
+    if writer_cls is None:
+        raise ValueError(f"Unsupported ledger format: {path}")
+    return writer_cls(path, **kwargs)
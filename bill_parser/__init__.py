@@ -1,34 +1,95 @@
-import os
-import pkgutil
 import importlib
+from importlib import metadata
+from functools import lru_cache
 
-def import_all_modules(package_name, exclude=None):
+# 解析器清单：类名 -> 所在模块。首次访问时才导入对应模块，import bill_parser 不会加载任何解析器
+MANIFEST = {
+    "AlipayBillParser": "bill_parser.alipay_bill_parser",
+    "WeChatBillParser": "bill_parser.wechat_bill_parser",
+    "ICBCBillParser": "bill_parser.icbc_bill_parser",
+}
+
+# 账单类型 -> 解析器类名
+BILL_TYPES = {
+    "alipay": "AlipayBillParser",
+    "wechat": "WeChatBillParser",
+    "icbc": "ICBCBillParser",
+}
+
+# 第三方解析器可在自己的包中以该组名声明 entry points：账单类型 = "模块:类名"
+ENTRY_POINT_GROUP = "billmate.parsers"
+
+__all__ = [*MANIFEST, "available_parsers", "detect_bill_type", "get_parser_class"]
+
+
+@lru_cache(maxsize=None)
+def _entry_points() -> dict:
+    return {entry_point.name: entry_point for entry_point in metadata.entry_points(group=ENTRY_POINT_GROUP)}
+
+
+def available_parsers() -> list:
+    """可用的账单类型（内置 + entry points 注册的），不会导入任何解析器"""
+    return sorted({*BILL_TYPES, *_entry_points()})
+
+
+def get_parser_class(bill_type: str):
     """
-    动态导入包及其子包的所有模块，支持排除指定模块。
+    按账单类型获取解析器类，首次调用时才导入对应模块。
 
-    Args:
-        package_name (str): 要导入的包名。
-        exclude (list): 要排除的模块或包的全名列表（字符串），默认值为 None。
+    参数:
+        - bill_type: 账单类型，如 "alipay"
+
+    返回:
+        - BillParserStrategy 的子类
     """
-    exclude = set(exclude or [])  # 转换为集合，方便高效检查
-    package_dir = os.path.dirname(__file__)
-
-    for _, module_name, is_pkg in pkgutil.walk_packages([package_dir], prefix=f"{package_name}."):
-        # 跳过排除的模块
-        if module_name in exclude:
-            continue
-        try:
-            # 动态导入模块
-            module = importlib.import_module(module_name)
-            
-            # 检查模块是否定义了 __all__
-            if hasattr(module, '__all__'):
-                globals().update({name: getattr(module, name) for name in module.__all__})
-            else:
-                globals().update({name: getattr(module, name) for name in dir(module) if not name.startswith("_")})
-        except Exception as e:
-            print(f"Failed to import {module_name}: {e}")
-
-# 自动导入所有模块，示例中没有排除任何模块
-# 可以通过传递 exclude 参数来控制排除特定模块
-import_all_modules(__name__, exclude=['bill_parser.base'])
+    if bill_type in BILL_TYPES:
+        return __getattr__(BILL_TYPES[bill_type])
+    entry_point = _entry_points().get(bill_type)
+    if entry_point is None:
+        raise ValueError(f"Unknown bill type: {bill_type}")
+    return entry_point.load()
+
+
+def detect_bill_type(file_path, sniff_size: int = 16 * 1024):
+    """
+    按文件内容识别账单类型：读取文件开头，返回表头与其 signature 相符的解析器对应的账单类型。
+    PDF 账单提取首页文字，与解析器的 pdf_signature 比较。
+
+    参数:
+        - file_path: 账单文件路径
+        - sniff_size: 读取的字节数，需覆盖表头之前的说明行
+
+    返回:
+        - 账单类型，无法识别时返回 None
+    """
+    from utils.pdf_reader import is_pdf, normalize_pdf_text, pdf_errors, read_pdf_text
+    from utils.reader import read_head
+
+    try:
+        if is_pdf(file_path):
+            text = normalize_pdf_text(read_pdf_text(file_path))
+            return next((t for t in available_parsers() if get_parser_class(t).matches_pdf(text)), None)
+        head = read_head(file_path, sniff_size)
+    except (OSError, *pdf_errors()):
+        # 无法读取或已损坏的文件视为无法识别
+        return None
+    # 列名更多的 signature 更具体，优先匹配
+    candidates = sorted(available_parsers(), key=lambda bill_type: -len(get_parser_class(bill_type).signature))
+    for bill_type in candidates:
+        if get_parser_class(bill_type).matches(head):
+            return bill_type
+    return None
+
+
+def __getattr__(name):
+    module_name = MANIFEST.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    parser_class = getattr(importlib.import_module(module_name), name)
+    # 缓存到模块命名空间，之后的访问不再经过 __getattr__
+    globals()[name] = parser_class
+    return parser_class
+
+
+def __dir__():
+    return sorted({*globals(), *MANIFEST})
@@ -1,15 +1,183 @@
+import os
 import pandas as pd
+from tqdm import tqdm
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterator, Optional
+
+from intelli_classifier.async_pipeline import AsyncClassificationPipeline, classify_frame
+from utils.general import build_data_structure, build_row_texts
+from utils.metrics import get_metrics
+
+
+class FilterStats:
+    """过滤统计，逐块解析时按块累加，读完整个文件后输出一次"""
+
+    def __init__(self):
+        self.total = 0
+        self.valid = 0
+        self.dropped: Dict[str, int] = {}
+
+    def add(self, df: pd.DataFrame, valid_rows: pd.DataFrame):
+        """累加一块数据的统计，被过滤的原因与行数由 report_filter 附带在 valid_rows.attrs 中"""
+        self.total += len(df)
+        self.valid += len(valid_rows)
+        for reason, count in valid_rows.attrs.pop("dropped", {}).items():
+            self.dropped[reason] = self.dropped.get(reason, 0) + count
+
 
 # 定义抽象策略
 class BillParserStrategy(ABC):
-    
+    # 账单来源名称，用于日志与进度提示
+    title = ""
+    # 导出文件的时间顺序："asc" 升序、"desc" 倒序，None 表示未知（合并时自动检测）
+    sort_order = None
+    # 表头行必须包含的列名，用于按文件内容识别账单来源
+    signature = ()
+    # PDF 账单首页必须包含的文字，为空表示不支持 PDF
+    pdf_signature = ()
+
+    def __init__(self, defer: Optional[bool] = None, max_concurrency: int = 4):
+        """
+        参数:
+            - defer: 是否延后大模型分类（只使用特例池与缓存，其余记录标记为待分类并加入延后分类队列，
+              账本写入成功后由 BillMerger 记录待回填的行），默认读取环境变量 BILLMATE_DEFER
+            - max_concurrency: 解析时同时在途的大模型请求上限（多进程解析时由 BillMerger 按进程数分配）
+        """
+        self.defer = os.environ.get("BILLMATE_DEFER", "") not in ("", "0") if defer is None else defer
+        self.max_concurrency = max_concurrency
+
+    @classmethod
+    def matches(cls, head: str) -> bool:
+        """文件开头的文本中是否存在包含全部 signature 列名的表头行"""
+        if not cls.signature:
+            return False
+        return any(all(column in line for column in cls.signature) for line in head.splitlines())
+
+    @classmethod
+    def matches_pdf(cls, text: str) -> bool:
+        """PDF 首页的文字（已去除空白）中是否包含全部 pdf_signature"""
+        return bool(cls.pdf_signature) and all(word in text for word in cls.pdf_signature)
+
+    @abstractmethod
+    def read(self, file_path, chunksize=None):
+        """读取原始账单表格，指定 chunksize 时返回按块读取的迭代器"""
+        pass
+
     @abstractmethod
     def filter_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """过滤不需要的数据"""
         pass
 
     @abstractmethod
+    def normalize(self, df: pd.DataFrame) -> pd.DataFrame:
+        """将原始账单整列转换为统一的账单结构（分类列除外）"""
+        pass
+
+    @abstractmethod
+    def build_keys(self, df: pd.DataFrame) -> pd.Series:
+        """构建分类缓存键文本（通常为商户+商品描述）"""
+        pass
+
+    def report_filter(self, df: pd.DataFrame, valid_rows: pd.DataFrame, dropped: Dict[str, int]):
+        """
+        记录过滤统计到指标中，并附带在 valid_rows 上，由 parse / iter_chunks 汇总后输出
+
+        参数:
+            - df: 过滤前的数据
+            - valid_rows: 过滤后的有效数据
+            - dropped: 被过滤的原因到行数的映射
+        """
+        metrics = get_metrics()
+        metrics.inc("input_rows_total", len(df), source=self.title)
+        metrics.inc("valid_rows_total", len(valid_rows), source=self.title)
+        for reason, count in dropped.items():
+            metrics.inc("dropped_rows_total", count, source=self.title, reason=reason)
+        valid_rows.attrs["dropped"] = dict(dropped)
+
+    def print_filter_stats(self, stats: FilterStats):
+        """输出过滤统计"""
+        print(f'{self.title}账单处理'.center(80, '*'))
+        print(f"总记录数: {stats.total}")
+        for reason, count in stats.dropped.items():
+            print(f"{reason}记录数: {count}")
+        print(f"有效记录数: {stats.valid}")
+
+    def assign_categories(
+        self,
+        bill_df: pd.DataFrame,
+        raw_df: pd.DataFrame,
+        classify: Optional[Callable] = None,
+        progress: Optional[tqdm] = None,
+    ) -> pd.DataFrame:
+        """
+        对规范化后的账单进行分类，填充 分类/子分类 列并按统一结构排列。
+
+        classify 为请求大模型的函数、progress 为共用的进度条（见 classify_frame），默认每次调用新建。
+        """
+        keys = self.build_keys(raw_df)
+        categories = classify_frame(
+            build_row_texts(raw_df),
+            bill_df["类型"],
+            keys,
+            desc=f"处理{self.title}账单",
+            max_concurrency=self.max_concurrency,
+            defer=self.defer,
+            classify=classify,
+            progress=progress,
+        )
+        bill_df = bill_df.assign(分类=categories["分类"], 子分类=categories["子分类"])
+        # 缓存键文本即交易对方与商户，随账单附带（不导出），供跨来源对账核对是否为同一笔交易
+        return bill_df[list(build_data_structure())].assign(对方=keys).reset_index(drop=True)
+
     def parse(self, file_path):
         """解析账单并返回 DataFrame"""
-        pass
\ No newline at end of file
+        metrics = get_metrics()
+        with metrics.timer("stage_seconds", stage="read", source=self.title):
+            df = self.read(file_path)
+        return self._process(df)
+
+    def iter_chunks(self, file_path, chunksize: int = 50_000, classify: Optional[Callable] = None) -> Iterator[pd.DataFrame]:
+        """
+        流式解析账单，逐块产出与 parse 结构相同的数据，内存占用与块大小相关而与文件大小无关。
+
+        同一文件的各块共用一个异步分类流水线与进度条，过滤统计在读完文件后输出一次。
+        classify 为请求大模型的函数（见 classify_frame），常驻服务传入共享流水线的入口。
+        """
+        if classify is None and not self.defer:
+            classify = AsyncClassificationPipeline(max_concurrency=self.max_concurrency).classify_many
+        stats = FilterStats()
+        chunks = self.read(file_path, chunksize=chunksize)
+        # 延后分类时不请求大模型，不需要进度条
+        with nullcontext() if self.defer else tqdm(total=0, desc=f"处理{self.title}账单") as progress:
+            for df in get_metrics().timed_iter(chunks, "stage_seconds", stage="read", source=self.title):
+                if df.empty:
+                    continue
+                bill_df = self._process(df, classify, stats, progress)
+                if not bill_df.empty:
+                    yield bill_df
+        if stats.total:
+            self.print_filter_stats(stats)
+
+    def _process(
+        self,
+        df: pd.DataFrame,
+        classify: Optional[Callable] = None,
+        stats: Optional[FilterStats] = None,
+        progress: Optional[tqdm] = None,
+    ) -> pd.DataFrame:
+        """过滤、规范化并分类一块原始数据，记录各阶段耗时；未传入 stats 时立即输出这块数据的过滤统计"""
+        metrics = get_metrics()
+        with metrics.timer("stage_seconds", stage="filter", source=self.title):
+            valid_rows = self.filter_data(df)
+        report = stats is None
+        stats = stats or FilterStats()
+        stats.add(df, valid_rows)
+        if report:
+            self.print_filter_stats(stats)
+        if valid_rows.empty:
+            return valid_rows
+        with metrics.timer("stage_seconds", stage="normalize", source=self.title):
+            bill_df = self.normalize(valid_rows)
+        with metrics.timer("stage_seconds", stage="classify", source=self.title):
+            return self.assign_categories(bill_df, valid_rows, classify, progress)
@@ -1,87 +1,93 @@
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from datetime import datetime
 from bill_parser.base import BillParserStrategy
-from intelli_classifier.classifier import classify_consume_type
-from utils.general import build_data_structure, detect_encoding, find_table_start, get_categories, run_in_thread_pool
+from utils.general import drop_last_row
+from utils.pdf_reader import is_pdf, read_pdf_table
+from utils.reader import read_bill_table
 
 __all__ = ['ICBCBillParser']
 
 
 # 具体策略：解析工商银行账单（PDF）
 class ICBCBillParser(BillParserStrategy):
-    
+    title = "工商银行"
+    signature = ("交易日期", "摘要", "交易场所", "记账金额(收入)", "记账金额(支出)")
+    pdf_signature = ("工商银行", "交易日期", "摘要")
+
+    # PDF 明细中的列名 -> CSV 导出中的列名（PDF 的版式随时期不同）
+    PDF_ALIASES = {
+        "交易地点": "交易场所",
+        "收入金额": "记账金额(收入)",
+        "支出金额": "记账金额(支出)",
+        "对方账户名称": "对方户名",
+    }
+    # 收入与支出合为一列、以正负号区分的金额列
+    PDF_SIGNED_AMOUNTS = ("记账金额", "收入/支出金额", "交易金额")
+
+    def read(self, file_path, chunksize=None):
+        if is_pdf(file_path):
+            df = self.read_pdf(file_path)
+            if chunksize:
+                return (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+            return df
+
+        # 表头行末尾缺少逗号（数据行末尾均有逗号），在读取流中补齐
+        df = read_bill_table(file_path, header_keyword="交易日期", chunksize=chunksize, fix_trailing_comma=True)
+
+        # 忽略最后一行
+        if chunksize:
+            return drop_last_row(df)
+        return df.iloc[:-1]
+
+    def read_pdf(self, file_path) -> pd.DataFrame:
+        """
+        读取 PDF 账单（较早时期只提供 PDF 格式），转换为与 CSV 导出相同的列，之后的过滤与规范化与 CSV 共用。
+        """
+        df = read_pdf_table(file_path, header_keyword="交易日期").rename(columns=self.PDF_ALIASES)
+        signed = next((col for col in self.PDF_SIGNED_AMOUNTS if col in df.columns), None)
+        if signed and "记账金额(收入)" not in df.columns:
+            amount = df[signed].str.replace(",", "").str.strip()
+            expense = amount.str.startswith("-")
+            df["记账金额(收入)"] = amount.str.lstrip("+").where(~expense, "")
+            df["记账金额(支出)"] = amount.str.lstrip("-").where(expense, "")
+        for col in ("摘要", "交易场所"):
+            if col not in df.columns:
+                df[col] = ""
+        # 只保留交易记录，去掉合计行与页脚
+        return df[df["交易日期"].str.strip().str.fullmatch(r"\d{4}-\d{2}-\d{2}", na=False)].reset_index(drop=True)
+
     def filter_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """过滤不需要的数据"""
         valid_type_rows = df[
-            ~(df["摘要"].str.contains("理财|基金", na=False)) & 
+            ~(df["摘要"].str.contains("理财|基金", na=False)) &
             ~(df["交易场所"].str.contains("基金|理财", na=False))
         ]
-        
-        print('工商银行账单处理'.center(80, '*'))
-        print(f"总记录数: {len(df)}")
-        print(f"收支类型无效记录数: {len(df) - len(valid_type_rows)}")
-        print(f"有效记录数: {len(valid_type_rows)}")
-        
-        return valid_type_rows
 
-    def add_line(self, table_data, row):
+        self.report_filter(df, valid_type_rows, {"理财/基金": len(df) - len(valid_type_rows)})
 
-        # 去除首位空白符
-        row = row.str.strip()
-        # 解析原始数据
-        col_time = datetime.strptime(row["交易日期"], "%Y-%m-%d").strftime("%Y-%m-%d %H:%M")
-        col_type = "收入" if row["记账金额(收入)"] != '' else "支出"
-        col_category, col_subcategory = classify_consume_type(str(row), col_type)
-        col_amount = -float(row["记账金额(支出)"].replace(",", "")) if col_type == "支出" else float(row["记账金额(收入)"].replace(",", ""))
-        col_ledger = "日常生活"
-        col_fromaccount = "工商银行"
-        col_toaccount = ""
-        col_notes = row["摘要"]
-
-        # 添加到输出数据中
-        table_data["账单时间"].append(col_time)
-        table_data["类型"].append(col_type)
-        table_data["分类"].append(col_category)
-        table_data["子分类"].append(col_subcategory)
-        table_data["金额"].append(col_amount)
-        table_data["账本"].append(col_ledger)
-        table_data["账户1"].append(col_fromaccount)
-        table_data["账户2"].append(col_toaccount)
-        table_data["备注"].append(col_notes)
+        return valid_type_rows
 
-    def parse(self, file_path):
-        encoding = detect_encoding(file_path)
-        start_row = find_table_start(file_path, encoding=encoding, header_keyword="交易日期")
-        
-        # 检查并修复表头行末尾的逗号
-        with open(file_path, 'r', encoding=encoding) as f:
-            lines = f.readlines()
-            header_line = lines[start_row].strip()
-            if not header_line.endswith(','):
-                lines[start_row] = header_line + ',\n'
-                with open(file_path, 'w', encoding=encoding) as f:
-                    f.writelines(lines)
+    def normalize(self, df: pd.DataFrame) -> pd.DataFrame:
+        # 去除首位空白符
+        income = df["记账金额(收入)"].astype("string").str.strip().fillna("")
+        expense = df["记账金额(支出)"].astype("string").str.strip().fillna("")
 
-        df = pd.read_csv(
-            file_path, encoding=encoding, encoding_errors="ignore", skiprows=start_row
-        )
+        # 解析原始数据
+        col_type = pd.Series(np.where(income != "", "收入", "支出"), index=df.index)
+        amount = income.where(col_type == "收入", expense).str.replace(",", "").astype(float)
 
-        # 忽略最后一行
-        df = df.iloc[:-1]
+        return pd.DataFrame({
+            "账单时间": pd.to_datetime(df["交易日期"].str.strip(), format="%Y-%m-%d").dt.strftime("%Y-%m-%d %H:%M"),
+            "类型": col_type,
+            "金额": amount.where(col_type == "收入", -amount),
+            "账本": "日常生活",
+            "账户1": "工商银行",
+            "账户2": "",
+            "备注": df["摘要"].str.strip(),
+        }, index=df.index)
 
-        # 定义目标数据框的结构
-        output_data = build_data_structure()
-        
-        # 过滤数据
-        valid_rows = self.filter_data(df)
-        total_count = len(valid_rows)
-        
-        # 构建参数列表
-        params = [{'table_data': output_data, 'row': row} for idx, row in valid_rows.iterrows()]
-        
-        # 使用线程池处理数据
-        list(tqdm(run_in_thread_pool(self.add_line, params), total=total_count, desc="处理工商银行账单"))
-        
-        # 返回处理后的DataFrame
-        return pd.DataFrame(output_data)
\ No newline at end of file
+    def build_keys(self, df: pd.DataFrame) -> pd.Series:
+        keys = df["交易场所"].astype(str).str.strip() + " " + df["摘要"].astype(str).str.strip()
+        if "对方户名" in df.columns:
+            keys = keys + " " + df["对方户名"].astype(str).str.strip()
+        return keys
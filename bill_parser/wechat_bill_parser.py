@@ -1,78 +1,50 @@
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from datetime import datetime
 from bill_parser.base import BillParserStrategy
-from intelli_classifier.classifier import classify_consume_type
-from utils.general import build_data_structure, find_table_start, detect_encoding, get_categories, run_in_thread_pool
+from utils.reader import read_bill_table
 
 __all__ = ["WeChatBillParser"]
 
 
 # 具体策略：解析微信账单
 class WeChatBillParser(BillParserStrategy):
-    
+    title = "微信"
+    sort_order = "desc"
+    signature = ("交易时间", "交易类型", "交易对方", "商品", "金额(元)")
+
+    def read(self, file_path, chunksize=None):
+        return read_bill_table(file_path, header_keyword="交易时间", chunksize=chunksize)
+
     def filter_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """过滤不需要的数据"""
         # 筛选有效数据并计算总数
         valid_type_rows = df[df["收/支"].isin(["支出", "收入"])]
         zero_amount_rows = valid_type_rows[valid_type_rows["金额(元)"] == "¥0.00"]
         valid_rows = valid_type_rows[valid_type_rows["金额(元)"] != "¥0.00"]
-        
-        print('微信账单处理'.center(80, '*'))
-        print(f"总记录数: {len(df)}")
-        print(f"收支类型无效记录数: {len(df) - len(valid_type_rows)}")
-        print(f"金额为0的记录数: {len(zero_amount_rows)}")
-        print(f"有效记录数: {len(valid_rows)}")
-        
+
+        self.report_filter(df, valid_rows, {
+            "收支类型无效": len(df) - len(valid_type_rows),
+            "金额为0": len(zero_amount_rows),
+        })
+
         return valid_rows
 
-    def add_line(self, table_data, row):
-        
+    def normalize(self, df: pd.DataFrame) -> pd.DataFrame:
         # 解析原始数据
-        col_time = datetime.strptime(row["交易时间"], "%Y/%m/%d %H:%M").strftime(
-            "%Y-%m-%d %H:%M"
-        )
-        col_type = "支出" if row["收/支"] == "支出" else "收入"
-        col_category, col_subcategory = classify_consume_type(str(row), col_type)
+        col_type = pd.Series(np.where(df["收/支"] == "支出", "支出", "收入"), index=df.index)
         # 处理带有¥符号的金额字符串
-        amount_str = row["金额(元)"].replace("¥", "").replace(",", "").strip()
-        col_amount = -float(amount_str) if col_type == "支出" else float(amount_str)
-        col_ledger = "日常生活"  # 假设账本固定为"日常生活"，可根据实际分类逻辑修改
-        col_fromaccount = "微信"  # row["支付方式"]
-        col_toaccount = ""  # 暂无对应字段
-        note = f'\n{row["备注"]}' if pd.notna(row["备注"]) else ""
-        col_notes = f'{row["商品"]}{note}'
-
-        # 添加到输出数据中
-        table_data["账单时间"].append(col_time)
-        table_data["类型"].append(col_type)
-        table_data["分类"].append(col_category)
-        table_data["子分类"].append(col_subcategory)
-        table_data["金额"].append(col_amount)
-        table_data["账本"].append(col_ledger)
-        table_data["账户1"].append(col_fromaccount)
-        table_data["账户2"].append(col_toaccount)
-        table_data["备注"].append(col_notes)
+        amount = df["金额(元)"].str.replace("[¥,]", "", regex=True).str.strip().astype(float)
+        note = ("\n" + df["备注"].astype(str)).where(df["备注"].notna(), "")
 
-    def parse(self, file_path):
-        encoding = detect_encoding(file_path)
-        start_row = find_table_start(file_path, encoding=encoding)
-        df = pd.read_csv(
-            file_path, encoding=encoding, encoding_errors="ignore", skiprows=start_row
-        )
+        return pd.DataFrame({
+            "账单时间": pd.to_datetime(df["交易时间"], format="%Y/%m/%d %H:%M").dt.strftime("%Y-%m-%d %H:%M"),
+            "类型": col_type,
+            "金额": amount.where(col_type == "收入", -amount),
+            "账本": "日常生活",  # 假设账本固定为"日常生活"，可根据实际分类逻辑修改
+            "账户1": "微信",  # row["支付方式"]
+            "账户2": "",  # 暂无对应字段
+            "备注": df["商品"].astype(str) + note,
+        }, index=df.index)
 
-        # 定义目标数据框的结构
-        output_data = build_data_structure()
-        
-        # 过滤数据
-        valid_rows = self.filter_data(df)
-        total_count = len(valid_rows)
-        
-        # 构建参数列表
-        params = [{'table_data': output_data, 'row': row} for idx, row in valid_rows.iterrows()]
-        
-        # 使用线程池处理数据
-        list(tqdm(run_in_thread_pool(self.add_line, params), total=total_count, desc="处理微信账单"))
-        
-        # 返回处理后的DataFrame
-        return pd.DataFrame(output_data)
+    def build_keys(self, df: pd.DataFrame) -> pd.Series:
+        return df["交易对方"].astype(str) + " " + df["商品"].astype(str)
@@ -0,0 +1,269 @@
+import time
+import sqlite3
+import threading
+import pandas as pd
+from pathlib import Path
+from typing import Iterable, List, Literal, Optional, Sequence
+
+from bill_merger.ledger import amount_fen
+from bill_merger.sorting import time_key
+from bill_merger.writers import LedgerWriter, import_pyarrow
+from utils.metrics import get_metrics
+
+# 汇总表的维度列（空值以空字符串保存，保证唯一键可用）
+DIMENSIONS = ["类型", "分类", "子分类", "账本", "账户1"]
+
+# 汇总粒度 -> (表名, 时间列)
+LEVELS = {"day": ("daily", "日期"), "month": ("monthly", "月份")}
+
+
+def default_rollup_path(ledger_path) -> Path:
+    """账本对应的汇总数据库路径：与账本同目录，如 data/ledger -> data/ledger_rollups.db"""
+    ledger_path = Path(ledger_path)
+    return ledger_path.parent / f"{ledger_path.stem}_rollups.db"
+
+
+def aggregate(bill_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    按 日期 × 类型 × 分类 × 子分类 × 账本 × 账户1 汇总账单。
+
+    参数:
+        - bill_df: 合并后的账单（紧凑表示或导出表示均可）
+
+    返回:
+        - pd.DataFrame: 列为 日期（YYYY-MM-DD）、月份（YYYY-MM）、各维度、金额_分（整数分）与 笔数
+    """
+    columns = ["日期", "月份", *DIMENSIONS, "金额_分", "笔数"]
+    if bill_df.empty:
+        return pd.DataFrame(columns=columns)
+    keys = {"日期": time_key(bill_df["账单时间"]).dt.normalize().to_numpy()}
+    for col in DIMENSIONS:
+        keys[col] = bill_df[col].to_numpy() if col in bill_df.columns else None
+    frame = pd.DataFrame(keys, index=bill_df.index).assign(金额_分=amount_fen(bill_df))
+    # 账单中只有少数几种取值，分组后再转换为字符串
+    daily = (
+        frame.groupby(["日期", *DIMENSIONS], observed=True, dropna=False, sort=False)["金额_分"]
+        .agg(["sum", "count"])
+        .reset_index()
+        .rename(columns={"sum": "金额_分", "count": "笔数"})
+    )
+    daily["日期"] = daily["日期"].dt.strftime("%Y-%m-%d")
+    daily["月份"] = daily["日期"].str[:7]
+    for col in DIMENSIONS:
+        daily[col] = daily[col].astype(object).where(daily[col].notna(), "")
+    return daily[columns]
+
+
+class RollupStore:
+    """
+    账本的预汇总表，保存在与账本同目录的 SQLite 数据库中：
+
+    - daily：日期 × 类型 × 分类 × 子分类 × 账本 × 账户1 的金额（分）与笔数；
+    - monthly：月份 × 同样的维度；
+    - partitions：各月份分区的记录数与更新时间。
+
+    新增的记录通过 add 累加到受影响的行上；修改或删除了已有记录时，用 rebuild / refresh 只重算受影响的月份。
+    报表查询直接读取汇总表，不需要扫描账本。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        dimensions = ", ".join(f'"{col}" TEXT NOT NULL' for col in DIMENSIONS)
+        key = ", ".join(f'"{col}"' for col in DIMENSIONS)
+        with self._conn:
+            for table, period in LEVELS.values():
+                self._conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {table} ("{period}" TEXT NOT NULL, {dimensions}, '
+                    f'"金额_分" INTEGER NOT NULL, "笔数" INTEGER NOT NULL, PRIMARY KEY ("{period}", {key}))'
+                )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS partitions ("月份" TEXT PRIMARY KEY, "笔数" INTEGER NOT NULL, updated_at REAL NOT NULL)'
+            )
+
+    def _upsert(self, daily: pd.DataFrame):
+        """将按日汇总的结果累加到 daily / monthly 表与分区记录"""
+        now = time.time()
+        monthly = daily.groupby(["月份", *DIMENSIONS], sort=False)[["金额_分", "笔数"]].sum().reset_index()
+        partitions = monthly.groupby("月份", sort=False)["笔数"].sum()
+        for table, period in LEVELS.values():
+            frame = daily if table == "daily" else monthly
+            columns = [period, *DIMENSIONS, "金额_分", "笔数"]
+            names = ", ".join(f'"{col}"' for col in columns)
+            key = ", ".join(f'"{col}"' for col in [period, *DIMENSIONS])
+            self._conn.executemany(
+                f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))}) "
+                f'ON CONFLICT ({key}) DO UPDATE SET "金额_分" = "金额_分" + excluded."金额_分", "笔数" = "笔数" + excluded."笔数"',
+                frame[columns].itertuples(index=False, name=None),
+            )
+        self._conn.executemany(
+            'INSERT INTO partitions VALUES (?, ?, ?) '
+            'ON CONFLICT ("月份") DO UPDATE SET "笔数" = "笔数" + excluded."笔数", updated_at = excluded.updated_at',
+            ((month, int(rows), now) for month, rows in partitions.items()),
+        )
+
+    def add(self, bill_df: pd.DataFrame) -> List[str]:
+        """
+        将新增的账单记录累加到汇总表（适用于只追加的导入），返回受影响的月份。
+        """
+        with get_metrics().timer("stage_seconds", stage="rollup", source="all"):
+            daily = aggregate(bill_df)
+            if daily.empty:
+                return []
+            with self._lock, self._conn:
+                self._upsert(daily)
+        return sorted(daily["月份"].unique())
+
+    def rebuild(self, bill_df: pd.DataFrame, months: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        用 bill_df 重算指定月份的汇总（先删除这些月份的旧数据），bill_df 中其他月份的记录被忽略。
+
+        参数:
+            - bill_df: 账单，至少包含指定月份的全部记录
+            - months: 需要重算的月份（YYYY-MM）；None 时清空并按 bill_df 全部重算
+
+        返回:
+            - 重算的月份
+        """
+        with get_metrics().timer("stage_seconds", stage="rollup", source="all"):
+            daily = aggregate(bill_df)
+            with self._lock, self._conn:
+                if months is None:
+                    months = sorted(daily["月份"].unique())
+                    for table in ("daily", "monthly", "partitions"):
+                        self._conn.execute(f"DELETE FROM {table}")
+                else:
+                    months = sorted(set(months))
+                    daily = daily[daily["月份"].isin(months)]
+                    for table, period in (*LEVELS.values(), ("partitions", "月份")):
+                        column = "substr(\"日期\", 1, 7)" if period == "日期" else '"月份"'
+                        self._conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", ((month,) for month in months))
+                if not daily.empty:
+                    self._upsert(daily)
+        return months
+
+    def refresh(self, ledger_path, months: Iterable[str]) -> List[str]:
+        """
+        从账本重新读取指定月份的记录并重算汇总。
+
+        按月分区的 Parquet 账本只读取 月份=YYYY-MM 对应的分区目录，SQLite 账本只查询这些月份的记录，
+        .csv 读取整个文件后筛选。
+        """
+        ledger_path = Path(ledger_path)
+        months = sorted(set(months))
+        if ledger_path.is_dir():
+            import_pyarrow()
+            frames = [
+                pd.read_parquet(ledger_path / f"月份={month}")
+                for month in months if (ledger_path / f"月份={month}").is_dir()
+            ]
+            bill_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["账单时间", "金额"])
+        elif ledger_path.suffix.lower() in (".db", ".sqlite"):
+            with sqlite3.connect(ledger_path) as conn:
+                bill_df = pd.read_sql(
+                    f'SELECT * FROM ledger WHERE substr("账单时间", 1, 7) IN ({", ".join("?" * len(months))})',
+                    conn, params=months,
+                )
+        elif ledger_path.suffix.lower() == ".csv":
+            bill_df = pd.read_csv(ledger_path, dtype={"账单时间": str}, keep_default_na=False, na_values=[""])
+            bill_df = bill_df[bill_df["账单时间"].str[:7].isin(months)]
+        else:
+            raise ValueError(f"Unsupported ledger for refresh: {ledger_path}")
+        return self.rebuild(bill_df, months)
+
+    def query(
+        self,
+        level: Literal["day", "month"] = "month",
+        by: Sequence[str] = ("分类",),
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        **filters,
+    ) -> pd.DataFrame:
+        """
+        查询汇总结果。
+
+        参数:
+            - level: 汇总粒度，"day" 或 "month"
+            - by: 分组维度，取自 类型 / 分类 / 子分类 / 账本 / 账户1，可为空（只按时间汇总）
+            - start / end: 时间范围（含两端），日粒度为 YYYY-MM-DD，月粒度为 YYYY-MM
+            - filters: 维度的过滤条件，如 类型="支出"、账户1="微信"
+
+        返回:
+            - pd.DataFrame: 列为 时间列（日期或月份）、各分组维度、金额（元）与 笔数
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level: {level}")
+        unknown = [col for col in [*by, *filters] if col not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown dimensions: {unknown}")
+        table, period = LEVELS[level]
+        groups = ", ".join(f'"{col}"' for col in [period, *by])
+        conditions, params = [], []
+        if start:
+            conditions.append(f'"{period}" >= ?')
+            params.append(start)
+        if end:
+            conditions.append(f'"{period}" <= ?')
+            params.append(end)
+        for col, value in filters.items():
+            conditions.append(f'"{col}" = ?')
+            params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f'SELECT {groups}, SUM("金额_分"), SUM("笔数") FROM {table} {where} GROUP BY {groups} ORDER BY {groups}'
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        result = pd.DataFrame(rows, columns=[period, *by, "金额_分", "笔数"])
+        result.insert(len(by) + 1, "金额", result.pop("金额_分") / 100)
+        return result
+
+    def income_expense(self, level: Literal["day", "month"] = "month", start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+        """各期的收入、支出（取绝对值）与结余"""
+        _, period = LEVELS[level]
+        totals = self.query(level, by=("类型",), start=start, end=end)
+        table = totals.pivot_table(index=period, columns="类型", values="金额", aggfunc="sum", fill_value=0)
+        result = pd.DataFrame({
+            "收入": table.get("收入", 0.0),
+            "支出": -table.get("支出", 0.0),
+        }, index=table.index)
+        result["结余"] = result["收入"] - result["支出"]
+        return result.reset_index()
+
+    def months(self) -> pd.DataFrame:
+        """已汇总的月份分区及其记录数、更新时间"""
+        with self._lock:
+            rows = self._conn.execute('SELECT "月份", "笔数", updated_at FROM partitions ORDER BY "月份"').fetchall()
+        return pd.DataFrame(rows, columns=["月份", "笔数", "updated_at"])
+
+    def clear(self):
+        with self._lock, self._conn:
+            for table in ("daily", "monthly", "partitions"):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        self._conn.close()
+
+
+# 汇总输出：与账本输出一起使用（TeeLedgerWriter），写入账本的每块数据同时累加到汇总表
+class RollupLedgerWriter(LedgerWriter):
+
+    def __init__(self, path, append=True):
+        super().__init__(path)
+        self.append = append
+        self.store: Optional[RollupStore] = None
+
+    def open(self):
+        self.store = RollupStore(self.path)
+        if not self.append:
+            self.store.clear()
+
+    def write(self, chunk: pd.DataFrame):
+        self.store.add(chunk)
+        self.rows += len(chunk)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
@@ -0,0 +1,338 @@
+import time
+import random
+import asyncio
+import threading
+import pandas as pd
+from tqdm import tqdm
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Literal, Optional, Tuple
+
+from intelli_classifier.cache import get_classification_cache
+from intelli_classifier.classifier import CategoryClassifier, get_classifier
+from intelli_classifier.embedding import classify_by_embedding
+from intelli_classifier.special_cases import get_special_case_matcher
+from utils.general import get_categories
+from utils.metrics import get_metrics
+
+
+class PipelineStats:
+    """异步分类流水线的运行统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.latencies: List[float] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def stop(self):
+        self.finished_at = time.perf_counter()
+
+    def record(self, latency: float):
+        """记录一次大模型分类请求的耗时（秒）"""
+        self.requests += 1
+        self.latencies.append(latency)
+
+    def percentile(self, q: float) -> float:
+        """请求耗时的分位数（秒），q 取值 0~100"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "elapsed": round(self.elapsed, 3),
+            "requests_per_second": round(self.requests_per_second, 2),
+            "latency_p50": round(self.percentile(50), 3),
+            "latency_p95": round(self.percentile(95), 3),
+        }
+
+
+# 获取进程内共享的事件循环，在后台线程中常驻运行。
+# 大模型客户端进程内共享，其连接池绑定在创建连接的事件循环上，所有异步请求都要提交到同一个循环
+@lru_cache(maxsize=None)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="classification-loop", daemon=True).start()
+    return loop
+
+
+class AsyncClassificationPipeline:
+    """
+    基于 asyncio 的并发分类流水线。
+
+    所有请求复用同一个大模型客户端，通过信号量限制同时在途的请求数，失败时指数退避重试；
+    待分类条目经由有界队列交给 worker，生产速度受下游消费速度约束。
+    未命中缓存的条目按收支类型攒批（满 batch_size 条或等待 linger 秒），以缓存键文本合并到一个提示词中请求大模型；
+    同一缓存键的并发请求只会向大模型发送一次。协程均在 get_event_loop() 的常驻循环中运行。
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        queue_size: Optional[int] = None,
+        batch_size: int = 20,
+        linger: float = 0.02,
+    ):
+        """
+        参数:
+        - llm: 大模型实例，默认使用共享的 Ollama 客户端
+        - max_concurrency (int): 同时在途的大模型请求上限
+        - max_retries (int): 单次请求失败后的最大重试次数
+        - backoff (float): 首次重试的等待时间（秒），之后每次翻倍
+        - queue_size (int | None): 待分类队列容量，默认为并发数的 4 倍
+        - batch_size (int): 每个提示词包含的条目数，1 表示逐条请求
+        - linger (float): 攒批的最长等待时间（秒）
+        """
+        self.classifier = CategoryClassifier(llm) if llm is not None else get_classifier()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue_size = queue_size or max_concurrency * 4
+        self.batch_size = batch_size
+        self.linger = linger
+        self.stats = PipelineStats()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # 收支类型 -> 攒批中的 (缓存键文本, future) 与定时发送的句柄
+        self._batches: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def _submit(self, cate: Literal["支出", "收入"], cache_text: str) -> asyncio.Future:
+        """将条目加入当前批次，返回在批次完成后得到分类结果（失败为 None）的 future"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._batches.setdefault(cate, [])
+        batch.append((cache_text, future))
+        if len(batch) >= self.batch_size:
+            self._flush(cate)
+        elif len(batch) == 1:
+            self._timers[cate] = loop.call_later(self.linger, self._flush, cate)
+        return future
+
+    def _flush(self, cate: Literal["支出", "收入"]):
+        """发送当前批次"""
+        timer = self._timers.pop(cate, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._batches.pop(cate, None)
+        if batch:
+            asyncio.ensure_future(self._query_batch(cate, batch))
+
+    async def _query_batch(self, cate: Literal["支出", "收入"], batch: List[Tuple[str, asyncio.Future]]):
+        """在并发上限内批量请求大模型并写入缓存，失败时退避重试，最终失败时各条目的结果为 None"""
+        texts = [cache_text for cache_text, _ in batch]
+        predictions = [None] * len(batch)
+        try:
+            categories = get_categories(cate)
+            for attempt in range(self.max_retries + 1):
+                async with self._semaphore:
+                    start = time.perf_counter()
+                    try:
+                        predictions = await self.classifier.aclassify_batch(texts, categories, 2, self.batch_size)
+                        self.stats.record(time.perf_counter() - start)
+                        break
+                    except Exception as e:
+                        if attempt == self.max_retries:
+                            self.stats.failures += 1
+                            print(f"Error in classification pipeline: {e}")
+                            return
+                self.stats.retries += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random() / 2))
+
+            cache = get_classification_cache()
+            for i, (cache_text, classify_result) in enumerate(zip(texts, predictions)):
+                # 如果二级分类是"其他", 则返回一级分类
+                if classify_result[1] == "其他":
+                    classify_result = [classify_result[0], ""]
+                cache.set(cache_text, cate, classify_result)
+                predictions[i] = classify_result
+        finally:
+            for (_, future), classify_result in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(classify_result)
+
+    async def classify(self, text: str, cate: Literal["支出", "收入"], key: Optional[str] = None) -> List[str]:
+        """
+        对单条文本进行分类，流程与 classify_consume_type 一致：特例池 -> 缓存 -> 大模型（以缓存键文本攒批请求）。
+        大模型多次重试仍失败时返回 ["其他", ""]，且不写入缓存。
+        """
+        metrics = get_metrics()
+        matched = get_special_case_matcher(cate).match(text)
+        if matched is not None:
+            metrics.inc("classified_total", method="rule", cate=cate)
+            return matched
+
+        cache = get_classification_cache()
+        cache_text = key or text
+        cached = cache.get(cache_text, cate)
+        if cached is not None:
+            metrics.inc("classified_total", method="cache", cate=cate)
+            return cached
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # 合并同一缓存键的并发请求
+        cache_key = cache.make_key(cache_text, cate)
+        future = self._inflight.get(cache_key)
+        if future is None:
+            future = self._submit(cate, cache_text)
+            self._inflight[cache_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        classify_result = await future
+        if not classify_result:
+            metrics.inc("classified_total", method="fallback", cate=cate)
+            return ["其他", ""]
+        metrics.inc("classified_total", method="llm", cate=cate)
+        return list(classify_result)
+
+    async def run(self, items: Iterable[Tuple[str, Literal["支出", "收入"], Optional[str]]], on_result: Optional[Callable] = None) -> List[List[str]]:
+        """
+        并发分类一组条目。
+
+        参数:
+        - items: (文本, 收支类型, 缓存键) 三元组的可迭代对象
+        - on_result (Callable | None): 每完成一条时调用的回调，可用于更新进度
+
+        返回:
+        - List[List[str]]: 与输入顺序一致的分类结果
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        results: Dict[int, List[str]] = {}
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    queue.task_done()
+                    return
+                index, (text, cate, key) = item
+                results[index] = await self.classify(text, cate, key)
+                queue.task_done()
+                if on_result:
+                    on_result()
+
+        self.stats.start()
+        # 每个请求可包含 batch_size 条，worker 数需足以填满所有在途的批次
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrency * self.batch_size)]
+        count = 0
+        for count, item in enumerate(items, start=1):
+            # 队列已满时等待，形成背压
+            await queue.put((count - 1, item))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        self.stats.stop()
+
+        return [results[i] for i in range(count)]
+
+    def classify_many(self, texts: List[str], cates: List[Literal["支出", "收入"]], keys: Optional[List[str]] = None, on_result: Optional[Callable] = None) -> List[List[str]]:
+        """run 的同步入口：提交到共享的事件循环并等待结果，on_result 在事件循环的线程中调用"""
+        keys = keys or [None] * len(texts)
+        future = asyncio.run_coroutine_threadsafe(self.run(zip(texts, cates, keys), on_result), get_event_loop())
+        return future.result()
+
+
+def classify_frame(
+    texts: pd.Series,
+    types: pd.Series,
+    keys: Optional[pd.Series] = None,
+    desc: Optional[str] = None,
+    max_concurrency: int = 4,
+    defer: bool = False,
+    classify: Optional[Callable[..., List[List[str]]]] = None,
+    progress: Optional[tqdm] = None,
+) -> pd.DataFrame:
+    """
+    对整列文本进行分类：先按收支类型整列匹配特例池，再查询缓存与向量索引，剩余的行交给异步分类流水线。
+
+    defer 为 True 时只使用特例池与缓存，不请求任何模型：剩余的行分类为 "待分类"，并加入延后分类队列
+    （见 intelli_classifier.deferred），由后台任务批量分类后回填账本。
+
+    参数:
+    - texts (pd.Series): 待分类文本
+    - types (pd.Series): 与 texts 对齐的收支类型
+    - keys (pd.Series | None): 与 texts 对齐的缓存键文本，默认使用 texts
+    - desc (str | None): 进度条描述
+    - max_concurrency (int): 同时在途的大模型请求上限
+    - defer (bool): 是否将未命中特例池与缓存的行延后分类
+    - classify (Callable | None): 请求大模型分类剩余行的函数，参数与 AsyncClassificationPipeline.classify_many 相同，
+      默认新建一个流水线；常驻服务传入共享流水线的入口，使其并发上限与请求合并对所有请求生效
+    - progress (tqdm | None): 共用的进度条（如逐块解析同一文件时），剩余行数累加到其总数上；默认每次调用新建
+
+    返回:
+    - pd.DataFrame: 与 texts 索引对齐，包含 "分类"、"子分类" 两列
+    """
+    keys = texts if keys is None else keys
+    metrics = get_metrics()
+    result = pd.DataFrame({"分类": None, "子分类": None}, index=texts.index, dtype=object)
+    for cate in ("支出", "收入"):
+        mask = types == cate
+        if mask.any():
+            result.loc[mask] = get_special_case_matcher(cate).match_series(texts[mask]).values
+            metrics.inc("classified_total", int(result.loc[mask, "分类"].notna().sum()), method="rule", cate=cate)
+
+    # 查询分类缓存，剩余的行尝试向量近邻快速分类（同一缓存键只查询一次）
+    cache = get_classification_cache()
+    for cate in ("支出", "收入"):
+        missing = result["分类"].isna() & (types == cate)
+        if not missing.any():
+            continue
+        labels = {key: cache.get(key, cate) for key in keys[missing].unique().tolist()}
+        pending = [] if defer else [key for key, label in labels.items() if label is None]
+        embedded = set()
+        for key, predicted in zip(pending, classify_by_embedding(pending, cate)):
+            if predicted is not None:
+                cache.set(key, cate, predicted, source="embedding")
+                labels[key] = predicted
+                embedded.add(key)
+        matched = keys[missing].map(labels).dropna()
+        if len(matched):
+            result.loc[matched.index, ["分类", "子分类"]] = matched.tolist()
+            by_embedding = int(keys[matched.index].isin(embedded).sum())
+            metrics.inc("classified_total", by_embedding, method="embedding", cate=cate)
+            metrics.inc("classified_total", len(matched) - by_embedding, method="cache", cate=cate)
+
+    missing = result["分类"].isna()
+    if missing.any() and defer:
+        from intelli_classifier.deferred import PENDING_CATEGORY, get_deferred_queue
+
+        get_deferred_queue().enqueue(zip(texts[missing], types[missing], keys[missing]))
+        result.loc[missing, ["分类", "子分类"]] = [PENDING_CATEGORY, ""]
+        for cate, count in types[missing].value_counts().items():
+            metrics.inc("classified_total", int(count), method="deferred", cate=cate)
+    elif missing.any():
+        classify = classify or AsyncClassificationPipeline(max_concurrency=max_concurrency).classify_many
+        with tqdm(total=0, desc=desc) if progress is None else nullcontext(progress) as progress:
+            progress.total += int(missing.sum())
+            progress.refresh()
+            classified = classify(
+                texts[missing].tolist(), types[missing].tolist(), keys[missing].tolist(), on_result=progress.update
+            )
+        result.loc[missing, ["分类", "子分类"]] = classified
+    return result
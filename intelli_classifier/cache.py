@@ -0,0 +1,176 @@
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from pathlib import Path
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Literal, Optional, Tuple
+
+from utils.general import CACHE_DIR, get_config_fingerprint
+from utils.metrics import get_metrics
+
+
+# 可作为向量索引样本的分类来源；向量索引自身的预测不参与构建，避免自我强化
+TRUSTED_SOURCES = ("rule", "llm", "manual")
+
+Source = Literal["rule", "llm", "manual", "embedding"]
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化商户/描述文本，得到缓存键使用的指纹文本。
+
+    统一全半角与大小写，合并标点和空白，并把订单号、流水号等长数字串替换为占位符，
+    使同一商户的不同交易得到相同的指纹。
+    """
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    text = re.sub(r"[\W_]+", " ", text)
+    text = re.sub(r"\d{6,}", "#", text)
+    return text.strip()
+
+
+class ClassificationCache:
+    """
+    基于 SQLite 的分类结果持久化缓存。
+
+    缓存键由归一化文本、收支类型以及分类配置指纹共同决定；类别树或提示词模板变化后，
+    旧版本的记录会在初始化时被清除。淘汰策略为 TTL 过期 + 按最近访问时间的 LRU。
+    每条记录标注分类来源（特例规则 / 大模型 / 人工 / 向量索引）。
+    """
+
+    def __init__(
+        self,
+        db_path: Path = CACHE_DIR / "classification.db",
+        max_entries: int = 200_000,
+        ttl: Optional[float] = 180 * 24 * 3600,
+        version: Optional[str] = None,
+    ):
+        """
+        参数:
+        - db_path (Path): 缓存数据库路径
+        - max_entries (int): 最大缓存条数，超出后按最近访问时间淘汰
+        - ttl (float | None): 缓存有效期（秒），None 表示永不过期
+        - version (str | None): 配置版本，默认使用 categories.json 与提示词模板的指纹
+        """
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = version or get_config_fingerprint()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS classification (
+                key TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                cate TEXT NOT NULL,
+                text TEXT NOT NULL,
+                category TEXT NOT NULL,
+                subcategory TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                source TEXT NOT NULL DEFAULT 'unknown'
+            )
+            """
+        )
+        # 早期的缓存没有来源列，补上后旧记录的来源为 unknown，不参与构建向量索引
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(classification)")}
+        if "source" not in columns:
+            self._conn.execute("ALTER TABLE classification ADD COLUMN source TEXT NOT NULL DEFAULT 'unknown'")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON classification (accessed_at)")
+        # 配置变化后旧结果全部失效
+        with self._lock:
+            self._conn.execute("DELETE FROM classification WHERE version != ?", (self.version,))
+        self.evict()
+
+    def make_key(self, text: str, cate: Literal["支出", "收入"]) -> str:
+        """生成缓存键"""
+        raw = f"{self.version}|{cate}|{normalize_text(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text: str, cate: Literal["支出", "收入"]) -> Optional[List[str]]:
+        """查询缓存，未命中或已过期时返回 None"""
+        key = self.make_key(text, cate)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT category, subcategory, created_at FROM classification WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                get_metrics().inc("cache_requests_total", result="miss")
+                return None
+            if self.ttl is not None and now - row[2] > self.ttl:
+                self._conn.execute("DELETE FROM classification WHERE key = ?", (key,))
+                get_metrics().inc("cache_requests_total", result="expired")
+                return None
+            self._conn.execute("UPDATE classification SET accessed_at = ? WHERE key = ?", (now, key))
+        get_metrics().inc("cache_requests_total", result="hit")
+        return [row[0], row[1]]
+
+    def set(self, text: str, cate: Literal["支出", "收入"], result: List[str], source: Source = "llm"):
+        """写入分类结果，source 为分类来源"""
+        key = self.make_key(text, cate)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO classification "
+                "(key, version, cate, text, category, subcategory, created_at, accessed_at, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, self.version, cate, str(text), result[0], result[1], now, now, source),
+            )
+            self._writes += 1
+            need_evict = self._writes % 1000 == 0
+        if need_evict:
+            self.evict()
+
+    def evict(self):
+        """清除过期记录，并在超出容量时淘汰最久未访问的记录"""
+        with self._lock:
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM classification WHERE created_at < ?", (time.time() - self.ttl,))
+            count = self._conn.execute("SELECT COUNT(*) FROM classification").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM classification WHERE key IN "
+                    "(SELECT key FROM classification ORDER BY accessed_at ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def items(
+        self, cate: Optional[Literal["支出", "收入"]] = None, sources: Optional[Iterable[Source]] = None
+    ) -> Iterator[Tuple[str, str, str, str]]:
+        """遍历当前版本的缓存记录，产出 (文本, 收支类型, 分类, 子分类)；sources 指定时只包含这些来源的记录"""
+        sql = "SELECT text, cate, category, subcategory FROM classification WHERE version = ?"
+        params = [self.version]
+        if cate:
+            sql += " AND cate = ?"
+            params.append(cate)
+        if sources is not None:
+            sources = list(sources)
+            sql += f" AND source IN ({', '.join('?' * len(sources))})"
+            params.extend(sources)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        yield from rows
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM classification")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM classification").fetchone()[0]
+
+
+@lru_cache(maxsize=None)
+def get_classification_cache() -> ClassificationCache:
+    """获取进程内共享的分类缓存实例"""
+    return ClassificationCache()
@@ -1,20 +1,74 @@
-from typing import List, Literal
-from langchain_core.language_models import BaseChatModel
-from langchain_core.output_parsers import StrOutputParser
-from langchain_ollama.llms import OllamaLLM
+import re
+import json
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Literal, Optional
 from jinja2 import Template
-from utils.general import ROOT, get_categories, get_special_cases, get_txt_content
+from intelli_classifier.cache import get_classification_cache, normalize_text
+from intelli_classifier.embedding import classify_by_embedding
+from intelli_classifier.special_cases import get_special_case_matcher
+from utils.general import OLLAMA_HOST, ROOT, get_categories, get_txt_content
+from utils.metrics import get_metrics
 
+# langchain 仅在真正请求大模型时才导入，只用特例规则与缓存分类时不加载
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+
+
+# 获取 Ollama 模型实例，相同参数复用同一个客户端及其连接池
+@lru_cache(maxsize=None)
+def get_ollama(model="qwen2.5:latest", base_url=OLLAMA_HOST):
+    from langchain_ollama.llms import OllamaLLM
 
-# 获取 Ollama 模型实例
-def get_ollama(model="qwen2.5:latest", base_url="http://localhost:11434"):
     return OllamaLLM(model=model, base_url=base_url)
 
 
 class CategoryClassifier:
-    def __init__(self, llm: BaseChatModel):
-        """初始化分类器"""
+    def __init__(self, llm: "BaseChatModel", batch_size: int = 20, mode: Literal["path", "recursive"] = "path"):
+        """
+        初始化分类器
+
+        参数:
+        - llm (BaseChatModel): 大模型实例
+        - batch_size (int): 批量分类时每个提示词包含的文本条数
+        - mode (str): 多层级分类方式，"path" 在一个提示词中给出全部 "分类/子分类" 路径、一次请求完成；
+          "recursive" 逐层请求
+        """
         self.llm = llm
+        self.batch_size = batch_size
+        self.mode = mode
+        from langchain_core.output_parsers import StrOutputParser
+
+        self._chain = llm | StrOutputParser()
+        # 提示词模板与类别路径在实例内只编译一次
+        self._template = Template(get_txt_content(ROOT / "prompts/classifier.jinja"))
+        self._path_template = Template(get_txt_content(ROOT / "prompts/path_classifier.jinja"))
+        self._batch_template = Template(get_txt_content(ROOT / "prompts/batch_classifier.jinja"))
+        self._paths: Dict[tuple, tuple] = {}
+
+    def _invoke(self, prompt: str, kind: str) -> str:
+        """请求大模型，记录请求耗时与失败次数"""
+        metrics = get_metrics()
+        start = time.perf_counter()
+        try:
+            return self._chain.invoke(prompt)
+        except Exception:
+            metrics.inc("llm_errors_total", kind=kind)
+            raise
+        finally:
+            metrics.observe("llm_request_seconds", time.perf_counter() - start, kind=kind)
+
+    async def _ainvoke(self, prompt: str, kind: str) -> str:
+        """_invoke 的异步版本"""
+        metrics = get_metrics()
+        start = time.perf_counter()
+        try:
+            return await self._chain.ainvoke(prompt)
+        except Exception:
+            metrics.inc("llm_errors_total", kind=kind)
+            raise
+        finally:
+            metrics.observe("llm_request_seconds", time.perf_counter() - start, kind=kind)
 
     def _llm_classifier_query(self, text: str, categories: List[dict]) -> str:
         """
@@ -32,10 +86,172 @@ class CategoryClassifier:
         返回:
         - class (str): 预测类别。
         """
-        jinja_template = Template(get_txt_content(ROOT / "prompts/classifier.jinja"))
-        prompt = jinja_template.render(text=text, categories=categories)
-        chain = self.llm | StrOutputParser()
-        return chain.invoke(prompt)
+        prompt = self._template.render(text=text, categories=categories)
+        return self._invoke(prompt, "level")
+
+    async def _allm_classifier_query(self, text: str, categories: List[dict]) -> str:
+        """_llm_classifier_query 的异步版本"""
+        prompt = self._template.render(text=text, categories=categories)
+        return await self._ainvoke(prompt, "level")
+
+    def _flatten_paths(self, categories: List[dict], max_depth: int) -> List[str]:
+        """将类别树展开为 "分类/子分类" 形式的叶子路径列表（按实例缓存）"""
+        key = (id(categories), max_depth)
+        if key not in self._paths:
+            paths = []
+
+            def walk(nodes, prefix, depth):
+                for node in nodes:
+                    path = prefix + [node["name"]]
+                    if node.get("children") and depth < max_depth:
+                        walk(node["children"], path, depth + 1)
+                    else:
+                        paths.append("/".join(path))
+
+            walk(categories, [], 1)
+            # 同时保存 categories 的引用，避免其被回收后 id 被复用
+            self._paths[key] = (categories, paths)
+        return self._paths[key][1]
+
+    def _resolve_path(self, predicted: str, categories: List[dict], max_depth: int) -> Optional[List[str]]:
+        """校验大模型返回的分类路径，无法对应到类别树时返回 None"""
+        parts = [part.strip() for part in predicted.strip().strip('"“”\'').split("/")]
+        if parts == ["其他"]:
+            return ["其他"] + [""] * (max_depth - 1)
+
+        result, nodes = [], categories
+        for depth, part in enumerate(parts[:max_depth], start=1):
+            node = self._get_category(nodes, part)
+            if not node:
+                if depth == 1:
+                    return None
+                # 子分类无效时与逐层预测一致，记为"其他"
+                return result + ["其他"] + [""] * (max_depth - depth)
+            result.append(part)
+            nodes = node.get("children") or []
+            if not nodes:
+                break
+        if nodes and len(result) < max_depth:
+            result.append("其他")
+        return result + [""] * (max_depth - len(result))
+
+    def _predict_path(self, text: str, categories: List[dict], max_depth: int) -> List[str]:
+        """一次请求预测完整分类路径，路径无效时回退为逐层预测"""
+        prompt = self._path_template.render(text=text, paths=self._flatten_paths(categories, max_depth))
+        resolved = self._resolve_path(self._invoke(prompt, "path"), categories, max_depth)
+        if resolved is None:
+            return self._predict_category(text, categories, 1, max_depth)
+        return resolved
+
+    async def _apredict_path(self, text: str, categories: List[dict], max_depth: int) -> List[str]:
+        """_predict_path 的异步版本"""
+        prompt = self._path_template.render(text=text, paths=self._flatten_paths(categories, max_depth))
+        resolved = self._resolve_path(await self._ainvoke(prompt, "path"), categories, max_depth)
+        if resolved is None:
+            return await self._apredict_category(text, categories, 1, max_depth)
+        return resolved
+
+    def _render_batch(self, texts: List[str], categories: List[dict]) -> str:
+        # 提示词中使用归一化后的文本（合并标点与空白、长数字串替换为占位符），减少每批的 token 数
+        return self._batch_template.render(texts=[normalize_text(text) for text in texts], categories=categories)
+
+    def _llm_batch_classifier_query(self, texts: List[str], categories: List[dict]) -> Dict[int, str]:
+        """
+        批量分类工具函数，将多条文本放入同一个提示词，要求大模型以 JSON 返回每条文本的类别。
+
+        参数:
+        - texts (List[str]): 待分类文本列表
+        - categories (list of dict): 分类类别列表（也可以是 "分类/子分类" 路径）
+
+        返回:
+        - Dict[int, str]: 文本序号 (从 0 开始) 到预测类别的映射，无法解析的条目不包含在内。
+        """
+        prompt = self._render_batch(texts, categories)
+        return self._parse_batch_response(self._invoke(prompt, "batch"), len(texts))
+
+    async def _allm_batch_classifier_query(self, texts: List[str], categories: List[dict]) -> Dict[int, str]:
+        """_llm_batch_classifier_query 的异步版本"""
+        prompt = self._render_batch(texts, categories)
+        return self._parse_batch_response(await self._ainvoke(prompt, "batch"), len(texts))
+
+    @staticmethod
+    def _parse_batch_response(response: str, count: int) -> Dict[int, str]:
+        """解析批量分类的 JSON 输出，兼容代码块包裹等常见格式"""
+        match = re.search(r"\{.*\}", response, re.S)
+        if not match:
+            return {}
+        try:
+            data = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+
+        predictions = {}
+        for key, value in data.items():
+            try:
+                index = int(str(key).strip("[] ")) - 1
+            except ValueError:
+                continue
+            if 0 <= index < count and isinstance(value, str):
+                predictions[index] = value.strip()
+        return predictions
+
+    def _batch_predict_level(self, texts: List[str], categories: List[dict], batch_size: int) -> List[str]:
+        """批量预测同一层级的类别，解析失败或类别无效的条目逐条回退"""
+        wrapped_categories = self._wrapper_category(categories)
+        valid_names = {category["name"] for category in categories} | {"其他"}
+
+        predictions = []
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start:start + batch_size]
+            answers = self._llm_batch_classifier_query(chunk, wrapped_categories) if len(chunk) > 1 else {}
+            for index, text in enumerate(chunk):
+                predicted = answers.get(index)
+                if predicted not in valid_names:
+                    predicted = self._llm_classifier_query(text, wrapped_categories)
+                predictions.append(predicted)
+        return predictions
+
+    async def _abatch_predict_level(self, texts: List[str], categories: List[dict], batch_size: int) -> List[str]:
+        """_batch_predict_level 的异步版本"""
+        wrapped_categories = self._wrapper_category(categories)
+        valid_names = {category["name"] for category in categories} | {"其他"}
+
+        predictions = []
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start:start + batch_size]
+            answers = await self._allm_batch_classifier_query(chunk, wrapped_categories) if len(chunk) > 1 else {}
+            for index, text in enumerate(chunk):
+                predicted = answers.get(index)
+                if predicted not in valid_names:
+                    predicted = await self._allm_classifier_query(text, wrapped_categories)
+                predictions.append(predicted)
+        return predictions
+
+    def _batch_predict_path(self, texts: List[str], categories: List[dict], max_depth: int, batch_size: int) -> List[List[str]]:
+        """批量预测完整分类路径，每批一次请求；解析失败或路径无效的条目逐条回退"""
+        paths = [{"name": path} for path in self._flatten_paths(categories, max_depth)]
+        results = []
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start:start + batch_size]
+            answers = self._llm_batch_classifier_query(chunk, paths) if len(chunk) > 1 else {}
+            for index, text in enumerate(chunk):
+                resolved = self._resolve_path(answers[index], categories, max_depth) if index in answers else None
+                results.append(resolved or self._predict_path(text, categories, max_depth))
+        return results
+
+    async def _abatch_predict_path(self, texts: List[str], categories: List[dict], max_depth: int, batch_size: int) -> List[List[str]]:
+        """_batch_predict_path 的异步版本"""
+        paths = [{"name": path} for path in self._flatten_paths(categories, max_depth)]
+        results = []
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start:start + batch_size]
+            answers = await self._allm_batch_classifier_query(chunk, paths) if len(chunk) > 1 else {}
+            for index, text in enumerate(chunk):
+                resolved = self._resolve_path(answers[index], categories, max_depth) if index in answers else None
+                results.append(resolved or await self._apredict_path(text, categories, max_depth))
+        return results
 
     def _wrapper_category(self, categories: List[dict]) -> List[dict]:
         """包装类别,只保留name字段"""
@@ -73,6 +289,24 @@ class CategoryClassifier:
             # 如果没有子类别,用空字符串填充剩余深度
             return [predicted] + [""] * (max_depth - current_depth)
 
+    async def _apredict_category(self, text: str, current_categories: List[dict], current_depth: int, max_depth: int) -> List[str]:
+        """_predict_category 的异步版本"""
+        if current_depth > max_depth or not current_categories:
+            return []
+
+        wrapped_categories = self._wrapper_category(current_categories)
+        predicted = await self._allm_classifier_query(text, wrapped_categories)
+
+        category = self._get_category(current_categories, predicted)
+        if not category:
+            return ["其他"] + [""] * (max_depth - current_depth)
+
+        if category.get("children"):
+            sub_categories = await self._apredict_category(text, category["children"], current_depth + 1, max_depth)
+            return [predicted] + sub_categories
+        else:
+            return [predicted] + [""] * (max_depth - current_depth)
+
     def classify(self, text: str, categories: List[dict], max_depth: int = 1) -> List[str]:
         """
         对文本进行多层级分类
@@ -85,32 +319,191 @@ class CategoryClassifier:
         返回:
         - List[str]: 分类结果列表
         """
+        if not categories:
+            return []
+        if self.mode == "path" and max_depth > 1:
+            return self._predict_path(text, categories, max_depth)
         return self._predict_category(text, categories, 1, max_depth)
 
+    async def aclassify(self, text: str, categories: List[dict], max_depth: int = 1) -> List[str]:
+        """classify 的异步版本，基于 ainvoke 请求大模型"""
+        if not categories:
+            return []
+        if self.mode == "path" and max_depth > 1:
+            return await self._apredict_path(text, categories, max_depth)
+        return await self._apredict_category(text, categories, 1, max_depth)
+
+    def classify_batch(self, texts: List[str], categories: List[dict], max_depth: int = 1, batch_size: Optional[int] = None) -> List[List[str]]:
+        """
+        批量进行多层级分类，将多条文本合并到同一个提示词中：mode 为 "path" 时每批一次请求给出完整分类路径，
+        否则每一层级一次请求。texts 宜使用缓存键文本（商户+商品描述），而非整行原始数据。
+
+        参数:
+        - texts (List[str]): 待分类文本列表
+        - categories (List[dict]): 类别列表
+        - max_depth (int): 最大分类深度
+        - batch_size (int | None): 每个提示词包含的文本条数，默认使用初始化时的配置
+
+        返回:
+        - List[List[str]]: 与 texts 一一对应的分类结果列表
+        """
+        batch_size = batch_size or self.batch_size
+        if self.mode == "path" and max_depth > 1 and categories:
+            return self._batch_predict_path(texts, categories, max_depth, batch_size)
+        results: List[List[str]] = [[] for _ in texts]
+        # 当前层级待预测的分组: (候选类别, 文本序号列表)
+        pending = [(categories, list(range(len(texts))))] if categories and texts else []
+
+        for depth in range(1, max_depth + 1):
+            next_pending = {}
+            for current_categories, indices in pending:
+                predictions = self._batch_predict_level([texts[i] for i in indices], current_categories, batch_size)
+                for i, predicted in zip(indices, predictions):
+                    category = self._get_category(current_categories, predicted)
+                    if not category:
+                        results[i] += ["其他"] + [""] * (max_depth - depth)
+                        continue
+                    results[i].append(predicted)
+                    if category.get("children") and depth < max_depth:
+                        next_pending.setdefault(predicted, (category["children"], []))[1].append(i)
+                    else:
+                        results[i] += [""] * (max_depth - depth)
+            pending = list(next_pending.values())
 
-def classify_consume_type(text: str, cate: Literal["支出", "收入"]) -> List[str]:
-    """对收入/支出类型进行分类"""
-    # 特例池定义 - 按类别和子类别组织
-    special_cases = get_special_cases(cate)
-    categories = get_categories(cate)
-    
+        return results
+
+    async def aclassify_batch(self, texts: List[str], categories: List[dict], max_depth: int = 1, batch_size: Optional[int] = None) -> List[List[str]]:
+        """classify_batch 的异步版本"""
+        batch_size = batch_size or self.batch_size
+        if self.mode == "path" and max_depth > 1 and categories:
+            return await self._abatch_predict_path(texts, categories, max_depth, batch_size)
+        results: List[List[str]] = [[] for _ in texts]
+        pending = [(categories, list(range(len(texts))))] if categories and texts else []
+
+        for depth in range(1, max_depth + 1):
+            next_pending = {}
+            for current_categories, indices in pending:
+                predictions = await self._abatch_predict_level([texts[i] for i in indices], current_categories, batch_size)
+                for i, predicted in zip(indices, predictions):
+                    category = self._get_category(current_categories, predicted)
+                    if not category:
+                        results[i] += ["其他"] + [""] * (max_depth - depth)
+                        continue
+                    results[i].append(predicted)
+                    if category.get("children") and depth < max_depth:
+                        next_pending.setdefault(predicted, (category["children"], []))[1].append(i)
+                    else:
+                        results[i] += [""] * (max_depth - depth)
+            pending = list(next_pending.values())
+
+        return results
+
+
+# 获取共享的分类器实例，相同参数复用同一条调用链与已编译的提示词模板
+@lru_cache(maxsize=None)
+def get_classifier(batch_size: int = 20, mode: Literal["path", "recursive"] = "path") -> CategoryClassifier:
+    return CategoryClassifier(get_ollama(), batch_size=batch_size, mode=mode)
+
+
+def classify_consume_type(text: str, cate: Literal["支出", "收入"], key: Optional[str] = None) -> List[str]:
+    """
+    对收入/支出类型进行分类
+
+    参数:
+    - text (str): 待分类文本
+    - cate (str): 收支类型
+    - key (str | None): 缓存键文本（通常为商户+商品描述），默认使用 text
+    """
     # 检查是否在特例池中
-    for category in special_cases:
-        # 检查是否有子类别
-        if "children" in category:
-            for child in category["children"]:
-                if any(case.lower() in text.lower() for case in child["cases"]):
-                    return [category["name"], child["name"]]
-        # 没有子类别的情况
-        elif "cases" in category:
-            if any(case.lower() in text.lower() for case in category["cases"]):
-                return [category["name"], ""]
-            
+    matched = get_special_case_matcher(cate).match(text)
+    metrics = get_metrics()
+    if matched is not None:
+        metrics.inc("classified_total", method="rule", cate=cate)
+        return matched
+
+    # 查询分类缓存
+    cache = get_classification_cache()
+    cache_text = key or text
+    cached = cache.get(cache_text, cate)
+    if cached is not None:
+        metrics.inc("classified_total", method="cache", cate=cate)
+        return cached
+
+    # 近邻样本一致时直接使用向量索引的分类
+    predicted = classify_by_embedding([cache_text], cate)[0]
+    if predicted is not None:
+        metrics.inc("classified_total", method="embedding", cate=cate)
+        cache.set(cache_text, cate, predicted, source="embedding")
+        return predicted
+
     # 不在特例池中,使用大模型分类
-    llm = get_ollama()
-    classifier = CategoryClassifier(llm)
-    classify_result = classifier.classify(text, categories, 2)
+    classify_result = get_classifier().classify(text, get_categories(cate), 2)
     # 如果二级分类是"其他", 则返回一级分类
     if classify_result[1] == "其他":
-        return [classify_result[0], ""]
+        classify_result = [classify_result[0], ""]
+    metrics.inc("classified_total", method="llm", cate=cate)
+    cache.set(cache_text, cate, classify_result)
     return classify_result
+
+
+def classify_consume_types(texts: List[str], cate: Literal["支出", "收入"], keys: Optional[List[str]] = None, batch_size: int = 20) -> List[List[str]]:
+    """
+    批量对同一收支类型的多条文本进行分类，未命中特例池与缓存的文本按商户去重后批量交给大模型。
+
+    参数:
+    - texts (List[str]): 待分类文本列表
+    - cate (str): 收支类型
+    - keys (List[str] | None): 与 texts 对应的缓存键文本，默认使用 texts
+    - batch_size (int): 每个提示词包含的文本条数
+
+    返回:
+    - List[List[str]]: 与 texts 一一对应的 [分类, 子分类] 列表
+    """
+    keys = keys or texts
+    metrics = get_metrics()
+    results = get_special_case_matcher(cate).match_many(texts)
+    metrics.inc("classified_total", sum(result is not None for result in results), method="rule", cate=cate)
+
+    # 查询分类缓存，同一缓存键只需要请求一次大模型
+    cache = get_classification_cache()
+    misses: Dict[str, List[int]] = {}
+    for i, result in enumerate(results):
+        if result is not None:
+            continue
+        cache_key = cache.make_key(keys[i], cate)
+        if cache_key not in misses:
+            cached = cache.get(keys[i], cate)
+            if cached is not None:
+                results[i] = cached
+                metrics.inc("classified_total", method="cache", cate=cate)
+                continue
+            misses[cache_key] = []
+        misses[cache_key].append(i)
+
+    # 近邻样本一致的文本直接使用向量索引的分类
+    if misses:
+        groups = list(misses.values())
+        predictions = classify_by_embedding([keys[group[0]] for group in groups], cate)
+        for group, predicted in zip(groups, predictions):
+            if predicted is None:
+                continue
+            cache.set(keys[group[0]], cate, predicted, source="embedding")
+            metrics.inc("classified_total", len(group), method="embedding", cate=cate)
+            for i in group:
+                results[i] = list(predicted)
+        misses = {k: group for k, group in misses.items() if results[group[0]] is None}
+
+    if misses:
+        groups = list(misses.values())
+        # 提示词中使用缓存键文本，而非多行的原始数据
+        predictions = get_classifier(batch_size).classify_batch([keys[group[0]] for group in groups], get_categories(cate), 2)
+        for group, classify_result in zip(groups, predictions):
+            # 如果二级分类是"其他", 则返回一级分类
+            if classify_result[1] == "其他":
+                classify_result = [classify_result[0], ""]
+            cache.set(keys[group[0]], cate, classify_result)
+            metrics.inc("classified_total", len(group), method="llm", cate=cate)
+            for i in group:
+                results[i] = list(classify_result)
+
+    return results
@@ -0,0 +1,202 @@
+import time
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from functools import lru_cache
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
+from intelli_classifier.cache import get_classification_cache
+from intelli_classifier.classifier import CategoryClassifier, get_classifier
+from utils.general import CACHE_DIR, get_categories
+from utils.metrics import get_metrics
+
+# 延后分类的记录在账本中的临时分类
+PENDING_CATEGORY = "待分类"
+
+
+class DeferredQueue:
+    """
+    延后分类的持久化工作队列（SQLite）。
+
+    - items：待大模型分类的条目，按分类缓存键去重（同一商户只请求一次），分类完成后保存结果；
+    - rows：账本中标记为待分类的记录（账单时间、金额、备注）及其缓存键，用于分类完成后回填账本。
+    """
+
+    def __init__(self, db_path: Path = CACHE_DIR / "deferred.db"):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                key TEXT PRIMARY KEY,
+                cate TEXT NOT NULL,
+                text TEXT NOT NULL,
+                cache_text TEXT NOT NULL,
+                category TEXT,
+                subcategory TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                enqueued_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS rows ("账单时间" TEXT NOT NULL, "金额_分" INTEGER NOT NULL, "备注" TEXT, key TEXT NOT NULL)'
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rows_key ON rows (key)")
+
+    def enqueue(self, items: Iterable[Tuple[str, Literal["支出", "收入"], str]]) -> int:
+        """加入 (文本, 收支类型, 缓存键文本) 条目，已在队列中的缓存键被忽略，返回新增的条数"""
+        cache = get_classification_cache()
+        now = time.time()
+        records = [(cache.make_key(key, cate), cate, str(text), str(key), now, now) for text, cate, key in items]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO items (key, cate, text, cache_text, enqueued_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def track(self, bill_df: pd.DataFrame, keys: pd.Series):
+        """
+        记录账本中待分类的行，分类完成后据此回填。
+
+        参数:
+            - bill_df: 规范化后的账单（账单时间为 "%Y-%m-%d %H:%M" 字符串，金额为元）
+            - keys: 与 bill_df 对齐的缓存键文本
+        """
+        cache = get_classification_cache()
+        amounts = np.rint(bill_df["金额"].astype(float).to_numpy() * 100).astype("int64")
+        records = [
+            (str(when), int(amount), note, cache.make_key(key, cate))
+            for when, amount, note, key, cate in zip(bill_df["账单时间"], amounts, bill_df["备注"], keys, bill_df["类型"])
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany('INSERT INTO rows VALUES (?, ?, ?, ?)', records)
+            self._conn.execute("COMMIT")
+
+    def pending(self, cate: Literal["支出", "收入"], limit: int) -> List[Tuple[str, str, str]]:
+        """取出尚未分类的条目 (缓存键, 文本, 缓存键文本)，失败次数少的优先"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, text, cache_text FROM items WHERE category IS NULL AND cate = ? "
+                "ORDER BY attempts, enqueued_at LIMIT ?",
+                (cate, limit),
+            ).fetchall()
+
+    def resolve(self, results: Dict[str, List[str]]):
+        """保存分类结果"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE items SET category = ?, subcategory = ?, error = NULL, updated_at = ? WHERE key = ?",
+                [(result[0], result[1], now, key) for key, result in results.items()],
+            )
+            self._conn.execute("COMMIT")
+
+    def fail(self, keys: Iterable[str], error: str):
+        """记录一次失败，条目保留在队列中等待重试"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE items SET attempts = attempts + 1, error = ?, updated_at = ? WHERE key = ?",
+                [(error, now, key) for key in keys],
+            )
+            self._conn.execute("COMMIT")
+
+    def resolutions(self) -> pd.DataFrame:
+        """已得到分类结果、等待回填账本的行：账单时间、金额_分、备注、分类、子分类"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT r.rowid, r."账单时间", r."金额_分", r."备注", i.category, i.subcategory FROM rows r '
+                "JOIN items i ON r.key = i.key WHERE i.category IS NOT NULL"
+            ).fetchall()
+        return pd.DataFrame(rows, columns=["rowid", "账单时间", "金额_分", "备注", "分类", "子分类"])
+
+    def forget(self, rowids: Iterable[int]):
+        """删除已回填的行，以及不再被任何行引用的已分类条目"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM rows WHERE rowid = ?", [(int(rowid),) for rowid in rowids])
+            self._conn.execute(
+                "DELETE FROM items WHERE category IS NOT NULL AND key NOT IN (SELECT key FROM rows)"
+            )
+            self._conn.execute("COMMIT")
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending, resolved, failing = self._conn.execute(
+                "SELECT COUNT(*) FILTER (WHERE category IS NULL), COUNT(*) FILTER (WHERE category IS NOT NULL), "
+                "COUNT(*) FILTER (WHERE category IS NULL AND attempts > 0) FROM items"
+            ).fetchone()
+            rows = self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+        return {"pending": pending, "resolved": resolved, "failing": failing, "rows": rows}
+
+    def __len__(self):
+        return self.stats()["pending"]
+
+
+@lru_cache(maxsize=None)
+def get_deferred_queue() -> DeferredQueue:
+    """获取进程内共享的延后分类队列"""
+    return DeferredQueue()
+
+
+def drain(queue: Optional[DeferredQueue] = None, llm=None, batch_size: int = 20, limit: Optional[int] = None) -> int:
+    """
+    批量请求大模型，分类队列中的条目，结果写入分类缓存与队列。
+
+    大模型请求失败时记录失败次数并停止本轮处理（条目保留在队列中，下次重试）。
+
+    参数:
+        - queue: 延后分类队列，默认使用共享实例
+        - llm: 大模型实例，默认使用共享的 Ollama 客户端
+        - batch_size: 每个提示词包含的文本条数
+        - limit: 本轮最多分类的条数，None 表示处理完队列
+
+    返回:
+        - 本轮完成分类的条数
+    """
+    queue = queue or get_deferred_queue()
+    classifier = CategoryClassifier(llm, batch_size=batch_size) if llm is not None else get_classifier(batch_size)
+    cache = get_classification_cache()
+    metrics = get_metrics()
+    resolved = 0
+    for cate in ("支出", "收入"):
+        while limit is None or resolved < limit:
+            size = batch_size * 5 if limit is None else min(batch_size * 5, limit - resolved)
+            items = queue.pending(cate, size)
+            if not items:
+                break
+            keys = [key for key, _, _ in items]
+            try:
+                predictions = classifier.classify_batch([cache_text for _, _, cache_text in items], get_categories(cate), 2)
+            except Exception as e:
+                queue.fail(keys, str(e))
+                metrics.inc("llm_errors_total", kind="deferred")
+                print(f"延后分类请求失败，稍后重试: {e}")
+                return resolved
+            results = {}
+            for (key, _, cache_text), classify_result in zip(items, predictions):
+                # 如果二级分类是"其他", 则返回一级分类
+                if classify_result[1] == "其他":
+                    classify_result = [classify_result[0], ""]
+                cache.set(cache_text, cate, classify_result)
+                results[key] = classify_result
+            queue.resolve(results)
+            metrics.inc("classified_total", len(results), method="llm", cate=cate)
+            resolved += len(results)
+    return resolved
@@ -0,0 +1,159 @@
+import json
+import numpy as np
+from pathlib import Path
+from functools import lru_cache
+from typing import List, Literal, Optional
+
+from intelli_classifier.cache import TRUSTED_SOURCES, ClassificationCache, get_classification_cache
+from utils.general import CACHE_DIR, OLLAMA_HOST, get_categories, get_config_fingerprint
+from utils.metrics import get_metrics
+
+
+# 获取 Ollama 向量模型实例，相同参数复用同一个客户端
+@lru_cache(maxsize=None)
+def get_ollama_embeddings(model="nomic-embed-text", base_url=OLLAMA_HOST):
+    from langchain_ollama import OllamaEmbeddings
+
+    return OllamaEmbeddings(model=model, base_url=base_url)
+
+
+class EmbeddingIndex:
+    """
+    向量近邻分类索引。
+
+    以已分类的商户文本与 categories.json 中的类别描述构建向量矩阵（NumPy，按行归一化），
+    查询时取余弦相似度 top-k 近邻加权投票：最近邻相似度不低于 threshold 且得票占比不低于
+    min_agreement 时直接给出分类，否则交给大模型。
+    """
+
+    def __init__(self, embeddings=None, k: int = 5, threshold: float = 0.85, min_agreement: float = 0.8):
+        """
+        参数:
+        - embeddings: 向量模型（需提供 embed_documents / embed_query），默认使用 Ollama
+        - k (int): 近邻个数
+        - threshold (float): 最近邻的最低余弦相似度
+        - min_agreement (float): 获胜分类在 k 个近邻中的最低加权得票占比
+        """
+        self.embeddings = embeddings or get_ollama_embeddings()
+        self.k = k
+        self.threshold = threshold
+        self.min_agreement = min_agreement
+        self.version = get_config_fingerprint()
+        self.texts: List[str] = []
+        self.labels: List[List[str]] = []  # [收支类型, 分类, 子分类]
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(self.embeddings.embed_documents(list(texts)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def add(self, texts: List[str], cate: Literal["支出", "收入"], labels: List[List[str]]):
+        """加入已分类的文本，labels 为与 texts 对应的 [分类, 子分类]"""
+        if not texts:
+            return
+        vectors = self._embed(texts)
+        self.matrix = vectors if not len(self.matrix) else np.vstack([self.matrix, vectors])
+        self.texts.extend(texts)
+        self.labels.extend([cate, *label] for label in labels)
+
+    def add_category_descriptions(self, cate: Literal["支出", "收入"]):
+        """将类别名称与描述作为种子样本加入索引"""
+        texts, labels = [], []
+        for category in get_categories(cate):
+            texts.append(f'{category["name"]}: {category.get("description", "")}'.rstrip(": "))
+            labels.append([category["name"], ""])
+            for child in category.get("children", []):
+                texts.append(f'{category["name"]}/{child["name"]}')
+                labels.append([category["name"], child["name"]])
+        self.add(texts, cate, labels)
+
+    @classmethod
+    def build(cls, cache: Optional[ClassificationCache] = None, batch_size: int = 256, **kwargs) -> "EmbeddingIndex":
+        """由分类缓存中特例规则、大模型与人工给出的分类和类别描述构建索引（不含向量索引自身的预测）"""
+        index = cls(**kwargs)
+        cache = cache or get_classification_cache()
+        for cate in ("支出", "收入"):
+            index.add_category_descriptions(cate)
+            rows = list(cache.items(cate, sources=TRUSTED_SOURCES))
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                index.add([row[0] for row in batch], cate, [[row[2], row[3]] for row in batch])
+        return index
+
+    def query(self, texts: List[str], cate: Literal["支出", "收入"]) -> List[Optional[List[str]]]:
+        """
+        批量查询近邻分类。
+
+        返回:
+        - List[Optional[List[str]]]: 与 texts 对应的 [分类, 子分类]，置信度不足的条目为 None
+        """
+        rows = np.array([label[0] == cate for label in self.labels], dtype=bool)
+        if not texts or not rows.any():
+            return [None] * len(texts)
+        candidates = np.flatnonzero(rows)
+        similarities = self._embed(texts) @ self.matrix[candidates].T
+
+        k = min(self.k, len(candidates))
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for i, neighbours in enumerate(top):
+            scores = similarities[i, neighbours]
+            if scores.max() < self.threshold:
+                results.append(None)
+                continue
+            votes = {}
+            for neighbour, score in zip(neighbours, scores):
+                label = tuple(self.labels[candidates[neighbour]][1:])
+                votes[label] = votes.get(label, 0.0) + max(float(score), 0.0)
+            label, weight = max(votes.items(), key=lambda item: item[1])
+            total = sum(votes.values())
+            results.append(list(label) if total and weight / total >= self.min_agreement else None)
+        return results
+
+    def save(self, path: Path = CACHE_DIR / "embedding_index.npz"):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {"version": self.version, "texts": self.texts, "labels": self.labels}
+        np.savez_compressed(path, matrix=self.matrix, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path: Path = CACHE_DIR / "embedding_index.npz", **kwargs) -> Optional["EmbeddingIndex"]:
+        """加载索引；文件不存在或分类配置已变化时返回 None"""
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            matrix = data["matrix"]
+        index = cls(**kwargs)
+        if meta["version"] != index.version:
+            return None
+        index.matrix, index.texts, index.labels = matrix, meta["texts"], meta["labels"]
+        return index
+
+
+@lru_cache(maxsize=None)
+def get_embedding_index() -> Optional[EmbeddingIndex]:
+    """获取已构建的向量索引，未构建时返回 None（此时不启用向量快速分类）"""
+    return EmbeddingIndex.load()
+
+
+def classify_by_embedding(texts: List[str], cate: Literal["支出", "收入"]) -> List[Optional[List[str]]]:
+    """使用向量索引批量分类；索引未构建或向量模型不可用时全部返回 None，交由大模型处理"""
+    index = get_embedding_index()
+    if index is None or not texts:
+        return [None] * len(texts)
+    try:
+        return index.query(texts, cate)
+    except Exception as e:
+        get_metrics().inc("embedding_errors_total")
+        print(f"Error in embedding classifier: {e}")
+        return [None] * len(texts)
+
+
+if __name__ == "__main__":
+    # 由分类缓存重建向量索引: python -m intelli_classifier.embedding
+    index = EmbeddingIndex.build()
+    index.save()
+    print(f"向量索引构建完成，共 {len(index.texts)} 条样本")
@@ -0,0 +1,136 @@
+import pandas as pd
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, List, Literal, Optional
+
+from utils.general import get_special_cases
+
+
+class SpecialCaseMatcher:
+    """
+    特例池匹配器。
+
+    将某一收支类型下的全部特例关键词编译为一个 Aho-Corasick 自动机，对每段文本只扫描一遍。
+    匹配优先级与原有逐条判断一致：按特例池中 (类别, 子类别) 的先后顺序取第一个命中的条目；
+    含子类别的类别只匹配子类别的关键词。
+    """
+
+    def __init__(self, special_cases: List[dict]):
+        """
+        参数:
+        - special_cases (List[dict]): 特例池定义，即 special_cases.json 中某一收支类型的列表
+        """
+        # 按优先级展开的 (类别, 子类别) 条目
+        self.entries: List[List[str]] = []
+        patterns = {}
+        for category in special_cases:
+            if "children" in category:
+                for child in category["children"]:
+                    self._add_entry(patterns, [category["name"], child["name"]], child.get("cases", []))
+            elif "cases" in category:
+                self._add_entry(patterns, [category["name"], ""], category["cases"])
+        self._build(patterns)
+
+    def _add_entry(self, patterns: dict, result: List[str], cases: List[str]):
+        priority = len(self.entries)
+        self.entries.append(result)
+        for case in cases:
+            case = case.lower()
+            # 同一关键词出现在多个条目中时，保留优先级最高（序号最小）的条目
+            if case and case not in patterns:
+                patterns[case] = priority
+
+    def _build(self, patterns: dict):
+        """构建 goto / fail 表，并沿失败链预先计算每个状态可命中的最高优先级"""
+        self._goto: List[dict] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[int]] = [None]
+
+        for pattern, priority in patterns.items():
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                state = nxt
+            self._out[state] = priority
+
+        # 不出现在任何关键词中的字符必然使自动机回到根状态
+        self._alphabet = frozenset(char for pattern in patterns for char in pattern)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                inherited = self._out[self._fail[nxt]]
+                if inherited is not None and (self._out[nxt] is None or inherited < self._out[nxt]):
+                    self._out[nxt] = inherited
+
+    def _search(self, text: str) -> Optional[int]:
+        """扫描已转为小写的文本，返回命中的最高优先级序号"""
+        goto, fail, out, alphabet = self._goto, self._fail, self._out, self._alphabet
+        best = None
+        state = 0
+        for char in text:
+            if char not in alphabet:
+                state = 0
+                continue
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            priority = out[state]
+            if priority is not None and (best is None or priority < best):
+                if priority == 0:
+                    return 0
+                best = priority
+        return best
+
+    def match(self, text: str) -> Optional[List[str]]:
+        """匹配单条文本，未命中时返回 None"""
+        priority = self._search(str(text).lower())
+        return None if priority is None else list(self.entries[priority])
+
+    def match_many(self, texts: Iterable[str]) -> List[Optional[List[str]]]:
+        """批量匹配，相同文本只扫描一次"""
+        seen = {}
+        results = []
+        for text in texts:
+            text = str(text).lower()
+            if text not in seen:
+                seen[text] = self._search(text)
+            priority = seen[text]
+            results.append(None if priority is None else list(self.entries[priority]))
+        return results
+
+    def match_series(self, texts: pd.Series) -> pd.DataFrame:
+        """
+        对整列文本进行匹配。
+
+        返回:
+        - pd.DataFrame: 与输入索引对齐，包含 "分类"、"子分类" 两列，未命中的行为 None
+        """
+        lowered = texts.astype(str).str.lower()
+        codes = {text: self._search(text) for text in lowered.unique()}
+        priorities = lowered.map(codes)
+        result = pd.DataFrame({"分类": None, "子分类": None}, index=texts.index, dtype=object)
+        hit = priorities.notna()
+        if hit.any():
+            matched = priorities[hit].astype(int)
+            result.loc[hit, "分类"] = [self.entries[p][0] for p in matched]
+            result.loc[hit, "子分类"] = [self.entries[p][1] for p in matched]
+        return result
+
+
+@lru_cache(maxsize=None)
+def get_special_case_matcher(cate: Literal["支出", "收入"]) -> SpecialCaseMatcher:
+    """获取编译好的特例池匹配器，每种收支类型只加载和编译一次"""
+    return SpecialCaseMatcher(get_special_cases(cate))
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import argparse
+import concurrent.futures
+from pathlib import Path
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional, Tuple
+
+import bill_parser
+from intelli_classifier.async_pipeline import AsyncClassificationPipeline, get_event_loop
+from intelli_classifier.cache import get_classification_cache
+from intelli_classifier.embedding import get_embedding_index
+from intelli_classifier.special_cases import get_special_case_matcher
+from utils.general import get_categories
+from utils.metrics import get_metrics
+
+
+class ClassificationService:
+    """
+    常驻的分类服务：类别树、特例规则自动机、分类缓存、向量索引与大模型客户端在启动时加载一次，供所有请求共享。
+
+    分类请求统一提交到后台线程中的事件循环，由同一个异步流水线处理：各客户端共享大模型并发上限，
+    同一缓存键的并发请求（即使来自不同客户端）只会向大模型发送一次。
+    """
+
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max_concurrency
+        self.started_at = time.time()
+        # 与进程内其他异步分类共用同一个事件循环，大模型客户端的连接池只绑定在这个循环上
+        self.loop = get_event_loop()
+        self.pipeline: Optional[AsyncClassificationPipeline] = None
+        self._parsers = {}
+
+    def start(self):
+        self.warm_up()
+        return self
+
+    def warm_up(self):
+        """预先加载规则、缓存、向量索引与大模型客户端"""
+        start = time.perf_counter()
+        for cate in ("支出", "收入"):
+            get_categories(cate)
+            get_special_case_matcher(cate)
+        get_classification_cache()
+        get_embedding_index()
+        self.pipeline = AsyncClassificationPipeline(max_concurrency=self.max_concurrency)
+        print(f"分类服务预热完成, 耗时 {time.perf_counter() - start:.2f}s")
+
+    def classify(self, items: List[Tuple[str, str, Optional[str]]]) -> Iterator[Tuple[int, List[str]]]:
+        """
+        分类一组 (文本, 收支类型, 缓存键)，按完成顺序产出 (序号, [分类, 子分类])。
+        特例规则与缓存命中的条目会立即返回，无需等待大模型。
+        """
+        futures = {
+            asyncio.run_coroutine_threadsafe(self.pipeline.classify(text, cate, key), self.loop): index
+            for index, (text, cate, key) in enumerate(items)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+
+    def classify_many(self, texts: List[str], cates: List[str], keys: List[Optional[str]], on_result=None) -> List[List[str]]:
+        """同步分类一组条目，返回与输入顺序一致的结果（参数与 AsyncClassificationPipeline.classify_many 相同）"""
+        results: List[Optional[List[str]]] = [None] * len(texts)
+        for index, result in self.classify(list(zip(texts, cates, keys))):
+            results[index] = result
+            if on_result:
+                on_result()
+        return results
+
+    def parse(self, file_path, bill_type: Optional[str] = None, chunksize: int = 5_000):
+        """
+        流式解析账单文件，逐块产出规范化并分类后的数据；未指定账单类型时按内容识别。
+
+        需要大模型分类的行经由 classify_many 交给共享的流水线，与 /classify 共用并发上限与请求合并。
+        """
+        bill_type = bill_type or bill_parser.detect_bill_type(file_path)
+        if bill_type is None:
+            raise ValueError(f"Unrecognized bill file: {file_path}")
+        if bill_type not in self._parsers:
+            self._parsers[bill_type] = bill_parser.get_parser_class(bill_type)()
+        yield from self._parsers[bill_type].iter_chunks(file_path, chunksize=chunksize, classify=self.classify_many)
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "uptime": round(time.time() - self.started_at, 1),
+            "cache_entries": len(get_classification_cache()),
+            "pipeline": self.pipeline.stats.summary() if self.pipeline else None,
+            "metrics": get_metrics().summary(),
+        }
+
+
+def make_handler(service: ClassificationService):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, lines: Iterator[str]):
+            """以分块传输编码逐行返回 NDJSON，处理过程中的错误作为最后一行返回"""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write(text: str):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                for line in lines:
+                    write(line)
+            except Exception as e:
+                write(json.dumps({"error": str(e)}, ensure_ascii=False) + "\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, service.health())
+            elif self.path == "/metrics":
+                data = get_metrics().to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+        def do_POST(self):
+            try:
+                body = self._read_json()
+            except ValueError as e:
+                self._send_json(400, {"error": f"Invalid JSON: {e}"})
+                return
+
+            if self.path == "/classify":
+                # {"items": [{"text": ..., "cate": "支出", "key": ...}, ...]}，单条时可直接传 {"text": ..., "cate": ...}
+                items = body["items"] if "items" in body else [body]
+                try:
+                    items = [(item["text"], item["cate"], item.get("key")) for item in items]
+                except (KeyError, TypeError) as e:
+                    self._send_json(400, {"error": f"Invalid item: {e}"})
+                    return
+                if any(cate not in ("支出", "收入") for _, cate, _ in items):
+                    self._send_json(400, {"error": 'cate must be "支出" or "收入"'})
+                    return
+                self._stream(
+                    json.dumps({"index": index, "分类": result[0], "子分类": result[1]}, ensure_ascii=False) + "\n"
+                    for index, result in service.classify(items)
+                )
+            elif self.path == "/parse":
+                # {"path": 本机上的账单文件路径, "bill_type": 可选, "chunksize": 可选}
+                path = Path(body.get("path", ""))
+                if not path.is_file():
+                    self._send_json(400, {"error": f"File not found: {path}"})
+                    return
+                chunksize = body.get("chunksize", 5_000)
+                if isinstance(chunksize, bool) or not str(chunksize).isdigit() or int(chunksize) <= 0:
+                    self._send_json(400, {"error": f"chunksize must be a positive integer: {chunksize!r}"})
+                    return
+                chunks = service.parse(path, body.get("bill_type"), int(chunksize))
+                self._stream(chunk.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n" for chunk in chunks)
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, unix_socket=None, max_concurrency: int = 4):
+    """启动分类服务（HTTP 或 Unix 域套接字），直到收到中断信号"""
+    service = ClassificationService(max_concurrency=max_concurrency).start()
+    handler = make_handler(service)
+    if unix_socket:
+        unix_socket = Path(unix_socket)
+        unix_socket.unlink(missing_ok=True)
+        server = ThreadingUnixHTTPServer(str(unix_socket), handler)
+        print(f"分类服务已启动: unix://{unix_socket}")
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        print(f"分类服务已启动: http://{host}:{server.server_address[1]}")
+    # SIGTERM 与 Ctrl+C 一样正常退出，清理套接字文件
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket:
+            unix_socket.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    # python server.py --port 8765
+    # curl -N localhost:8765/classify -d '{"items": [{"text": "美团外卖", "cate": "支出"}]}'
+    parser = argparse.ArgumentParser(description="常驻分类服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("BILLMATE_PORT", 8765)))
+    parser.add_argument("--unix", help="监听 Unix 域套接字路径（替代 HTTP 端口）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时在途的大模型请求上限")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.unix, args.concurrency)
@@ -1,11 +1,15 @@
-import chardet
+import os
+import hashlib
 import json
-import multiprocessing as mp
+import pandas as pd
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Callable, Dict, Generator, List, Literal
+from functools import lru_cache
+from typing import Generator, Iterable, Literal
 
 ROOT = Path(__file__).parents[1]
+# 运行时缓存目录与 Ollama 服务地址，可通过环境变量覆盖（基准测试使用独立的缓存与模拟服务）
+CACHE_DIR = Path(os.environ.get("BILLMATE_CACHE_DIR", ROOT / "cache"))
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
 
 
 def load_json(path: Path):
@@ -19,7 +23,9 @@ def get_txt_content(file_path):
         return f.read()
 
 
+@lru_cache(maxsize=None)
 def get_categories(cate: Literal["支出", "收入"]):
+    """获取收支类型下的类别树（进程内只加载一次，返回值为共享对象，请勿修改）"""
     categories = load_json(ROOT / "config/categories.json")
 
     def get_category_by_type(type: Literal["支出", "收入"]):
@@ -36,6 +42,15 @@ def get_special_cases(cate: Literal["支出", "收入"]):
     return special_cases[cate]
 
 
+def get_config_fingerprint() -> str:
+    """计算分类配置（类别树与提示词模板）的指纹，任一文件变化都会得到不同的值"""
+    sha = hashlib.sha256()
+    for path in [ROOT / "config/categories.json", *sorted((ROOT / "prompts").glob("*.jinja"))]:
+        sha.update(path.name.encode("utf-8"))
+        sha.update(path.read_bytes())
+    return sha.hexdigest()[:16]
+
+
 # 构建数据结构
 def build_data_structure(fields=None):
     default_fields = [
@@ -53,66 +68,32 @@ def build_data_structure(fields=None):
     return {field: [] for field in fields}
 
 
-# 获取文件数据第一行
-def find_table_start(file_path):
-    with open(file_path, "rb") as f:
-        for i, line in enumerate(f):
-            if "交易时间" in str(line):  # 根据某列名判断表头行
-                return i
-    return -1
-
-
-def detect_encoding(file_path):
-    with open(file_path, "rb") as f:
-        data = f.read(1024)
-        return chardet.detect(data)["encoding"] or "utf-8"  # 回退到 utf-8
-
-
-def find_table_start(file_path, encoding="auto", header_keyword="交易时间"):
+# 构建用于分类的行文本
+def build_row_texts(df):
     """
-    查找表头所在的行号。
+    将每行原始数据按 "列名    值" 逐行拼接为文本，作为分类依据（整列运算，跳过 Unnamed 列）。
 
     参数:
-        - file_path: 文件路径
-        - encoding: 文件编码 ("auto" 表示自动检测)
-        - header_keyword: 表头的关键字，用于判断表头行
+        - df: 原始账单数据
 
     返回:
-        - 表头行号 (0-based)，如果未找到返回 -1
-    """
-    # 自动检测编码
-    if encoding == "auto":
-        encoding = detect_encoding(file_path)
-
-    try:
-        with open(file_path, "r", encoding=encoding, errors="ignore") as f:
-            for i, line in enumerate(f):
-                if header_keyword in line:  # 判断表头关键字是否在当前行
-                    return i
-    except Exception as e:
-        print(f"Error reading file: {e}")
-
-    return -1
-
-
-def run_in_thread_pool(func: Callable, params: List[Dict]) -> Generator:
-    """
-    使用线程池并发执行函数。
-
-    Args:
-        func (Callable): 要并发执行的函数。
-        params (List[Dict]): 函数的参数列表。
-
-    Returns:
-        Generator: 函数执行结果的生成器。
+        - pd.Series: 与 df 索引对齐的文本列，没有可用的列时为空字符串
     """
-    max_workers = min(mp.cpu_count(), len(params))
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        tasks = [executor.submit(func, **param) for param in params]
-
-        for task in as_completed(tasks):
-            try:
-                yield task.result()
-            except Exception as e:
-                print(f"Error in thread pool: {e}")
+    columns = [col for col in df.columns if not str(col).startswith("Unnamed")]
+    if not columns:
+        return pd.Series("", index=df.index, dtype=str)
+    texts = f"{columns[0]}    " + df[columns[0]].astype(str).str.strip()
+    for col in columns[1:]:
+        texts = texts + f"\n{col}    " + df[col].astype(str).str.strip()
+    return texts
+
+
+def drop_last_row(chunks: Iterable) -> Generator:
+    """逐块产出数据，并去掉最后一块的最后一行（如银行账单末尾的合计行）"""
+    previous = None
+    for chunk in chunks:
+        if previous is not None:
+            yield previous
+        previous = chunk
+    if previous is not None:
+        yield previous.iloc[:-1]
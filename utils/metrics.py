@@ -0,0 +1,251 @@
+import io
+import json
+import time
+import pstats
+import bisect
+import cProfile
+import threading
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    """转义 Prometheus 标签值中的反斜杠、双引号与换行"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """累计分桶直方图，与 Prometheus 的 histogram 语义一致"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+    def merge(self, data: dict):
+        if tuple(data["buckets"]) != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, data["counts"])]
+        self.sum += data["sum"]
+        self.count += data["count"]
+
+
+class Metrics:
+    """
+    进程内的指标注册表：计数器与直方图，按名称 + 标签区分。
+
+    解析器、分类器与合并器在关键路径上记录各阶段耗时、缓存命中、分类来源、大模型请求耗时与被过滤的行数，
+    结果可导出为 JSON 或 Prometheus 文本格式。子进程中的指标通过 snapshot / merge 汇总到主进程。
+    """
+
+    def __init__(self, prefix: str = "billmate"):
+        self.prefix = prefix
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器加 value"""
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=DEFAULT_BUCKETS, **labels):
+        """向直方图记录一个观测值"""
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """记录代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed_iter(self, iterable: Iterable, name: str, **labels) -> Iterator:
+        """逐个产出 iterable 的元素，并记录每次取出元素的耗时（用于按块读取的迭代器）"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - start, **labels)
+            yield item
+
+    def value(self, name: str, **labels) -> float:
+        """计数器的值；未指定的标签会被汇总"""
+        wanted = set(_labels(labels))
+        return sum(v for key, v in self.counters.get(name, {}).items() if wanted <= set(key))
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self) -> dict:
+        """可序列化的原始数据，用于跨进程汇总"""
+        with self._lock:
+            return {
+                "counters": {
+                    name: [[dict(key), value] for key, value in series.items()] for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [[dict(key), histogram.to_dict()] for key, histogram in series.items()]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def merge(self, snapshot: Optional[dict]):
+        """合并其他进程的 snapshot"""
+        if not snapshot:
+            return
+        for name, series in snapshot["counters"].items():
+            for labels, value in series:
+                self.inc(name, value, **labels)
+        with self._lock:
+            for name, series in snapshot["histograms"].items():
+                for labels, data in series:
+                    key = _labels(labels)
+                    target = self.histograms.setdefault(name, {})
+                    if key not in target:
+                        target[key] = Histogram(data["buckets"])
+                    target[key].merge(data)
+
+    def summary(self) -> dict:
+        """常用的派生指标：缓存命中率、各分类来源的占比、各阶段总耗时"""
+        hits = self.value("cache_requests_total", result="hit")
+        lookups = self.value("cache_requests_total")
+        classified = self.value("classified_total")
+        methods = {dict(key).get("method") for key in self.counters.get("classified_total", {})}
+        stages = {}
+        for key, histogram in self.histograms.get("stage_seconds", {}).items():
+            stage = dict(key).get("stage")
+            stages[stage] = round(stages.get(stage, 0.0) + histogram.sum, 4)
+        return {
+            "cache_hit_rate": round(hits / lookups, 4) if lookups else None,
+            "classified": {
+                method: {"rows": self.value("classified_total", method=method),
+                         "ratio": round(self.value("classified_total", method=method) / classified, 4)}
+                for method in sorted(methods)
+            },
+            "stage_seconds": stages,
+            "dropped_rows": self.value("dropped_rows_total"),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps({"summary": self.summary(), **self.snapshot()}, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        def fmt(key: Labels, extra: Labels = ()) -> str:
+            pairs = [*key, *extra]
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} counter")
+                lines.extend(f"{metric}{fmt(key)} {value:g}" for key, value in sorted(series.items()))
+            for name, series in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip([*histogram.buckets, "+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{fmt(key, (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{metric}_sum{fmt(key)} {histogram.sum:g}")
+                    lines.append(f"{metric}_count{fmt(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """按后缀保存：.prom / .txt 为 Prometheus 文本格式，其余为 JSON"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        content = self.to_prometheus() if path.suffix in (".prom", ".txt") else self.to_json()
+        path.write_text(content, encoding="utf-8")
+
+
+# 进程内共享的指标注册表
+METRICS = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return METRICS
+
+
+@contextmanager
+def profile(output_dir=None, cpu: bool = True, memory: bool = False, top: int = 20):
+    """
+    可选的性能剖析：cProfile 统计函数耗时，tracemalloc 统计内存分配位置。
+
+    参数:
+        - output_dir: 结果目录，保存 profile.pstats 与 tracemalloc.txt；None 时只打印摘要
+        - cpu: 是否启用 cProfile
+        - memory: 是否启用 tracemalloc
+        - top: 摘要中列出的条目数
+    """
+    profiler = cProfile.Profile() if cpu else None
+    if memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        if memory:
+            # 先取内存快照，避免统计到输出结果本身的分配
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        output_dir = Path(output_dir) if output_dir else None
+        if output_dir:
+            output_dir.mkdir(parents=True, exist_ok=True)
+        if profiler:
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream).sort_stats("cumulative")
+            stats.print_stats(top)
+            print(stream.getvalue())
+            if output_dir:
+                stats.dump_stats(output_dir / "profile.pstats")
+        if memory:
+            lines = [f"当前分配 {current / 1024 / 1024:.1f} MB, 峰值 {peak / 1024 / 1024:.1f} MB"]
+            lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:top])
+            print("\n".join(lines))
+            if output_dir:
+                (output_dir / "tracemalloc.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
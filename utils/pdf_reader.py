@@ -0,0 +1,148 @@
+import os
+import hashlib
+import unicodedata
+import multiprocessing as mp
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from utils.general import CACHE_DIR
+from utils.metrics import get_metrics
+
+# 提取逻辑变化时递增，使旧的缓存失效
+EXTRACT_VERSION = "1"
+
+# 表格线不完整的页面改用文字位置推断单元格
+TEXT_TABLE_SETTINGS = {"vertical_strategy": "text", "horizontal_strategy": "text"}
+
+
+def is_pdf(file_path) -> bool:
+    """按文件头判断是否为 PDF"""
+    with open(file_path, "rb") as f:
+        return f.read(5) == b"%PDF-"
+
+
+def normalize_pdf_text(text: str) -> str:
+    """统一全半角并去除空白（PDF 中的表头常被折行或以全角括号书写）"""
+    return "".join(unicodedata.normalize("NFKC", text).split())
+
+
+def pdf_errors() -> tuple:
+    """pdfplumber / pdfminer 解析损坏的 PDF 时抛出的异常类型"""
+    from pdfminer.psparser import PSException
+    from pdfplumber.utils.exceptions import MalformedPDFException, PdfminerException
+
+    return PdfminerException, MalformedPDFException, PSException
+
+
+def read_pdf_text(file_path, pages: int = 1) -> str:
+    """提取 PDF 前几页的文字，用于识别账单来源"""
+    import pdfplumber
+
+    with pdfplumber.open(file_path) as pdf:
+        return "\n".join(page.extract_text() or "" for page in pdf.pages[:pages])
+
+
+def _clean_cell(cell) -> str:
+    # 单元格内折行的文字（如较长的对方户名）拼接为一行
+    return "" if cell is None else "".join(str(cell).splitlines()).strip()
+
+
+def extract_pages(file_path, start: int, stop: int) -> List[List[str]]:
+    """
+    提取第 [start, stop) 页中所有表格的行，可在子进程中执行。
+
+    优先按表格线识别单元格，页面中没有带线的表格时按文字位置识别。
+    """
+    import pdfplumber
+
+    rows = []
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[start:stop]:
+            tables = page.extract_tables() or page.extract_tables(TEXT_TABLE_SETTINGS)
+            for table in tables:
+                rows.extend([_clean_cell(cell) for cell in row] for row in table)
+            # 释放已解析页面的对象，长账单的内存占用与页数无关
+            page.close()
+    return rows
+
+
+def _build_table(rows: List[List[str]], header_keyword: str) -> pd.DataFrame:
+    """以首个包含关键字的行为表头组装表格，跳过表头之前的内容与各页重复的表头"""
+    keyword = normalize_pdf_text(header_keyword)
+    for index, row in enumerate(rows):
+        if any(normalize_pdf_text(cell) == keyword for cell in row):
+            break
+    else:
+        raise ValueError(f"Header keyword '{header_keyword}' not found in PDF tables")
+
+    header = [normalize_pdf_text(cell) for cell in rows[index]]
+    width = len(header)
+    records = []
+    for row in rows[index + 1:]:
+        if [normalize_pdf_text(cell) for cell in row] == header or not any(row):
+            continue
+        records.append((row + [""] * width)[:width])
+    return pd.DataFrame(records, columns=header)
+
+
+def read_pdf_table(
+    file_path,
+    header_keyword: str = "交易日期",
+    max_workers: Optional[int] = None,
+    pages_per_task: int = 8,
+    cache_dir=CACHE_DIR / "pdf_tables",
+) -> pd.DataFrame:
+    """
+    提取 PDF 账单中的交易表格。
+
+    页面按 pages_per_task 分组交给进程池并行提取，结果按页序拼接；提取出的表格按 PDF 内容哈希缓存，
+    同一文件再次导入时直接读取缓存。
+
+    参数:
+        - file_path: PDF 文件路径
+        - header_keyword: 表头的关键字，用于判断表头行
+        - max_workers: 并行提取的进程数，默认为 CPU 核数；页数不超过 pages_per_task 时在当前进程中提取。
+          已在子进程中（如批量导入时每个文件一个进程）时默认在当前进程中提取，避免进程数相乘
+        - pages_per_task: 每个任务提取的页数
+        - cache_dir: 缓存目录，None 表示不缓存
+
+    返回:
+        - pd.DataFrame: 列名为规范化后的表头（去除空白、全角括号转为半角），值均为字符串
+    """
+    metrics = get_metrics()
+    file_path = Path(file_path)
+    cache_path = None
+    if cache_dir is not None:
+        digest = hashlib.sha256(file_path.read_bytes()).hexdigest()
+        cache_path = Path(cache_dir) / f"{digest}-{EXTRACT_VERSION}.pkl"
+        if cache_path.exists():
+            metrics.inc("pdf_cache_total", result="hit")
+            return pd.read_pickle(cache_path)
+        metrics.inc("pdf_cache_total", result="miss")
+
+    import pdfplumber
+
+    with metrics.timer("stage_seconds", stage="extract", source="pdf"):
+        with pdfplumber.open(file_path) as pdf:
+            pages = len(pdf.pages)
+        ranges = [(start, min(start + pages_per_task, pages)) for start in range(0, pages, pages_per_task)]
+        if max_workers is None:
+            max_workers = 1 if mp.parent_process() is not None else os.cpu_count()
+        workers = min(max_workers or 1, len(ranges))
+        if workers > 1:
+            # spawn 方式启动子进程，避免继承父进程中的数据库连接与模型客户端
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as executor:
+                parts = list(executor.map(extract_pages, *zip(*[(file_path, start, stop) for start, stop in ranges])))
+        else:
+            parts = [extract_pages(file_path, start, stop) for start, stop in ranges]
+        metrics.inc("pdf_pages_total", pages)
+        df = _build_table([row for part in parts for row in part], header_keyword)
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        df.to_pickle(tmp)
+        tmp.replace(cache_path)
+    return df
@@ -0,0 +1,181 @@
+import io
+import mmap
+import codecs
+import chardet
+import pandas as pd
+from pathlib import Path
+
+# 带 BOM 的编码，按前缀长度从长到短匹配
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# chardet 常把 GBK 文件识别为其子集，统一使用兼容的超集解码
+ENCODING_ALIASES = {
+    "gb2312": "gb18030",
+    "gbk": "gb18030",
+    "ascii": "utf-8",
+}
+
+
+def sniff_encoding(sample: bytes) -> str:
+    """依据 BOM 或内容识别编码"""
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    encoding = (chardet.detect(sample)["encoding"] or "utf-8").lower()
+    return ENCODING_ALIASES.get(encoding, encoding)
+
+
+def read_head(file_path, size=16 * 1024) -> str:
+    """读取并解码文件开头的 size 个字节，用于识别账单来源"""
+    with open(file_path, "rb") as f:
+        sample = f.read(size)
+    return sample.decode(sniff_encoding(sample), errors="ignore")
+
+
+class ChainedStream(io.RawIOBase):
+    """将若干字节片段（如修补后的表头 + 原文件内存映射的剩余部分）串联为一个只读流，不复制数据"""
+
+    def __init__(self, *parts):
+        self.parts = [memoryview(part) for part in parts if len(part)]
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.parts and not len(self.parts[0]):
+            self.parts.pop(0).release()
+        if not self.parts:
+            return 0
+        part = self.parts[0]
+        size = min(len(buffer), len(part))
+        buffer[:size] = part[:size]
+        self.parts[0] = part[size:]
+        part.release()
+        return size
+
+    def close(self):
+        # 释放对内存映射的引用，之后映射才能关闭
+        for part in self.parts:
+            part.release()
+        self.parts = []
+        super().close()
+
+
+class BillTable:
+    """
+    账单表格读取器：每个文件只打开一次。
+
+    通过内存映射读取文件，依据 BOM 或文件开头的内容识别编码，按关键字定位表头行，
+    再把从表头开始的偏移视图交给 pandas，无需再次读取文件。
+    """
+
+    def __init__(self, file_path, header_keyword="交易时间", fix_trailing_comma=False, sniff_size=16 * 1024):
+        """
+        参数:
+            - file_path: 文件路径
+            - header_keyword: 表头的关键字，用于判断表头行
+            - fix_trailing_comma: 表头行末尾缺少逗号时（数据行末尾均有逗号）在流中补齐
+            - sniff_size: 用于识别编码的字节数
+        """
+        self.file_path = Path(file_path)
+        self._streams = []
+        self._file = open(self.file_path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            self._file.close()
+            raise ValueError(f"Empty bill file: {self.file_path}")
+
+        self.encoding = self._sniff_encoding(sniff_size)
+        self.header_offset, self.header_end = self._find_header(header_keyword)
+        self.fix_trailing_comma = fix_trailing_comma
+
+    def _sniff_encoding(self, sniff_size) -> str:
+        return sniff_encoding(self._mm[:sniff_size])
+
+    def _find_header(self, header_keyword):
+        """
+        返回表头行的起止字节偏移。
+
+        chardet 可能把表头前的少量字节误判为单字节编码（如 Latin-1），关键字无法以该编码表示或找不到时
+        依次改用 gb18030、utf-8 查找，找到时以该编码读取整个文件。
+        """
+        if self.encoding.startswith("utf-16"):
+            raise ValueError(f"UTF-16 bill files are not supported: {self.file_path}")
+        # 关键字编码时不能带 BOM
+        sniffed = "utf-8" if self.encoding == "utf-8-sig" else self.encoding
+        for encoding in dict.fromkeys([sniffed, "gb18030", "utf-8"]):
+            try:
+                position = self._mm.find(header_keyword.encode(encoding))
+            except UnicodeEncodeError:
+                continue
+            if position >= 0:
+                break
+        else:
+            raise ValueError(f"Header keyword '{header_keyword}' not found in {self.file_path}")
+        if encoding != sniffed:
+            self.encoding = encoding
+        start = self._mm.rfind(b"\n", 0, position) + 1
+        end = self._mm.find(b"\n", position)
+        return start, len(self._mm) if end < 0 else end + 1
+
+    def stream(self) -> io.BufferedReader:
+        """从表头行开始的只读流"""
+        header = self._mm[self.header_offset:self.header_end]
+        if self.fix_trailing_comma:
+            line = header.rstrip(b"\r\n")
+            if not line.endswith(b","):
+                header = line + b",\n"
+        with memoryview(self._mm) as data:
+            body = data[self.header_end:]
+        stream = io.BufferedReader(ChainedStream(header, body))
+        self._streams.append(stream)
+        return stream
+
+    def read_csv(self, chunksize=None, **kwargs):
+        """读取表格，指定 chunksize 时返回逐块读取的生成器，读取结束后释放文件"""
+        kwargs = {"encoding": self.encoding, "encoding_errors": "ignore", **kwargs}
+        if chunksize is None:
+            try:
+                return pd.read_csv(self.stream(), **kwargs)
+            finally:
+                self.close()
+        return self._iter_csv(chunksize, kwargs)
+
+    def _iter_csv(self, chunksize, kwargs):
+        try:
+            with pd.read_csv(self.stream(), chunksize=chunksize, **kwargs) as reader:
+                yield from reader
+        finally:
+            self.close()
+
+    def close(self):
+        for stream in self._streams:
+            stream.close()
+        self._streams = []
+        if not self._mm.closed:
+            self._mm.close()
+        self._file.close()
+
+
+def read_bill_table(file_path, header_keyword="交易时间", chunksize=None, fix_trailing_comma=False, **kwargs):
+    """
+    读取账单表格（编码识别、表头定位与读取共用一次文件打开）。
+
+    参数:
+        - file_path: 文件路径
+        - header_keyword: 表头的关键字
+        - chunksize: 每块读取的行数，None 表示一次读取全部
+        - fix_trailing_comma: 是否在流中为表头行补齐末尾逗号
+        - kwargs: 传给 pd.read_csv 的其他参数
+
+    返回:
+        - pd.DataFrame，或指定 chunksize 时为逐块读取的生成器
+    """
+    table = BillTable(file_path, header_keyword=header_keyword, fix_trailing_comma=fix_trailing_comma)
+    return table.read_csv(chunksize=chunksize, **kwargs)